@@ -0,0 +1,318 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+import click
+
+DEFAULT_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_BASELINE = os.path.join(DEFAULT_PROJECT_ROOT, "benchmarks", "baseline.json")
+
+# Benchmark the tree this script belongs to, even if lrp is not installed
+sys.path.insert(0, os.path.join(DEFAULT_PROJECT_ROOT, "src"))
+import lrp
+from lrp.message import Message, DIO, RREP, RERR, RREQ
+from lrp.replay import ReplayLrpProcess
+from lrp.simulation import Simulation, random_topology
+from lrp.tools import Address, Subnet, RoutingTable, DEFAULT_ROUTE
+
+ROUTING_TABLE_SIZES = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5)
+CONVERGENCE_SIZES = (100, 500)
+
+# name -> function returning the time of one operation, in s
+BENCHMARKS = {}
+
+logger = logging.getLogger("benchmarks")
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+def time_per_op(function, repeat: int = 5) -> float:
+    """Return the best time of one call of `function`, in s, over `repeat`
+    runs of at least 0.2s."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def addresses(count: int):
+    """Return `count` distinct host addresses."""
+    return [Address(b"\x0a" + i.to_bytes(3, "big")) for i in range(1, count + 1)]
+
+
+def filled_routing_table(size: int) -> RoutingTable:
+    """Return a routing table with `size` host routes, through 8 next hops, and
+    a default route."""
+    routing_table = RoutingTable()
+    next_hops = [Address("192.168.0.%d" % i) for i in range(1, 9)]
+    for i, destination in enumerate(addresses(size)):
+        routing_table.add_route(Subnet(destination), next_hops[i % len(next_hops)], 1 + i % 16)
+    routing_table.add_route(DEFAULT_ROUTE, next_hops[0], 1)
+    return routing_table
+
+
+# Messages
+
+_MESSAGES = {
+    'DIO': DIO(metric_value=3, sink=Address("10.0.0.1"), sink_load=42),
+    'RREP': RREP(Address("10.0.0.2"), Address("10.0.0.1"), 3),
+    'RERR': RERR(Address("10.0.0.2"), Address("10.0.0.3")),
+    'RREQ': RREQ(Address("10.0.0.2"), Address("10.0.0.3"), 42),
+}
+
+for _msg_type, _msg in _MESSAGES.items():
+    benchmark("message.%s.dump" % _msg_type)(lambda msg=_msg: time_per_op(msg.dump))
+    benchmark("message.%s.parse" % _msg_type)(
+        lambda data=_msg.dump(): time_per_op(lambda: Message.parse(data)))
+
+
+# Addresses
+
+@benchmark("address.from_str")
+def bench_address_from_str():
+    return time_per_op(lambda: Address("10.1.2.3"))
+
+
+@benchmark("address.from_bytes")
+def bench_address_from_bytes():
+    return time_per_op(lambda: Address(b"\x0a\x01\x02\x03"))
+
+
+@benchmark("subnet.from_str")
+def bench_subnet_from_str():
+    return time_per_op(lambda: Subnet("10.1.0.0/16"))
+
+
+@benchmark("address.hash")
+def bench_address_hash():
+    address = Address("10.1.2.3")
+    return time_per_op(lambda: hash(address))
+
+
+@benchmark("subnet.hash")
+def bench_subnet_hash():
+    subnet = Subnet("10.1.0.0/16")
+    return time_per_op(lambda: hash(subnet))
+
+
+@benchmark("subnet.contains")
+def bench_subnet_contains():
+    subnet, address = Subnet("10.1.0.0/16"), Address("10.1.2.3")
+    return time_per_op(lambda: address in subnet)
+
+
+# Routing table
+
+for _size in ROUTING_TABLE_SIZES:
+    @benchmark("routing_table.add.%d" % _size)
+    def bench_add(size=_size):
+        """Time to add a route, when filling a table."""
+        return time_per_op(lambda: filled_routing_table(size), repeat=1) / size
+
+    @benchmark("routing_table.delete.%d" % _size)
+    def bench_delete(size=_size):
+        """Time to delete a route, when emptying a table."""
+        destinations = [Subnet(address) for address in addresses(size)]
+        next_hops = [Address("192.168.0.%d" % i) for i in range(1, 9)]
+        total = 0
+        for _ in range(3):
+            routing_table = filled_routing_table(size)
+            start = time.perf_counter()
+            for i, destination in enumerate(destinations):
+                routing_table.del_route(destination, next_hops[i % len(next_hops)])
+            total += time.perf_counter() - start
+        return total / 3 / size
+
+    @benchmark("routing_table.lookup_host.%d" % _size)
+    def bench_lookup_host(size=_size):
+        routing_table = filled_routing_table(size)
+        destination = Address(b"\x0a" + (size // 2).to_bytes(3, "big"))
+        return time_per_op(lambda: routing_table.get_a_nexthop(destination))
+
+    @benchmark("routing_table.lookup_default.%d" % _size)
+    def bench_lookup_default(size=_size):
+        routing_table = filled_routing_table(size)
+        destination = Address("172.16.0.1")
+        return time_per_op(lambda: routing_table.get_a_nexthop(destination))
+
+    @benchmark("routing_table.is_predecessor.%d" % _size)
+    def bench_is_predecessor(size=_size):
+        routing_table = filled_routing_table(size)
+        # Not a next hop: the worst case
+        neighbor = Address("192.168.0.100")
+        return time_per_op(lambda: routing_table.is_predecessor(neighbor))
+
+
+# Message handling
+
+def _handle_msg_throughput(messages) -> float:
+    """Return the time taken by a LrpProcess, with a stub transport, to handle
+    a message of the list, on average."""
+    lrp_process = ReplayLrpProcess(Address("10.0.0.2"))
+    with lrp_process:
+        start = time.perf_counter()
+        for msg, sender, is_broadcast in messages:
+            lrp_process.handle_msg(msg, sender, is_broadcast)
+        return (time.perf_counter() - start) / len(messages)
+
+
+@benchmark("handle_msg.DIO")
+def bench_handle_dio():
+    senders = addresses(100)
+    return _handle_msg_throughput([(DIO(metric_value=1 + i % 8, sink=Address("10.255.0.1")), senders[i % 100], True)
+                                   for i in range(20000)])
+
+
+@benchmark("handle_msg.RREP")
+def bench_handle_rrep():
+    sources = addresses(20000)
+    sink = Address("10.255.0.1")
+    # Attach the node first, so that RREPs are forwarded towards the sink
+    messages = [(DIO(metric_value=1, sink=sink), sink, True)]
+    messages.extend((RREP(source, sink, 1 + i % 8), sources[i % 100], False) for i, source in enumerate(sources))
+    return _handle_msg_throughput(messages)
+
+
+# Convergence
+
+for _size in CONVERGENCE_SIZES:
+    @benchmark("convergence.%d" % _size)
+    def bench_convergence(size=_size):
+        """Time for a random topology to converge, in simulation."""
+        random.seed(size)
+        simulation = Simulation(random_topology(size, 8, seed=size), seed=size)
+        start = time.perf_counter()
+        with simulation:
+            if simulation.run_until_converged(600) is None:
+                raise Exception("convergence.%d: not converged" % size)
+        return time.perf_counter() - start
+
+
+def format_duration(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3)):
+        if seconds >= scale:
+            return "%9.3f%-2s" % (seconds / scale, unit)
+    return "%9.3fµs" % (seconds * 1e6)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print the results along with their baseline. Return the names of the
+    benchmarks slower than their baseline by more than `tolerance`."""
+    regressions = []
+    for name, seconds in results['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            print("%-40s %s" % (name, format_duration(seconds)))
+            continue
+        ratio = seconds / reference
+        status = ""
+        if ratio > 1 + tolerance:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            status = "improvement"
+        print("%-40s %s %s %+7.1f%% %s" % (name, format_duration(seconds), format_duration(reference),
+                                            (ratio - 1) * 100, status))
+    return regressions
+
+
+@click.command()
+@click.option("--filter", "name_filter", default="", metavar="<substring>",
+              help="Only run the benchmarks whose name contains this substring.")
+@click.option("--output", default=None, type=click.Path(dir_okay=False, writable=True), metavar="<file>",
+              help="Write the results in this JSON file.")
+@click.option("--baseline", default=DEFAULT_BASELINE, show_default=True, type=click.Path(dir_okay=False),
+              metavar="<file>", help="Compare the results with this JSON file, if it exists.")
+@click.option("--save-baseline/--no-save-baseline", default=False, show_default=True,
+              help="Write the results as the new baseline.")
+@click.option("--tolerance", default=0.2, show_default=True, metavar="<ratio>",
+              help="Relative slowdown over the baseline reported as a regression.")
+def run(name_filter="", output=None, baseline=DEFAULT_BASELINE, save_baseline=False, tolerance=0.2):
+    """Run the benchmarks of the core hot paths, and compare them with a
+    baseline. Exit with status 1 if a regression is found.
+
+    Results are times per operation, in s."""
+    # A flight recorder per process would be benchmarked along
+    lrp.conf['flight_recorder']['size'] = 0
+
+    results = {'python': platform.python_version(), 'machine': platform.machine(), 'time': time.time(),
+               'benchmarks': {}}
+    for name, function in BENCHMARKS.items():
+        if name_filter in name:
+            logger.info("Run %s", name)
+            results['benchmarks'][name] = function()
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    try:
+        with open(baseline) as f:
+            reference = json.load(f)
+    except FileNotFoundError:
+        reference = {'benchmarks': {}}
+        logger.warning("No baseline in %s", baseline)
+    regressions = compare(results, reference, tolerance)
+
+    if save_baseline:
+        # Keep the baseline of the benchmarks which were not run
+        reference['benchmarks'].update(results['benchmarks'])
+        results['benchmarks'] = reference['benchmarks']
+        with open(baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        logger.info("Baseline saved in %s", baseline)
+    elif regressions:
+        print("%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    # The protocol itself is quiet
+    logging.getLogger("LRP").setLevel(logging.WARNING)
+    logging.getLogger("RoutingTable").setLevel(logging.WARNING)
+
+    run()
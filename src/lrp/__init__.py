@@ -35,17 +35,171 @@ conf = {
     'service_multicast_address': "224.0.0.120",
     'service_port': 6666,
 
-    # Interval in s between DIO emission, when the node is disconnected.
-    'dio_reconnect_interval': 10,
+    # Maximum number of datagrams read from a socket at each wake-up of the
+    # event loop, before handling the other ready sockets.
+    'receive_budget': 64,
+    # Size of the receive buffers of the service sockets (SO_RCVBUF), in
+    # bytes. None keeps the system default.
+    'receive_buffer_size': None,
+
+    # Maximum delay in s before answering a neighbor with a unicast DIO.
     'dio_delay': 1,
+    # Trickle timer (RFC 6206) governing broadcast DIO emission.
+    'dio_trickle': {
+        # Minimum interval, in s
+        'imin': 1,
+        # Maximum interval, expressed as a number of doublings of imin
+        # (1s * 2 ** 10 ≃ 17 min)
+        'imax_doublings': 10,
+        # Redundancy constant. 0 disables suppression.
+        'k': 3,
+        # Maximum interval while the node is disconnected, so that it keeps
+        # looking for a successor (1s * 2 ** 3 = 8s)
+        'disconnected_imax_doublings': 3,
+    },
+
+    # Choice of the sink, when many of them are reachable. The score of a sink
+    # is `metric + load_weight * load`, where the load is the number of host
+    # routes the sink has. We switch only to a sink whose score is better by
+    # at least switch_hysteresis.
+    'multi_sink': {
+        'load_weight': 0.01,
+        'switch_hysteresis': 2,
+    },
+
+    # Asynchronous logging (see lrp.async_logging)
+    'logging': {
+        # Maximum number of records waiting to be written. Others are dropped.
+        'queue_size': 10000,
+    },
+
+    # Where diagnostics (profiling results, flight recorder dumps, memory
+    # reports) are written
+    'diagnostics_directory': "/tmp",
+
+    # On-demand profiling (see lrp.profiling), triggered by SIGUSR1
+    'profiling': {
+        # Default duration of a profiling session, in s
+        'duration': 30,
+    },
+
+    # Ring buffer of the last protocol events (see lrp.flight_recorder), dumped
+    # on SIGUSR2 or on crash
+    'flight_recorder': {
+        # Number of events kept. 0 disables the flight recorder.
+        'size': 65536,
+    },
+
+    # Memory reports (see lrp.memory), written on SIGUSR2
+    'memory': {
+        # Number of lines of the tracemalloc statistics, when enabled
+        'tracemalloc_top': 20,
+    },
+
+    # Metrics served over HTTP (see lrp.metrics.MetricsServer). The endpoint is
+    # not authenticated.
+    'metrics': {
+        # Host used when only a port is given
+        'default_host': "127.0.0.1",
+        # Serve them on non-loopback addresses too. Refused otherwise.
+        'allow_public': False,
+    },
+
+    # Control socket (see lrp.control), when the daemon is given one
+    'control': {
+        # Maximum number of change messages waiting to be sent to a subscribed
+        # client. Slower clients are disconnected.
+        'subscriber_queue_size': 1024,
+    },
+
+    # Warm restart (see lrp.snapshot), when the daemon is given a state file
+    'warm_restart': {
+        # Maximum age of a saved state, in s. Older states are ignored, and
+        # the kernel state left by the previous instance is cleaned.
+        'max_age': 300,
+    },
+
+    # Discrete-event simulation (see lrp.simulation)
+    'simulation': {
+        # Default latency of the simulated links, in s
+        'latency': 0.01,
+    },
 
     # netlink-related configuration
     'netlink': {
         # RTPROT number for LRP. See `man rtnetlink.7`
         'proto_number': 43,
+        # How LRP routes are programmed in the kernel (see lrp.kernel_routes):
+        # "ipdb" (mirror of the whole kernel state), "iproute" (single
+        # rtnetlink socket, only LRP routes are known, changes are coalesced)
+        # or "nexthop" (same, routes sharing their next hops point to a shared
+        # kernel nexthop group, Linux 5.3+)
+        'route_backend': "ipdb",
+        # First id of the kernel nexthop objects, in "nexthop" mode. Ids are
+        # shared by the whole system.
+        'nexthop_first_id': 43 << 16,
         # Number of the netfilter queue where non-routables from loop-avoidance mechanism are sent
         'netfilter_queue_nb': 43,
+        # Maximum number of queued packets handled as one batch. Packets of a
+        # batch with the same source, destination and sender trigger only one
+        # protocol action.
+        'netfilter_queue_batch': 64,
+        # Maximum number of queued packets handled at each wake-up of the
+        # event loop, so that a flood of non-routable packets does not starve
+        # the LRP messages. The others wait in the queue until the next
+        # wake-up (dropped unhandled with netfilterqueue < 1.0).
+        'netfilter_queue_budget': 256,
+        # Worker processes handling the netfilter queues (see
+        # lrp.nfqueue_workers). With count workers, non-routable packets are
+        # balanced among the queues netfilter_queue_nb to
+        # netfilter_queue_nb + count - 1. 0 handles the single queue in the
+        # daemon process.
+        'nfqueue_workers': {
+            'count': 0,
+            # A worker sends the same (source, destination, sender) again only
+            # after this delay, in s
+            'dedup_interval': 0.1,
+            # Maximum number of packets a worker sends to the daemon per second
+            'rate_limit': 1000,
+            # Number of times dead workers are restarted. The daemon stops
+            # when one more worker dies.
+            'respawn_limit': 3,
+        },
+        # How the loop-avoidance rules are programmed in the kernel (see
+        # lrp.loop_avoidance): "iptables" (one rule per entry), "ipset" (one
+        # set of predecessors, one set of destinations), "nftables" (same
+        # sets in a dedicated table, updated by atomic transactions) or "bpf"
+        # (same sets in the maps of a tc classifier, which marks the accepted
+        # packets)
+        'loop_avoidance_backend': "iptables",
         # Name of the iptables chain owning the LRP rules
         'iptables_chain_name': "LRP_RULES",
+        # Names of the ipsets, in "ipset" mode
+        'ipset_names': {
+            'predecessors': "LRP_PREDECESSORS",
+            'destinations': "LRP_DESTINATIONS",
+        },
+        # Name of the nftables table, in "nftables" mode
+        'nftables_table': "lrp",
+        # eBPF classifier, in "bpf" mode
+        'bpf': {
+            # Bit of the firewall mark set on accepted packets
+            'accept_mark': 0x10000000,
+            # Priority of the classifier among the tc ingress filters of the
+            # interface
+            'tc_priority': 43,
+            # Maximum number of entries in the maps
+            'max_predecessors': 1024,
+            'max_destinations': 65536,
+        },
+        # Apply the kernel changes from a dedicated thread (see
+        # lrp.kernel_worker). Only the iproute, nexthop, ipset and nftables
+        # backends use it.
+        'kernel_worker': {
+            'enabled': False,
+            # Maximum number of changes waiting to be applied. When reached,
+            # the protocol waits for the worker.
+            'queue_size': 1024,
+        },
     }
 }
@@ -30,14 +30,21 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+import atexit
 import logging
 
 import click
 
+import lrp
+from lrp.async_logging import start_async_logging
+
 
 @click.group()
 @click.option("-v", "--verbose", count=True)
-def cli(verbose):
+@click.option("--async-logging/--sync-logging", default=False, show_default=True,
+              help="Format and write logs from a background thread. Logs are dropped if they are produced "
+                   "faster than they are written.")
+def cli(verbose, async_logging=False):
     log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
     try:
         logging.basicConfig(format="[%(relativeCreated)d][%(levelname)s][%(name)s] %(message)s",
@@ -45,6 +52,12 @@ def cli(verbose):
     except IndexError:
         raise Exception("Use at most %d --verbose flags" % (len(log_levels) - 1))
 
+    if async_logging:
+        # Reuse the handler configured by basicConfig, from a background thread
+        handler = logging.getLogger().handlers[0]
+        listener = start_async_logging(handler, lrp.conf['logging']['queue_size'])
+        atexit.register(listener.stop)
+
 
 def _unavailable_subcommand(import_exception):
     def unavailable(**kwargs):
@@ -71,4 +84,32 @@ if __name__ == "__main__":
     except ImportError as e:
         cli.add_command(_unavailable_subcommand(e), name="sniff")
 
+    try:
+        from lrp.replay import replay_command
+
+        cli.add_command(replay_command)
+    except ImportError as e:
+        cli.add_command(_unavailable_subcommand(e), name="replay")
+
+    try:
+        from lrp.flight_recorder import events
+
+        cli.add_command(events)
+    except ImportError as e:
+        cli.add_command(_unavailable_subcommand(e), name="events")
+
+    try:
+        from lrp.control import query
+
+        cli.add_command(query)
+    except ImportError as e:
+        cli.add_command(_unavailable_subcommand(e), name="query")
+
+    try:
+        from lrp.simulation import simulate
+
+        cli.add_command(simulate)
+    except ImportError as e:
+        cli.add_command(_unavailable_subcommand(e), name="simulate")
+
     cli()
@@ -0,0 +1,85 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+import logging.handlers
+import queue
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Put log records in a bounded queue, to be formatted and written by a
+    `logging.handlers.QueueListener` thread.
+
+    Contrary to `QueueHandler`, records are not formatted before being
+    queued: the cost of formatting messages and addresses is paid by the
+    listener thread. When the queue is full, records are dropped, and a
+    warning reporting the number of dropped records is queued as soon as
+    possible."""
+
+    def __init__(self, queue_: queue.Queue):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped > 0:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': "WARNING",
+                    'msg': "%d log records dropped: logging queue is full", 'args': (self.dropped,)}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for some room in the queue, instead of failing
+        self.queue.put(self._sentinel)
+
+
+def start_async_logging(handler: logging.Handler, queue_size: int) -> logging.handlers.QueueListener:
+    """Route all records of the root logger through a DroppingQueueHandler, and
+    start a listener thread writing them to `handler`. Return the listener,
+    which should be stopped at exit to flush the remaining records."""
+    records = queue.Queue(maxsize=queue_size)
+    root_logger = logging.getLogger()
+    for old_handler in list(root_logger.handlers):
+        root_logger.removeHandler(old_handler)
+    root_logger.addHandler(DroppingQueueHandler(records))
+    listener = _QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
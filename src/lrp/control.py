@@ -0,0 +1,295 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from typing import Optional
+
+import click
+
+import lrp
+
+# Each message, in both directions, is a JSON object prefixed by its length
+_LENGTH = struct.Struct("!I")
+
+QUERIES = ("node", "routes", "neighbors", "all")
+
+
+def send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_message(sock: socket.socket) -> Optional[dict]:
+    """Return the next message of a socket, or None if it is closed."""
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _LENGTH.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode())
+
+
+class ControlState:
+    """Copy of the state of a LRP process, as served by the control socket,
+    updated by `apply`. Answers are encoded once per version, on first
+    request."""
+
+    def __init__(self):
+        # Incremented at each change of the state
+        self.version = 0
+        # Address, sink, metric… of the node
+        self.node = {}
+        # Destination -> {next hop -> metric}, as strings
+        self.routes = {}
+        # Address -> name of its interface, as strings
+        self.neighbors = {}
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def answer(self, query: str) -> bytes:
+        """Return the length-prefixed answer to a query."""
+        with self._lock:
+            try:
+                return self._answers[query]
+            except KeyError:
+                pass
+            answer = {'version': self.version}
+            if query in ("node", "all"):
+                answer['node'] = self.node
+            if query in ("routes", "all"):
+                answer['routes'] = self.routes
+            if query in ("neighbors", "all"):
+                answer['neighbors'] = self.neighbors
+            data = json.dumps(answer, separators=(",", ":")).encode()
+            self._answers[query] = data = _LENGTH.pack(len(data)) + data
+            return data
+
+    def apply(self, node: dict, routes: dict, neighbors: dict) -> list:
+        """Update the state, and return the changes. Only the given routes and
+        neighbors are compared.
+
+        node: the new node part
+        routes: destination -> {next hop -> metric} (empty, or None, if there
+          is no more route), for the changed destinations
+        neighbors: address -> name of its interface (None if it is no more a
+          neighbor), for the changed neighbors"""
+        changes = []
+        with self._lock:
+            if node != self.node:
+                self.node = node
+                changes.append({'type': "node", 'node': node})
+            for destination, new in routes.items():
+                old = self.routes.get(destination, {})
+                new = new or {}
+                for next_hop in old.keys() - new.keys():
+                    changes.append({'type': "route-del", 'destination': destination, 'next_hop': next_hop})
+                for next_hop, metric in new.items():
+                    if old.get(next_hop) != metric:
+                        changes.append({'type': "route-add", 'destination': destination, 'next_hop': next_hop,
+                                        'metric': metric})
+                if new:
+                    self.routes[destination] = new
+                else:
+                    self.routes.pop(destination, None)
+            for neighbor, interface in neighbors.items():
+                if self.neighbors.get(neighbor) == interface:
+                    continue
+                if interface is None:
+                    del self.neighbors[neighbor]
+                    changes.append({'type': "neighbor-del", 'address': neighbor})
+                else:
+                    self.neighbors[neighbor] = interface
+                    changes.append({'type': "neighbor-add", 'address': neighbor, 'interface': interface})
+            if changes:
+                self.version += 1
+                self._answers.clear()
+        return changes
+
+
+class ControlServer:
+    """Serve the state of a LRP process on a Unix socket, from background
+    threads.
+
+    Clients send length-prefixed JSON requests: {"query": <one of QUERIES>}
+    is answered by the matching part of the state, {"query": "subscribe"} by
+    the whole state, then by a message for each batch of changes. Requests are
+    served from a `ControlState`, which a background thread updates with the
+    changes given to `publish`: clients never wait for, nor slow down, the
+    event loop."""
+    logger = logging.getLogger("Control")
+
+    def __init__(self, address: str):
+        """Constructor.
+
+        address: path of the Unix socket"""
+        self.address = address
+        self.state = ControlState()
+        # Batches of changes given to `publish`, waiting to be applied
+        self._updates = queue.Queue()
+        # One queue of changes per subscribed client
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._updater = None
+
+    def __enter__(self):
+        control = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    request = recv_message(self.request)
+                    if request is None:
+                        return
+                    query = request.get('query')
+                    if query == "subscribe":
+                        control._stream_changes(self.request)
+                        return
+                    elif query in QUERIES:
+                        self.request.sendall(control.state.answer(query))
+                    else:
+                        send_message(self.request, {'error': "unknown query %r" % query})
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._server = Server(self.address, Handler)
+        self.logger.info("Serve control requests on %s", self.address)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control", daemon=True)
+        self._thread.start()
+        self._updater = threading.Thread(target=self._apply_updates, name="control-updater", daemon=True)
+        self._updater.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._updates.put(None)
+        self._updater.join()
+        with self._subscribers_lock:
+            for changes in self._subscribers:
+                try:
+                    changes.put_nowait(None)
+                except queue.Full:
+                    # The client is too slow: it will be disconnected
+                    changes.overflowed = True
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        os.unlink(self.address)
+
+    def publish(self, node: dict, routes: dict, neighbors: dict):
+        """Queue changes of the state, to be applied, then sent to the
+        subscribed clients, by a background thread. See `ControlState.apply`
+        for the arguments, which must not be modified afterwards. Should be
+        called from the event loop."""
+        self._updates.put((node, routes, neighbors))
+
+    def _apply_updates(self):
+        while True:
+            update = self._updates.get()
+            if update is None:
+                return
+            # Under the lock, so that a new subscriber gets either the state
+            # before these changes, then them, or the state after them
+            with self._subscribers_lock:
+                changes = self.state.apply(*update)
+                if not changes or not self._subscribers:
+                    continue
+                message = {'version': self.state.version, 'changes': changes}
+                for subscriber in self._subscribers:
+                    try:
+                        subscriber.put_nowait(message)
+                    except queue.Full:
+                        # The client is too slow: it will be disconnected
+                        subscriber.overflowed = True
+
+    def _stream_changes(self, sock: socket.socket):
+        changes = queue.Queue(maxsize=lrp.conf['control']['subscriber_queue_size'])
+        changes.overflowed = False
+        with self._subscribers_lock:
+            self._subscribers.add(changes)
+            # Next changes are queued
+            answer = self.state.answer("all")
+        try:
+            sock.sendall(answer)
+            while True:
+                message = changes.get()
+                if message is None:
+                    return
+                if changes.overflowed:
+                    self.logger.warning("Disconnect a subscriber: too many changes waiting")
+                    return
+                send_message(sock, message)
+        except OSError:
+            # The client left
+            pass
+        finally:
+            with self._subscribers_lock:
+                self._subscribers.discard(changes)
+
+
+@click.command()
+@click.argument("address", type=click.Path(exists=True, dir_okay=False))
+@click.argument("query", type=click.Choice(QUERIES + ("subscribe",)), default="all")
+def query(address, query="all"):
+    """Query the state of a running daemon, through its control socket."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        send_message(sock, {'query': query})
+        while True:
+            message = recv_message(sock)
+            if message is None:
+                break
+            print(json.dumps(message, indent=2, sort_keys=True), flush=True)
+            if query != "subscribe":
+                break
@@ -34,10 +34,17 @@ import abc
 import logging
 import random
 import sched
+import time
+from typing import Dict
 
 import lrp
+from lrp.flight_recorder import FlightRecorder, EVENT_MESSAGE_IN
+from lrp.memory import MemoryReport
 from lrp.message import RREP, DIO, Message, RERR, RREQ
+from lrp.metrics import Registry
+from lrp.profiling import Profiler
 from lrp.tools import Address, Subnet, NULL_ADDRESS, DEFAULT_ROUTE, RoutingTable
+from lrp.trickle import TrickleTimer
 
 
 class LrpProcess(metaclass=abc.ABCMeta):
@@ -45,11 +52,12 @@ class LrpProcess(metaclass=abc.ABCMeta):
 
     dest_next_DIO = None
 
-    def __init__(self, metric: int = 2 ** 16 - 1, is_sink: bool = False):
+    def __init__(self, metric: int = 2 ** 16 - 1, is_sink: bool = False, scheduler: sched.scheduler = None):
         """Constructor.
 
         metric: The initial metric of the node. Should be set to a realistic value if is_sink is True.
-        is_sink: Does this node is a LRP sink?"""
+        is_sink: Does this node is a LRP sink?
+        scheduler: The scheduler for timed events. Default: a new real-time scheduler."""
         self.is_sink = is_sink
         self.own_metric = metric
 
@@ -58,17 +66,53 @@ class LrpProcess(metaclass=abc.ABCMeta):
         else:
             self.sink = NULL_ADDRESS
 
+        # Other sinks we could be attached to: our metric towards them, their
+        # load, and the usable successors towards them
+        self._sink_metrics: Dict[Address, int] = {}
+        self._sink_loads: Dict[Address, int] = {}
+        self._sink_candidates: Dict[Address, Dict[Address, int]] = {}
+
         self._tracked_rreq = {}
         self._own_current_seqno = 0
-        self.scheduler = sched.scheduler()
-        self.routing_table = RoutingTable()
+        self.scheduler = scheduler if scheduler is not None else sched.scheduler()
+        # If set, all inputs of the process are recorded (see lrp.replay.Recorder)
+        self.recorder = None
+        if lrp.conf['flight_recorder']['size'] > 0:
+            self.flight_recorder = FlightRecorder(lrp.conf['flight_recorder']['size'])
+        else:
+            self.flight_recorder = None
+        self.routing_table = RoutingTable(flight_recorder=self.flight_recorder)
+        self.dio_trickle = TrickleTimer(self.scheduler, action=self._send_DIO,
+                                        imin=lrp.conf['dio_trickle']['imin'],
+                                        imax_doublings=lrp.conf['dio_trickle']['imax_doublings'],
+                                        k=lrp.conf['dio_trickle']['k'])
+
+        self.profiler = Profiler(self.scheduler)
+        self.memory_report = MemoryReport()
+        self.metrics = Registry()
+        self.metrics.counter("lrp_messages_received_total", "LRP messages received", ("type",))
+        self.metrics.counter("lrp_messages_sent_total", "LRP messages sent", ("type",))
+        self.metrics.histogram("lrp_handler_duration_seconds", "Time spent handling a LRP message", ("type",))
+        self.metrics.counter("lrp_non_routable_packets_total", "Non-routable packets, answered by a RERR")
+        self.metrics.counter("lrp_unknown_hosts_total", "Packets towards unknown hosts, searched by a RREQ")
+        self.metrics.gauge("lrp_routes", "Destinations in the routing table",
+                           callback=lambda: len(self.routing_table.routes))
+        self.metrics.gauge("lrp_neighbors", "Known neighbors", callback=lambda: len(self.routing_table.neighbors))
+        self.metrics.gauge("lrp_metric", "Metric of this node", callback=lambda: self.own_metric)
+        for name, documentation in (('transmitted', "Broadcast DIOs sent by the trickle timer"),
+                                    ('suppressed', "Broadcast DIOs suppressed by the trickle timer"),
+                                    ('resets', "Resets of the trickle timer"),
+                                    ('consistent', "Consistent DIOs heard by the trickle timer")):
+            self.metrics.gauge("lrp_dio_trickle_%s" % name, documentation,
+                               callback=lambda name=name: self.dio_trickle.counters[name])
 
     def __enter__(self):
         self.logger.debug("LRP process started")
         if self.is_sink:
             self.logger.debug("Started as sink")
             self.logger.debug("Emit a first DIO to signal our presence")
-            self.send_msg(DIO(self.own_metric, sink=self.sink), destination=None)
+            self._send_DIO(destination=None)
+            self.dio_trickle.start()
         else:
             self.logger.debug("Started as standard node")
             self.disconnected()
@@ -76,6 +120,7 @@ class LrpProcess(metaclass=abc.ABCMeta):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.dio_trickle.stop()
         self.logger.debug("Close service sockets")
 
     @property
@@ -92,6 +137,25 @@ class LrpProcess(metaclass=abc.ABCMeta):
           message.
         """
 
+    def timer_due(self, timestamp: float) -> bool:
+        """Check whether a timed event is due at `timestamp`, on the clock of
+        the scheduler."""
+        queue = self.scheduler.queue
+        return len(queue) > 0 and queue[0].time <= timestamp
+
+    def memory_structures(self) -> Dict[str, object]:
+        """Return the data structures to be accounted in memory reports."""
+        structures = {
+            'routing_table.routes': self.routing_table.routes,
+            'routing_table.neighbors': self.routing_table.neighbors,
+            'tracked_rreq': self._tracked_rreq,
+            'sink_candidates': self._sink_candidates,
+            'scheduler.queue': self.scheduler.queue,
+        }
+        if self.flight_recorder is not None:
+            structures['flight_recorder'] = self.flight_recorder
+        return structures
+
     def _new_rreq_seqno(self) -> int:
         self._own_current_seqno += 1
         if self._own_current_seqno >= 2 ** 16:
@@ -105,6 +169,10 @@ class LrpProcess(metaclass=abc.ABCMeta):
         sender: the neighbor which has sent the msg
         is_broadcast: is it a broadcast message, or am I the destination?
         """
+        if self.recorder is not None:
+            self.recorder.record_message(msg, sender, is_broadcast)
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(EVENT_MESSAGE_IN, msg.message_type, sender.as_bytes, value=is_broadcast)
         try:
             handler = self.__getattribute__("_handle_" + str(msg.message_type))
         except AttributeError:
@@ -113,16 +181,37 @@ class LrpProcess(metaclass=abc.ABCMeta):
         else:
             self.logger.info("Received message %s from %s to %s",
                              msg, sender, "broadcast" if is_broadcast else "myself")
+            self.metrics.counter("lrp_messages_received_total").inc(msg.message_type)
+            start = time.perf_counter()
             self.routing_table.ensure_is_neighbor(sender)
             handler(msg, sender, is_broadcast)
+            duration = time.perf_counter() - start
+            self.metrics.histogram("lrp_handler_duration_seconds").observe(duration, msg.message_type)
+            self.profiler.record(handler.__name__, duration)
 
     def _handle_DIO(self, dio: DIO, sender: Address, is_broadcast: bool):
         # Compute real route cost
         route_cost = dio.metric_value + 1
 
-        # Check if this sink is supported
+        if dio.sink != NULL_ADDRESS and dio.sink == self.sink and dio.metric_value <= self.own_metric:
+            # The neighbor advertises the DODAG we are part of, as well as we
+            # do: our own DIOs may be redundant with its ones. DIOs of our
+            # children do not make ours useless.
+            self.dio_trickle.hear_consistent()
+
+        if dio.sink != NULL_ADDRESS:
+            self._sink_loads[dio.sink] = dio.sink_load
+            # A neighbor is attached to only one sink at a time: forget it as
+            # successor towards the others
+            self._forget_successor(sender, except_sink=dio.sink)
+
         if dio.sink != NULL_ADDRESS and self.sink != NULL_ADDRESS and dio.sink != self.sink:
-            self.logger.warning("Drop DIO: not the same sink (many sinks are not handled now)")
+            if self.own_metric + 2 < route_cost:
+                self.logger.info("Neighbor attached to %s may be interested by our DIO", dio.sink)
+                self._schedule_DIO(destination=sender)
+            if not self.is_sink:
+                self._add_sink_candidate(dio.sink, sender, route_cost)
+                self._select_sink()
 
         elif dio.sink == NULL_ADDRESS or self.own_metric < route_cost:
             self.logger.debug("Do not use DIO: route is too bad")
@@ -136,6 +225,7 @@ class LrpProcess(metaclass=abc.ABCMeta):
 
             # Add route
             self.routing_table.add_route(DEFAULT_ROUTE, sender, route_cost)
+            self.dio_trickle.limit()
 
             # Update position in the DODAG
             if self.own_metric > route_cost:
@@ -147,20 +237,101 @@ class LrpProcess(metaclass=abc.ABCMeta):
                         "Trying to change the sink we are attached to (%s -> %s)" % (self.sink, dio.sink)
                     self.logger.info("Update our sink to %s", dio.sink)
                     self.sink = dio.sink
+                    self._sink_candidates.pop(dio.sink, None)
+                self._sink_metrics[self.sink] = self.own_metric
 
                 self.logger.debug("Check if old successors are still usable")
                 self.routing_table.filter_out_nexthops(DEFAULT_ROUTE, max_metric=self.own_metric)
 
                 self.logger.debug("Inform neighbors that we have changed our metric")
-                self._schedule_DIO(destination=None)
+                self.dio_trickle.reset()
 
             if not was_already_successor:
                 # This neighbor does not know us as predecessor. Send RREP
-                self.logger.info("Create host route through %s" % sender)
+                self.logger.info("Create host route through %s", sender)
                 self.send_msg(RREP(self.own_ip, self.sink, 0), destination=sender)
 
+    def _add_sink_candidate(self, sink: Address, neighbor: Address, route_cost: int):
+        """Record a neighbor as usable successor towards a sink we are not attached
+        to. As for our own sink, our metric towards each sink never increases,
+        so that we can switch back and forth without creating loops."""
+        known_metric = self._sink_metrics.get(sink, 2 ** 16 - 1)
+        if route_cost > known_metric:
+            self.logger.debug("Do not use %s towards %s: route is too bad", neighbor, sink)
+            return
+        self._sink_metrics[sink] = route_cost
+        candidates = self._sink_candidates.setdefault(sink, {})
+        candidates[neighbor] = route_cost
+        for nh, metric in list(candidates.items()):
+            if metric > route_cost:
+                del candidates[nh]
+
+    def _forget_successor(self, neighbor: Address, except_sink: Address):
+        """Forget neighbor as successor towards all sinks but `except_sink`."""
+        for sink, candidates in list(self._sink_candidates.items()):
+            if sink != except_sink:
+                candidates.pop(neighbor, None)
+                if len(candidates) == 0:
+                    del self._sink_candidates[sink]
+        if self.sink != except_sink and self.routing_table.is_successor(neighbor):
+            self.logger.info("%s is no more a successor: it moved to sink %s", neighbor, except_sink)
+            self.routing_table.del_route(DEFAULT_ROUTE, neighbor)
+            if not self.is_sink and self.routing_table.get_a_nexthop(DEFAULT_ROUTE) is None:
+                # It was the last one: move to another sink, if any
+                self._select_sink()
+                self.disconnected()
+
+    def _sink_score(self, sink: Address, metric: int) -> float:
+        return metric + lrp.conf['multi_sink']['load_weight'] * self._sink_loads.get(sink, 0)
+
+    def _select_sink(self):
+        """Choose the sink to be attached to, according to the metric towards each
+        sink and their load. We move to another sink only if it is notably
+        better than the current one, or if the current one is unreachable."""
+        if len(self._sink_candidates) == 0:
+            return
+        best_sink = min(self._sink_candidates,
+                        key=lambda sink: self._sink_score(sink, self._sink_metrics[sink]))
+        best_score = self._sink_score(best_sink, self._sink_metrics[best_sink])
+        if self.routing_table.get_a_nexthop(DEFAULT_ROUTE) is not None:
+            current_score = self._sink_score(self.sink, self.own_metric)
+            if best_score + lrp.conf['multi_sink']['switch_hysteresis'] >= current_score:
+                return
+        self._switch_sink(best_sink)
+
+    def _switch_sink(self, new_sink: Address):
+        """Attach the node to another sink. Current successors are kept as
+        candidates, in case we would switch back."""
+        self.logger.info("Switch from sink %s to sink %s", self.sink, new_sink)
+        old_successors = dict(self.routing_table.routes.get(DEFAULT_ROUTE, {}))
+        if self.sink != NULL_ADDRESS:
+            self._sink_metrics[self.sink] = self.own_metric
+            if len(old_successors) > 0:
+                self._sink_candidates[self.sink] = old_successors
+        for nh in old_successors:
+            self.routing_table.del_route(DEFAULT_ROUTE, nh)
+
+        self.sink = new_sink
+        self.own_metric = self._sink_metrics[new_sink]
+        for nh, metric in self._sink_candidates.pop(new_sink).items():
+            self.routing_table.add_route(DEFAULT_ROUTE, nh, metric)
+            # Make the new sink learn our host route
+            self.send_msg(RREP(self.own_ip, self.sink, 0), destination=nh)
+        self.dio_trickle.limit()
+        self.dio_trickle.reset()
+
+    def _advertised_load(self) -> int:
+        """The load of our sink, as advertised in our DIOs. The sink computes it
+        from its number of host routes; other nodes relay what they heard."""
+        if self.is_sink:
+            load = len(self.routing_table.routes)
+        else:
+            load = self._sink_loads.get(self.sink, 0)
+        return min(load, 2 ** 16 - 1)
+
     def _schedule_DIO(self, destination):
-        """Schedule the sending of a DIO towards this destination.
+        """Schedule the sending of a DIO towards this destination. Regular broadcast
+        DIOs are governed by the trickle timer `dio_trickle` instead.
 
         If a DIO is already programmed, only one broadcast DIO will be
         scheduled.
@@ -187,7 +358,8 @@ class LrpProcess(metaclass=abc.ABCMeta):
 
         destination: the IP address of the destination. If None, broadcast the
           message."""
-        self.send_msg(DIO(metric_value=self.own_metric, sink=self.sink), destination=destination)
+        self.send_msg(DIO(metric_value=self.own_metric, sink=self.sink, sink_load=self._advertised_load()),
+                      destination=destination)
 
     def _handle_RREP(self, rrep: RREP, sender: Address, is_broadcast: bool):
         assert not is_broadcast, "Broadcast RREP are unacceptable"
@@ -198,12 +370,16 @@ class LrpProcess(metaclass=abc.ABCMeta):
 
         self.routing_table.add_route(Subnet(rrep.source), sender, route_cost)
 
-        # Update and forward RREP
-        rrep.hops = route_cost
+        # Update and forward RREP. The received message is left untouched, as
+        # it may still be referenced by a pending log record.
+        rrep = RREP(rrep.source, rrep.destination, route_cost)
         if rrep.destination == self.own_ip:
             self.logger.debug("RREP has reached its destination")
         elif self.is_sink:
             self.logger.warning("Do not forward a RREP through the sink")
+        elif rrep.destination != self.sink:
+            self.logger.warning("Do not forward a RREP towards %s: we are attached to sink %s",
+                                rrep.destination, self.sink)
         else:
             nexthop = self.routing_table.get_a_nexthop(rrep.destination)
             if nexthop is not None:
@@ -237,6 +413,9 @@ class LrpProcess(metaclass=abc.ABCMeta):
         # Throw out our messages
         if rreq.source == self.own_ip:
             self.logger.debug("Skip RREQ: it is mine")
+        elif self.sink != NULL_ADDRESS and rreq.source != self.sink:
+            # Each sink looks for the nodes of its own DODAG only
+            self.logger.debug("Skip RREQ: it comes from sink %s, we are attached to %s", rreq.source, self.sink)
         else:
             # Track RREQ seqnos
             try:
@@ -265,33 +444,36 @@ class LrpProcess(metaclass=abc.ABCMeta):
         """Handle non-routable packet: all packets that does not either come from a
         predecessor or follow a host route."""
         assert not self.is_sink, "The sink should be able to route any packet"
+        if self.recorder is not None:
+            self.recorder.record_non_routable(source, destination, sender)
         self.logger.warning("Drop a non-routable packet: %s --(%s)--> %s", source, sender, destination)
+        self.metrics.counter("lrp_non_routable_packets_total").inc()
         self.send_msg(RERR(error_source=source, error_destination=destination), destination=sender)
 
     def handle_unknown_host(self, destination: Address):
         """Handle the situation when the sink do not have a host route towards a node
         into the network."""
         assert self.is_sink, "Non-sink nodes does not handle unknown hosts, they use their default route instead"
+        if self.recorder is not None:
+            self.recorder.record_unknown_host(destination)
         self.logger.info("Unknown host %s. Flooding a RREQ to find it", destination)
+        self.metrics.counter("lrp_unknown_hosts_total").inc()
         self.send_msg(RREQ(searched_node=destination, source=self.own_ip, seqno=self._new_rreq_seqno()),
                       destination=None)
 
     def disconnected(self):
-        """Should be called whenever the node is detected as disconnected. Handle disconnection by sending regularly
-        DIOs."""
+        """Should be called whenever the node is detected as disconnected. Handle disconnection by resetting the
+        DIO trickle timer: DIOs are sent quickly, then less and less often (but at least every
+        lrp.conf['dio_trickle']['disconnected_imax_doublings'] intervals) until a neighbor answers."""
         assert not self.is_sink, "Sink cannot be disconnected!"
 
-        # Check if we already know that we are disconnected
-        if any(event.action == self.disconnected for event in self.scheduler.queue):
-            self.logger.debug("Disconnection already handled")
+        successor = self.routing_table.get_a_nexthop(DEFAULT_ROUTE)
+        if successor is not None:
+            self.logger.info("Node is still connected to %s", successor)
+            # E.g. restored from a snapshot: keep advertising ourselves
+            self.dio_trickle.start()
         else:
-            # Check if we are still disconnected
-            successor = self.routing_table.get_a_nexthop(DEFAULT_ROUTE)
-            if successor is not None:
-                self.logger.info("Node is reconnected to %s", successor)
-            else:
-                # Handle disconnection
-                self.logger.debug("Trying to connect the DODAG…")
-                self.send_msg(DIO(metric_value=self.own_metric, sink=self.sink), destination=None)
-                # Re-schedule next DIO emission
-                self.scheduler.enter(lrp.conf['dio_reconnect_interval'], 0, action=self.disconnected)
+            self.logger.debug("Trying to connect the DODAG…")
+            # Keep on trying regularly
+            self.dio_trickle.limit(lrp.conf['dio_trickle']['disconnected_imax_doublings'])
+            self.dio_trickle.reset()
@@ -0,0 +1,142 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+import os
+import socket
+import struct
+import time
+
+import click
+
+import lrp
+
+EVENT_MESSAGE_IN = 0  # detail: message type, a: sender, value: 1 if broadcast
+EVENT_MESSAGE_OUT = 1  # detail: message type, a: destination (0.0.0.0 if broadcast)
+EVENT_ROUTE_ADD = 2  # detail: prefix length, a: destination, b: next hop, value: metric
+EVENT_ROUTE_DEL = 3  # detail: prefix length, a: destination, b: next hop
+EVENT_TIMER = 4  # value: lag, in µs
+
+_EVENT_NAMES = {EVENT_MESSAGE_IN: "msg-in", EVENT_MESSAGE_OUT: "msg-out", EVENT_ROUTE_ADD: "route-add",
+                EVENT_ROUTE_DEL: "route-del", EVENT_TIMER: "timer"}
+
+# timestamp, kind, detail, a, b, value
+_EVENT = struct.Struct("!dBB4s4sI")
+_MAGIC = b"LRPF"
+_VERSION = 1
+# magic, version, number of events
+_HEADER = struct.Struct("!4sBI")
+
+_NULL = b"\x00\x00\x00\x00"
+
+
+class FlightRecorder:
+    """Keep the last protocol events in a fixed-size ring buffer.
+
+    Each event is packed as a fixed-size binary record in a preallocated
+    buffer: recording an event costs one `struct.pack_into`, whatever the
+    logging level. The buffer can be dumped to a file, and decoded with the
+    `events` command."""
+    logger = logging.getLogger("FlightRecorder")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity * _EVENT.size)
+        self._next = 0
+        self._count = 0
+
+    def record(self, kind: int, detail: int = 0, a: bytes = _NULL, b: bytes = _NULL, value: int = 0):
+        _EVENT.pack_into(self._buffer, self._next * _EVENT.size, time.time(), kind, detail, a, b, value)
+        self._next += 1
+        if self._next == self.capacity:
+            self._next = 0
+        self._count += 1
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def dump(self, path: str = None) -> str:
+        """Write the recorded events, from the oldest to the newest, in a file.
+        Return the path of this file."""
+        if path is None:
+            path = os.path.join(lrp.conf['diagnostics_directory'],
+                                "lrp-%d-%s.events" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        nb_events = len(self)
+        start = self._next if self._count > self.capacity else 0
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, nb_events))
+            f.write(self._buffer[start * _EVENT.size:nb_events * _EVENT.size])
+            f.write(self._buffer[0:start * _EVENT.size])
+        self.logger.warning("%d events dumped in %s", nb_events, path)
+        return path
+
+
+def read_events(path: str):
+    """Read a dump of a FlightRecorder. Generate the events as (timestamp, kind,
+    detail, a, b, value) tuples."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, nb_events = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception("%s: not a LRP events dump (or unsupported version)" % path)
+    for i in range(nb_events):
+        yield _EVENT.unpack_from(data, _HEADER.size + i * _EVENT.size)
+
+
+def format_event(timestamp, kind, detail, a, b, value) -> str:
+    """Return a human-readable representation of an event."""
+    # Imported here: lrp.message depends on lrp.tools, which depends on us
+    from lrp.message import MessageType
+    a, b = socket.inet_ntoa(a), socket.inet_ntoa(b)
+
+    result = "%s.%06d %-9s " % (time.strftime("%H:%M:%S", time.localtime(timestamp)),
+                                (timestamp % 1) * 1e6, _EVENT_NAMES.get(kind, kind))
+    if kind == EVENT_MESSAGE_IN:
+        result += "%s from %s%s" % (MessageType(detail), a, " (broadcast)" if value else "")
+    elif kind == EVENT_MESSAGE_OUT:
+        result += "%s to %s" % (MessageType(detail), a if a != "0.0.0.0" else "broadcast")
+    elif kind == EVENT_ROUTE_ADD:
+        result += "%s/%d through %s[%d]" % (a, detail, b, value)
+    elif kind == EVENT_ROUTE_DEL:
+        result += "%s/%d through %s" % (a, detail, b)
+    elif kind == EVENT_TIMER:
+        result += "lag %dµs" % value
+    return result
+
+
+@click.command()
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+def events(dump):
+    """Print the events of a flight recorder dump."""
+    for event in read_events(dump):
+        print(format_event(*event))
@@ -0,0 +1,604 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import abc
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict, FrozenSet, Optional, Set, Tuple
+
+import pyroute2
+from pyroute2.ipdb.main import IPDB
+from pyroute2.netlink import nlmsg, NLM_F_REQUEST, NLM_F_ACK, NLM_F_CREATE, NLM_F_EXCL, NLM_F_REPLACE, NLM_F_DUMP
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl import rt_scope, RTM_NEWROUTE
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+import lrp
+from lrp.kernel_worker import SyncProgrammer
+from lrp.tools import Address, Subnet, DEFAULT_ROUTE
+
+# State of a kernel route. `neighbor` is True for a link-scope route towards a
+# neighbor, in which case `gateways` is empty.
+KernelRoute = namedtuple("KernelRoute", ("neighbor", "gateways"))
+
+
+def parse_route(msg) -> Tuple[Subnet, KernelRoute]:
+    """Return the destination and the state of a route, from a rtnetlink route
+    message."""
+    destination = Subnet(msg.get_attr('RTA_DST') or "0.0.0.0", prefix=msg['dst_len'])
+    if msg['scope'] == rt_scope['link']:
+        return destination, KernelRoute(True, frozenset())
+    if msg.get_attr('RTA_MULTIPATH'):
+        return destination, KernelRoute(False, frozenset(Address(nh.get_attr('RTA_GATEWAY'))
+                                                         for nh in msg.get_attr('RTA_MULTIPATH')))
+    if msg.get_attr('RTA_GATEWAY') is None:
+        # Through a nexthop object: the gateways are not in the message. See
+        # NexthopRoutes.
+        return destination, KernelRoute(False, frozenset())
+    return destination, KernelRoute(False, frozenset((Address(msg.get_attr('RTA_GATEWAY')),)))
+
+
+# Nexthop objects (Linux 5.3+), not provided by pyroute2. See linux/nexthop.h.
+RTM_NEWNEXTHOP = 104
+RTM_DELNEXTHOP = 105
+RTM_GETNEXTHOP = 106
+RTNH_F_ONLINK = 4
+RTA_NH_ID = 30
+
+
+class nhmsg(nlmsg):
+    fields = (('family', 'B'),
+              ('scope', 'B'),
+              ('protocol', 'B'),
+              ('resvd', 'B'),
+              ('flags', 'I'))
+    nla_map = (('NHA_UNSPEC', 'none'),
+               ('NHA_ID', 'uint32'),
+               # Array of struct nexthop_grp. See `_NEXTHOP_GRP`.
+               ('NHA_GROUP', 'cdata'),
+               ('NHA_GROUP_TYPE', 'uint16'),
+               ('NHA_BLACKHOLE', 'flag'),
+               ('NHA_OIF', 'uint32'),
+               ('NHA_GATEWAY', 'ip4addr'))
+
+
+# Member of a nexthop group: id, weight - 1, reserved
+_NEXTHOP_GRP = struct.Struct("=IBxH")
+
+if RTA_NH_ID < len(rtmsg.nla_map):
+    nh_rtmsg = rtmsg
+else:
+    class nh_rtmsg(rtmsg):
+        """Route message, with the RTA_NH_ID attribute."""
+        # pyroute2 compiles the attributes map once per class, but the flag is
+        # inherited from rtmsg
+        _nlmsg_base__compiled_nla = False
+        nla_map = tuple(rtmsg.nla_map) + \
+            tuple(('RTA_UNKNOWN_%d' % i, 'hex') for i in range(len(rtmsg.nla_map), RTA_NH_ID)) + \
+            (('RTA_NH_ID', 'uint32'),)
+
+
+class KernelRoutes(metaclass=abc.ABCMeta):
+    """Programming of the LRP routes in the kernel. Subclasses implement a
+    given netlink backend.
+
+    Changes may be delayed until the next `flush`, which the event loop calls
+    before waiting for new events."""
+    logger = logging.getLogger("KernelRoutes")
+    # Whether the changes are applied by the programmer, or at once
+    uses_programmer = False
+
+    def __init__(self, interface_idx: int, account_kernel_call: Callable[[str, float, str], None],
+                 programmer: SyncProgrammer = None):
+        """Constructor.
+
+        interface_idx: the index of the interface of the neighbors, unless
+          given to `add_neighbor_route`
+        account_kernel_call: called as `(name, start, subsystem)` after each
+          kernel call. See `NetlinkRoutingTable._account_kernel_call`.
+        programmer: applies the changes, if the backend supports it. Default:
+          a SyncProgrammer."""
+        self.interface_idx = interface_idx
+        self._account_kernel_call = account_kernel_call
+        self.programmer = programmer if programmer is not None else SyncProgrammer()
+        # If set, routes are left in the kernel on exit, for a warm restart
+        self.keep_kernel_state = False
+
+    def __enter__(self):
+        return self
+
+    @abc.abstractmethod
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Remove all the routes owned by LRP, unless `keep_kernel_state` is
+        set."""
+
+    @abc.abstractmethod
+    def route(self, destination: Subnet) -> Optional[KernelRoute]:
+        """Return the kernel route towards `destination`, or None."""
+
+    @abc.abstractmethod
+    def routes(self) -> Dict[Subnet, KernelRoute]:
+        """Return all the kernel routes owned by LRP."""
+
+    @abc.abstractmethod
+    def add_neighbor_route(self, neighbor: Subnet, interface_idx: int = None):
+        """Add a link-scope route towards `neighbor`, through the interface
+        `interface_idx` (default: the interface given to the constructor).
+        There should not be any route towards it."""
+
+    @abc.abstractmethod
+    def add_nexthop(self, destination: Subnet, next_hop: Address):
+        """Add `next_hop` to the route towards `destination`, creating the route
+        if needed."""
+
+    @abc.abstractmethod
+    def del_nexthop(self, destination: Subnet, next_hop: Address) -> bool:
+        """Remove `next_hop` from the route towards `destination`. Return False
+        if the route was removed, as it has no more next hop."""
+
+    @abc.abstractmethod
+    def remove_route(self, destination: Subnet):
+        """Remove the route towards `destination`."""
+
+    def flush(self):
+        """Send the pending changes to the kernel."""
+        pass
+
+    def kernel_changed(self, destination: Subnet, route: Optional[KernelRoute]):
+        """Signal that the kernel route towards `destination` is now `route`
+        (None if removed), maybe because of an external change."""
+        pass
+
+    def memory_structures(self) -> Dict[str, object]:
+        """Return the structures to be included in memory reports."""
+        return {}
+
+
+class IpdbRoutes(KernelRoutes):
+    """Backend based on a pyroute2 IPDB, which mirrors all the kernel routes,
+    links and neighbours. Each change is committed synchronously."""
+
+    def __init__(self, interface_idx, account_kernel_call, programmer=None):
+        super().__init__(interface_idx, account_kernel_call, programmer)
+        self.ipdb = IPDB()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.keep_kernel_state:
+            for route in self.ipdb.routes:
+                if route['proto'] == lrp.conf['netlink']['proto_number']:
+                    self._commit(route.remove())
+        self.ipdb.release()
+
+    def _commit(self, transaction):
+        """Commit an IPDB transaction, accounting for its cost."""
+        start = time.perf_counter()
+        transaction.commit()
+        self._account_kernel_call("ipdb.commit", start, "rtnetlink")
+
+    def route(self, destination):
+        try:
+            route = self.ipdb.routes[str(destination)]
+        except KeyError:
+            return None
+        if route['scope'] == rt_scope['link']:
+            return KernelRoute(True, frozenset())
+        if route['multipath']:
+            return KernelRoute(False, frozenset(Address(nh['gateway']) for nh in route['multipath']))
+        return KernelRoute(False, frozenset((Address(route['gateway']),)))
+
+    def routes(self):
+        routes = {}
+        for route in self.ipdb.routes:
+            if route['proto'] == lrp.conf['netlink']['proto_number']:
+                destination = DEFAULT_ROUTE if route['dst'] == "default" else Subnet(route['dst'])
+                routes[destination] = self.route(destination)
+        return routes
+
+    def add_neighbor_route(self, neighbor, interface_idx=None):
+        self._commit(self.ipdb.routes.add({
+            'dst': str(neighbor),
+            'oif': interface_idx if interface_idx is not None else self.interface_idx,
+            'scope': rt_scope['link'],
+            'proto': lrp.conf['netlink']['proto_number']}))
+
+    def add_nexthop(self, destination, next_hop):
+        try:
+            route = self.ipdb.routes[str(destination)]
+        except KeyError:
+            self._commit(self.ipdb.routes.add({
+                'dst': str(destination),
+                'multipath': [{'gateway': str(next_hop)}],
+                'proto': lrp.conf['netlink']['proto_number']}))
+        else:
+            self._commit(route.add_nh({'gateway': str(next_hop)}))
+
+    def del_nexthop(self, destination, next_hop):
+        route = self.ipdb.routes[str(destination)]
+        try:
+            self._commit(route.del_nh({'gateway': str(next_hop)}))
+        except KeyError:  # 'attempt to delete nexthop from non-multipath route': no more next hop
+            self._commit(route.remove())
+            return False
+        return True
+
+    def remove_route(self, destination):
+        self._commit(self.ipdb.routes[str(destination)].remove())
+
+    def memory_structures(self):
+        return {'ipdb.routes': list(self.ipdb.routes),
+                'ipdb.interfaces': [self.ipdb.interfaces[idx] for idx in self.ipdb.by_index],
+                'ipdb.neighbours': list(self.ipdb.neighbours[self.interface_idx].raw.values())}
+
+
+class IPRouteRoutes(KernelRoutes):
+    """Backend based on a single rtnetlink socket. Only the routes owned by LRP
+    (see lrp.conf['netlink']['proto_number']) are known, in a local index.
+
+    Changes are applied to the index at once, but sent to the kernel only on
+    `flush`: a route changed many times in the meantime is sent once, with its
+    final state. Flushed changes are sent by the programmer; those waiting for
+    it are merged the same way."""
+    uses_programmer = True
+
+    def __init__(self, interface_idx, account_kernel_call, programmer=None):
+        super().__init__(interface_idx, account_kernel_call, programmer)
+        self.ipr = pyroute2.IPRoute()
+        self._routes: Dict[Subnet, KernelRoute] = {}
+        # Destinations whose route changed since last flush
+        self._dirty: Set[Subnet] = set()
+        # Flushed routes, waiting to be sent by the programmer. Shared with its
+        # thread.
+        self._outbox: Dict[Subnet, Optional[KernelRoute]] = {}
+        self._outbox_lock = threading.Lock()
+        # Interface of each neighbor route
+        self._neighbor_interfaces: Dict[Subnet, int] = {}
+
+    def __enter__(self):
+        # Load the routes left by a previous instance, so they are cleaned too
+        start = time.perf_counter()
+        for msg in self.ipr.get_routes(family=socket.AF_INET, proto=lrp.conf['netlink']['proto_number']):
+            self._load_route(msg)
+        self._account_kernel_call("iproute.dump", start, None)
+        self.logger.debug("%d LRP routes already in the kernel", len(self._routes))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.keep_kernel_state:
+            for destination in list(self._routes.keys()):
+                self.remove_route(destination)
+        self.flush()
+        self.programmer.wait()
+        self.ipr.close()
+
+    def _load_route(self, msg) -> Tuple[Subnet, KernelRoute]:
+        """Index a route found in the kernel. Return its destination and
+        state."""
+        destination, route = parse_route(msg)
+        self._routes[destination] = route
+        if route.neighbor:
+            self._neighbor_interfaces[destination] = msg.get_attr('RTA_OIF')
+        return destination, route
+
+    def _set(self, destination: Subnet, route: Optional[KernelRoute]):
+        if route is None:
+            self._routes.pop(destination, None)
+        else:
+            self._routes[destination] = route
+        self._dirty.add(destination)
+
+    def route(self, destination):
+        return self._routes.get(destination)
+
+    def routes(self):
+        return dict(self._routes)
+
+    def add_neighbor_route(self, neighbor, interface_idx=None):
+        self._neighbor_interfaces[neighbor] = interface_idx if interface_idx is not None else self.interface_idx
+        self._set(neighbor, KernelRoute(True, frozenset()))
+
+    def add_nexthop(self, destination, next_hop):
+        route = self._routes.get(destination)
+        gateways = frozenset() if route is None or route.neighbor else route.gateways
+        self._set(destination, KernelRoute(False, gateways | {next_hop}))
+
+    def del_nexthop(self, destination, next_hop):
+        gateways = self._routes[destination].gateways - {next_hop}
+        self._set(destination, KernelRoute(False, gateways) if gateways else None)
+        return bool(gateways)
+
+    def remove_route(self, destination):
+        self._set(destination, None)
+
+    def flush(self):
+        if not self._dirty:
+            return
+        with self._outbox_lock:
+            # If the outbox is not empty, it is already waiting for the
+            # programmer
+            submit = not self._outbox
+            self._outbox.update((destination, self._routes.get(destination)) for destination in self._dirty)
+        self._dirty.clear()
+        if submit:
+            self.programmer.submit(self._send_outbox)
+
+    def _send_outbox(self):
+        with self._outbox_lock:
+            routes, self._outbox = self._outbox, {}
+        start = time.perf_counter()
+        self._send_routes(routes)
+        self._account_kernel_call("iproute.flush", start, "rtnetlink")
+
+    def _send_routes(self, routes: Dict[Subnet, Optional[KernelRoute]]):
+        """Send the final state of some routes to the kernel (None for a
+        removed route)."""
+        for destination, route in routes.items():
+            try:
+                self._send_route(destination, route)
+            except NetlinkError as e:
+                if route is None and e.code == errno.ESRCH:
+                    # Already removed, ok
+                    continue
+                self.logger.error("Unable to update the kernel route towards %s: %s", destination, e)
+
+    def _send_route(self, destination: Subnet, route: Optional[KernelRoute]):
+        """Send the final state of a route to the kernel."""
+        dst = "%s/%d" % (socket.inet_ntoa(destination.as_bytes), destination.prefix)
+        if route is None:
+            # Any scope: neighbor routes are link-scoped
+            self.ipr.route("del", dst=dst, scope=rt_scope['nowhere'], proto=lrp.conf['netlink']['proto_number'])
+        elif route.neighbor:
+            self.ipr.route("replace", dst=dst, oif=self._neighbor_interfaces.get(destination, self.interface_idx),
+                           scope=rt_scope['link'], proto=lrp.conf['netlink']['proto_number'])
+        elif len(route.gateways) == 1:
+            self.ipr.route("replace", dst=dst, gateway=str(next(iter(route.gateways))),
+                           proto=lrp.conf['netlink']['proto_number'])
+        else:
+            self.ipr.route("replace", dst=dst, multipath=[{'gateway': str(nh)} for nh in route.gateways],
+                           proto=lrp.conf['netlink']['proto_number'])
+
+    def kernel_changed(self, destination, route):
+        # Notifications of our own changes match the index, unless the route
+        # changed again since, and will be sent soon
+        if destination not in self._dirty and destination not in self._outbox and \
+                self._routes.get(destination) != route:
+            self.logger.warning("LRP route towards %s changed outside LRP: restore it", destination)
+            self._dirty.add(destination)
+
+    def memory_structures(self):
+        return {'iproute.routes': self._routes}
+
+
+class NexthopRoutes(IPRouteRoutes):
+    """Backend based on kernel nexthop objects (Linux 5.3+). Each gateway is a
+    nexthop object, and routes point to the nexthop group of their set of
+    gateways, shared by all the routes with the same set. When all the routes
+    sharing a group move to the same new set of gateways (e.g. when a neighbor
+    goes away), only the group is updated, not the routes.
+
+    As with IPRouteRoutes, changes are sent on `flush`, by the programmer. The
+    nexthop objects and groups are only handled by the programmer."""
+
+    def __init__(self, interface_idx, account_kernel_call, programmer=None):
+        super().__init__(interface_idx, account_kernel_call, programmer)
+        self.ipr.marshal.msg_map[RTM_NEWNEXTHOP] = nhmsg
+        self.ipr.marshal.msg_map[RTM_NEWROUTE] = nh_rtmsg
+        # Nexthop objects of the gateways, and groups of the sets of gateways,
+        # by id
+        self._nexthops: Dict[Address, int] = {}
+        self._groups: Dict[FrozenSet[Address], int] = {}
+        # Routes using each group, by set of gateways, and the other way round
+        self._group_users: Dict[FrozenSet[Address], Set[Subnet]] = {}
+        self._route_groups: Dict[Subnet, FrozenSet[Address]] = {}
+        self._next_id = lrp.conf['netlink']['nexthop_first_id']
+
+    def __enter__(self):
+        # Load the nexthop objects and the routes left by a previous instance,
+        # so they are reused or cleaned
+        start = time.perf_counter()
+        gateways = {}
+        groups = {}
+        for msg in self.ipr.nlm_request(nhmsg(), RTM_GETNEXTHOP, NLM_F_REQUEST | NLM_F_DUMP):
+            if msg['protocol'] != lrp.conf['netlink']['proto_number']:
+                continue
+            if msg.get_attr('NHA_GROUP') is not None:
+                groups[msg.get_attr('NHA_ID')] = [member for member, _, _ in
+                                                  _NEXTHOP_GRP.iter_unpack(msg.get_attr('NHA_GROUP'))]
+            else:
+                gateways[msg.get_attr('NHA_ID')] = Address(msg.get_attr('NHA_GATEWAY'))
+        self._nexthops = {gateway: nhid for nhid, gateway in gateways.items()}
+        groups = {nhid: frozenset(gateways[member] for member in members) for nhid, members in groups.items()}
+        self._groups = {gateways_set: nhid for nhid, gateways_set in groups.items()}
+        for msg in self.ipr.get_routes(family=socket.AF_INET, proto=lrp.conf['netlink']['proto_number']):
+            destination, route = self._load_route(msg)
+            if msg.get_attr('RTA_NH_ID') in groups:
+                route = KernelRoute(False, groups[msg.get_attr('RTA_NH_ID')])
+                self._use_group(destination, route.gateways)
+                self._routes[destination] = route
+        self._collect()
+        self._account_kernel_call("nexthop.dump", start, None)
+        self.logger.debug("%d LRP routes and %d nexthop groups already in the kernel",
+                          len(self._routes), len(self._groups))
+        return self
+
+    def _send_routes(self, routes):
+        # Groups whose routes all move to the same new set of gateways, and
+        # this set
+        moves = {}
+        for destination, route in routes.items():
+            old_gateways = self._route_groups.get(destination)
+            if old_gateways is None:
+                continue
+            new_gateways = route.gateways if route is not None and not route.neighbor else None
+            if moves.get(old_gateways, new_gateways) != new_gateways or old_gateways == new_gateways:
+                new_gateways = None
+            moves[old_gateways] = new_gateways
+
+        routes = dict(routes)
+        for old_gateways, new_gateways in moves.items():
+            if new_gateways is None or new_gateways in self._groups or \
+                    not all(destination in routes for destination in self._group_users[old_gateways]):
+                continue
+            nhid = self._groups[old_gateways]
+            try:
+                self._nexthop_request(RTM_NEWNEXTHOP, NLM_F_REPLACE, nhid, group=new_gateways)
+            except NetlinkError as e:
+                self.logger.warning("Unable to update the nexthop group %d: %s", nhid, e)
+                continue
+            # The routes use the updated group
+            del self._groups[old_gateways]
+            self._groups[new_gateways] = nhid
+            self._group_users[new_gateways] = self._group_users.pop(old_gateways)
+            for destination in self._group_users[new_gateways]:
+                self._route_groups[destination] = new_gateways
+                del routes[destination]
+
+        super()._send_routes(routes)
+        self._collect()
+
+    def _send_route(self, destination, route):
+        if route is None or route.neighbor:
+            super()._send_route(destination, route)
+            gateways = None
+        else:
+            gateways = route.gateways
+            msg = nh_rtmsg()
+            msg['family'] = socket.AF_INET
+            msg['dst_len'] = destination.prefix
+            msg['table'] = 254  # RT_TABLE_MAIN
+            msg['proto'] = lrp.conf['netlink']['proto_number']
+            msg['scope'] = rt_scope['universe']
+            msg['type'] = 1  # RTN_UNICAST
+            msg['attrs'] = [('RTA_DST', socket.inet_ntoa(destination.as_bytes)),
+                            ('RTA_NH_ID', self._group(gateways))]
+            tuple(self.ipr.nlm_request(msg, RTM_NEWROUTE,
+                                       NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE))
+        self._use_group(destination, gateways)
+
+    def _use_group(self, destination: Subnet, gateways: Optional[FrozenSet[Address]]):
+        """Record that the route towards `destination` uses the group of
+        `gateways` (None: no group)."""
+        old_gateways = self._route_groups.pop(destination, None)
+        if old_gateways is not None:
+            self._group_users[old_gateways].discard(destination)
+        if gateways is not None:
+            self._route_groups[destination] = gateways
+            self._group_users.setdefault(gateways, set()).add(destination)
+
+    def _nexthop_request(self, msg_type: int, flags: int, nhid: int, gateway: Address = None,
+                         group: FrozenSet[Address] = None):
+        """Send a nexthop object message, for a gateway or a group of
+        gateways."""
+        msg = nhmsg()
+        if msg_type == RTM_NEWNEXTHOP:
+            msg['protocol'] = lrp.conf['netlink']['proto_number']
+        msg['attrs'] = [('NHA_ID', nhid)]
+        if gateway is not None:
+            msg['family'] = socket.AF_INET
+            msg['flags'] = RTNH_F_ONLINK
+            msg['attrs'] += [('NHA_GATEWAY', str(gateway)),
+                             ('NHA_OIF', self._neighbor_interfaces.get(Subnet(gateway), self.interface_idx))]
+        elif group is not None:
+            msg['attrs'].append(('NHA_GROUP', b"".join(_NEXTHOP_GRP.pack(self._nexthop(gateway), 0, 0)
+                                                       for gateway in group)))
+        tuple(self.ipr.nlm_request(msg, msg_type, NLM_F_REQUEST | NLM_F_ACK | flags))
+
+    def _create(self, gateway: Address = None, group: FrozenSet[Address] = None) -> int:
+        """Create a nexthop object with a free id. Return its id."""
+        while True:
+            nhid, self._next_id = self._next_id, self._next_id + 1
+            try:
+                self._nexthop_request(RTM_NEWNEXTHOP, NLM_F_CREATE | NLM_F_EXCL, nhid, gateway, group)
+            except NetlinkError as e:
+                if e.code != errno.EEXIST:
+                    raise
+                # Used by someone else
+            else:
+                return nhid
+
+    def _nexthop(self, gateway: Address) -> int:
+        """Return the id of the nexthop object of `gateway`, creating it if
+        needed."""
+        if gateway not in self._nexthops:
+            self._nexthops[gateway] = self._create(gateway=gateway)
+        return self._nexthops[gateway]
+
+    def _group(self, gateways: FrozenSet[Address]) -> int:
+        """Return the id of the nexthop group of `gateways`, creating it if
+        needed."""
+        if gateways not in self._groups:
+            self._groups[gateways] = self._create(group=gateways)
+        return self._groups[gateways]
+
+    def _collect(self):
+        """Remove the groups no more used by any route, then the nexthop
+        objects no more part of any group."""
+        for gateways in [gateways for gateways in self._groups if not self._group_users.get(gateways)]:
+            self._delete(self._groups.pop(gateways))
+            self._group_users.pop(gateways, None)
+        used_gateways = set().union(*self._groups.keys())
+        for gateway in [gateway for gateway in self._nexthops if gateway not in used_gateways]:
+            self._delete(self._nexthops.pop(gateway))
+
+    def _delete(self, nhid: int):
+        try:
+            self._nexthop_request(RTM_DELNEXTHOP, 0, nhid)
+        except NetlinkError as e:
+            if e.code != errno.ENOENT:
+                self.logger.error("Unable to remove the nexthop object %d: %s", nhid, e)
+
+    def kernel_changed(self, destination, route):
+        # Notified routes through a group have no gateways: only check they are
+        # still there
+        own_route = self._routes.get(destination)
+        if route is not None and own_route is not None and not route.neighbor and not own_route.neighbor \
+                and not route.gateways:
+            return
+        super().kernel_changed(destination, route)
+
+    def memory_structures(self):
+        return {'iproute.routes': self._routes,
+                'nexthop.nexthops': self._nexthops,
+                'nexthop.groups': self._groups}
+
+
+# Available backends, by name. See lrp.conf['netlink']['route_backend'].
+ROUTE_BACKENDS = {
+    "ipdb": IpdbRoutes,
+    "iproute": IPRouteRoutes,
+    "nexthop": NexthopRoutes,
+}
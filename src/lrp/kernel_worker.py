@@ -0,0 +1,145 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import collections
+import logging
+import queue
+import socket
+import threading
+from typing import Callable
+
+
+class SyncProgrammer:
+    """Apply kernel changes at once, in the calling thread.
+
+    Kernel backends submit their changes to a programmer, instead of applying
+    them directly, so that they can be offloaded to a `KernelWorker`."""
+    logger = logging.getLogger("KernelProgrammer")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def submit(self, function: Callable, *args, callback: Callable = None):
+        """Apply a change by calling `function(*args)`. If set, `callback` is
+        then called with the result, from the thread of the event loop."""
+        result = function(*args)
+        if callback is not None:
+            callback(result)
+
+    def wait(self):
+        """Wait until all the submitted changes are applied."""
+        pass
+
+    @property
+    def pending(self) -> int:
+        """Number of submitted changes not yet applied."""
+        return 0
+
+
+class KernelWorker(SyncProgrammer):
+    """Apply kernel changes from a dedicated thread, in submission order, so
+    that the event loop keeps handling messages while the kernel catches up.
+
+    The queue is bounded: when it is full, `submit` blocks until the worker
+    makes some room. Completion callbacks are run by `handle_completions`,
+    which the event loop should call each time the socket of the worker (see
+    `fileno`) is readable."""
+
+    def __init__(self, queue_size: int):
+        self._changes = queue.Queue(maxsize=queue_size)
+        self._completions = collections.deque()
+        self._completion_socket, self._wakeup_socket = socket.socketpair()
+        self._completion_socket.setblocking(False)
+        self._wakeup_socket.setblocking(False)
+        self._thread = threading.Thread(target=self._run, name="KernelWorker", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wait()
+        # Stop the worker
+        self._changes.put(None)
+        self._thread.join()
+        self._completion_socket.close()
+        self._wakeup_socket.close()
+
+    def fileno(self) -> int:
+        return self._completion_socket.fileno()
+
+    def submit(self, function, *args, callback=None):
+        self._changes.put((function, args, callback))
+
+    def wait(self):
+        self._changes.join()
+
+    @property
+    def pending(self) -> int:
+        return self._changes.qsize()
+
+    def _run(self):
+        while True:
+            change = self._changes.get()
+            try:
+                if change is None:
+                    return
+                function, args, callback = change
+                try:
+                    result = function(*args)
+                except Exception:
+                    self.logger.exception("Unable to apply a kernel change")
+                    continue
+                if callback is not None:
+                    self._completions.append((callback, result))
+                    try:
+                        self._wakeup_socket.send(b"\x00")
+                    except BlockingIOError:
+                        # The event loop has already been woken up
+                        pass
+            finally:
+                self._changes.task_done()
+
+    def handle_completions(self):
+        """Run the callbacks of the applied changes."""
+        try:
+            while self._completion_socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self._completions:
+            callback, result = self._completions.popleft()
+            callback(result)
@@ -35,115 +35,389 @@
 import errno
 import logging
 import netfilterqueue
-import select
+import selectors
+import signal
 import socket
 import struct
-from typing import Optional, List, Tuple, Dict
+import time
+import tracemalloc
+from typing import Optional, List, Tuple, Dict, Set, Union
 
 import click
-import iptc
 import pyroute2
-from pyroute2.ipdb.main import IPDB
-from pyroute2.ipdb.routes import Route
-from pyroute2.netlink.rtnl import ifinfmsg, rt_scope
+from pyroute2.netlink.rtnl import ifinfmsg
 
 import lrp
 from lrp.daemon import LrpProcess
-from lrp.message import Message
+from lrp.flight_recorder import EVENT_MESSAGE_OUT, EVENT_TIMER
+from lrp.kernel_routes import ROUTE_BACKENDS
+from lrp.kernel_worker import KernelWorker, SyncProgrammer
+from lrp.loop_avoidance import LOOP_AVOIDANCE_BACKENDS
+from lrp.message import Message, RREP
+from lrp.control import ControlServer
+from lrp.metrics import MetricsServer
+from lrp.netlink_monitor import NetlinkMonitor
+from lrp.nfqueue_workers import NfqueueWorkers
+from lrp.replay import Recorder
+from lrp.snapshot import save_snapshot, restore_snapshot
 from lrp.tools import Address, Subnet, RoutingTable, DEFAULT_ROUTE
 
+# Linux socket option reporting the number of datagrams dropped by a socket.
+# Not always exposed by the socket module.
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+
+# Not always exposed by the socket module either
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+# Source and destination addresses, in an IPv4 header
+_IPV4_ADDRESSES = struct.Struct("!4s4s")
 
-class LinuxLrpProcess(LrpProcess):
-    """Linux toolbox to make LrpProcess works on native linux. It supposes that
-    netlink and netfilter are available on the system."""
 
-    def __init__(self, interface, **remaining_kwargs):
-        self._own_ip = None
-        self.interface = interface
+class LrpInterface:
+    """An interface LRP runs on: a copy of its kernel state, and its service
+    sockets, bound to its address."""
+    logger = logging.getLogger("LRP")
+
+    def __init__(self, name: str, watch_routes: bool = False):
+        """Constructor.
+
+        name: the name of the interface
+        watch_routes: whether its NetlinkMonitor also follows the LRP routes.
+          See `NetlinkMonitor`."""
+        self.name = name
         # Compute the interface id, based on its name
         with pyroute2.IPRoute() as ipr:
             try:
-                self.interface_idx = ipr.link_lookup(ifname=self.interface)[0]
+                self.idx = ipr.link_lookup(ifname=name)[0]
             except IndexError:
-                raise Exception("%s: unknown interface" % self.interface)
+                raise Exception("%s: unknown interface" % name)
+        # Copy of the kernel state, kept up to date from now on
+        self.netlink_monitor = NetlinkMonitor(self.idx, watch_routes).__enter__()
+        self.output_multicast_socket = None
+        self.input_multicast_socket = None
+        self.unicast_socket = None
 
-        super().__init__(**remaining_kwargs)
-        self.routing_table = NetlinkRoutingTable(self)
-        self.la_queue = netfilterqueue.NetfilterQueue()
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.netlink_monitor.__exit__(exc_type, exc_val, exc_tb)
 
-    def __enter__(self):
-        # Initialize sockets
-        with pyroute2.IPRoute() as ip:
-            iface_address = ip.get_addr(index=self.interface_idx)[0].get_attr('IFA_ADDRESS')
-        self.logger.debug("Guess %s's address is '%s'", self.interface, iface_address)
-        iface_address_as_bytes = socket.inet_aton(iface_address)
+    @property
+    def address(self) -> Address:
+        address = self.netlink_monitor.address
+        if address is None:
+            raise Exception("%s: interface has no IP address" % self.name)
+        return address
+
+    @property
+    def has_sockets(self) -> bool:
+        return self.unicast_socket is not None
+
+    @property
+    def input_sockets(self) -> Tuple[socket.socket, socket.socket]:
+        return self.input_multicast_socket, self.unicast_socket
+
+    def open_sockets(self):
+        address = self.address
+        self.logger.debug("Guess %s's address is '%s'", self.name, address)
         multicast_address_as_bytes = socket.inet_aton(lrp.conf['service_multicast_address'])
 
-        self.logger.debug("Initialize output multicast socket ([%s]:%d)",
-                          lrp.conf['service_multicast_address'], lrp.conf['service_port'])
+        self.logger.debug("Initialize output multicast socket ([%s]:%d) on %s",
+                          lrp.conf['service_multicast_address'], lrp.conf['service_port'], self.name)
         self.output_multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.output_multicast_socket.bind((str(self.own_ip), 0))
+        self.output_multicast_socket.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_IF, address.as_bytes)
+        self.output_multicast_socket.bind((str(address), 0))
         self.output_multicast_socket.connect((lrp.conf['service_multicast_address'], lrp.conf['service_port']))
 
-        self.logger.debug("Initialize input multicast socket ([%s]:%d)",
-                          lrp.conf['service_multicast_address'], lrp.conf['service_port'])
+        self.logger.debug("Initialize input multicast socket ([%s]:%d) on %s",
+                          lrp.conf['service_multicast_address'], lrp.conf['service_port'], self.name)
         self.input_multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # One such socket per interface, all bound to the same address
+        self.input_multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.input_multicast_socket.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, self.name.encode())
         self.input_multicast_socket.setsockopt(socket.SOL_IP, socket.IP_ADD_MEMBERSHIP,
-                                               struct.pack("=4s4s", multicast_address_as_bytes, iface_address_as_bytes))
+                                               struct.pack("=4s4s", multicast_address_as_bytes, address.as_bytes))
         self.input_multicast_socket.bind((lrp.conf['service_multicast_address'], lrp.conf['service_port']))
 
-        self.logger.debug("Initialize unicast socket ([%s]:%d)", iface_address, lrp.conf['service_port'])
+        self.logger.debug("Initialize unicast socket ([%s]:%d)", address, lrp.conf['service_port'])
         self.unicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.unicast_socket.bind((str(self.own_ip), lrp.conf['service_port']))
+        self.unicast_socket.bind((str(address), lrp.conf['service_port']))
+
+    def close_sockets(self):
+        self.output_multicast_socket.close()
+        self.input_multicast_socket.close()
+        self.unicast_socket.close()
+        self.output_multicast_socket = self.input_multicast_socket = self.unicast_socket = None
+
+
+class LinuxLrpProcess(LrpProcess):
+    """Linux toolbox to make LrpProcess works on native linux. It supposes that
+    netlink and netfilter are available on the system.
+
+    Many interfaces may be used: each has its own service sockets and
+    neighbours, but they share the routing table, and the address of the
+    first one is the address of this node."""
+
+    def __init__(self, interfaces: Union[str, List[str]], metrics_address: str = None, record_path: str = None,
+                 state_path: str = None, control_address: str = None, **remaining_kwargs):
+        """Constructor.
+
+        interfaces: the name of the interface LRP should use, or a list of
+          them
+        metrics_address: where metrics should be served, if any. See
+          `lrp.metrics.MetricsServer`.
+        record_path: where inputs should be recorded, if any. See
+          `lrp.replay.Recorder`.
+        state_path: where the state is saved on exit, and restored from on
+          start, if any. See `lrp.snapshot`. The kernel state is then kept
+          between both.
+        control_address: path of the Unix socket serving the state, if any.
+          See `lrp.control.ControlServer`."""
+        if isinstance(interfaces, str):
+            interfaces = [interfaces]
+        self.metrics_address = metrics_address
+        self.metrics_server = None
+        self.control_address = control_address
+        self.control_server = None
+        # What the served node state was built from. See
+        # `_publish_control_state`.
+        self._control_key = None
+        self.record_path = record_path
+        self.state_path = state_path
+        # The LRP routes are followed through the first interface
+        self.interfaces = [LrpInterface(name, watch_routes=i == 0) for i, name in enumerate(interfaces)]
+        for interface in self.interfaces:
+            interface.netlink_monitor.link_listeners.append(
+                lambda link_up, interface=interface: self._link_changed(interface, link_up))
+            interface.netlink_monitor.address_listeners.append(
+                lambda address, interface=interface: self._address_changed(interface, address))
+        # Interface each neighbor was last heard on
+        self._neighbor_interfaces: Dict[Address, LrpInterface] = {}
+        # New addresses of the interfaces, not yet handled. See
+        # `_address_changed`.
+        self._address_changes: Dict[LrpInterface, Optional[Address]] = {}
+
+        super().__init__(**remaining_kwargs)
+        if lrp.conf['netlink']['kernel_worker']['enabled']:
+            self.kernel_programmer = KernelWorker(lrp.conf['netlink']['kernel_worker']['queue_size'])
+        else:
+            self.kernel_programmer = SyncProgrammer()
+        self.routing_table = NetlinkRoutingTable(self)
+        workers_conf = lrp.conf['netlink']['nfqueue_workers']
+        if workers_conf['count'] > 0:
+            self.la_queue = None
+            self.la_workers = NfqueueWorkers(lrp.conf['netlink']['netfilter_queue_nb'], workers_conf['count'],
+                                             workers_conf['dedup_interval'], workers_conf['rate_limit'],
+                                             lrp.conf['receive_buffer_size'], workers_conf['respawn_limit'])
+            self.metrics.gauge("lrp_nfqueue_worker_packets", "Packets received by the nfqueue workers",
+                               callback=lambda: self.la_workers.packets)
+            self.metrics.gauge("lrp_nfqueue_worker_duplicates", "Packets dropped by the nfqueue workers, as recently "
+                                                                "sent duplicates",
+                               callback=lambda: self.la_workers.duplicates)
+            self.metrics.gauge("lrp_nfqueue_worker_rate_limited", "Packets dropped by the rate limit of the nfqueue "
+                                                                  "workers",
+                               callback=lambda: self.la_workers.rate_limited)
+            self.metrics.gauge("lrp_nfqueue_worker_respawns", "Dead nfqueue workers restarted",
+                               callback=lambda: self.la_workers.respawns)
+        else:
+            self.la_queue = netfilterqueue.NetfilterQueue()
+            self.la_workers = None
+        # Non-routable packets waiting to be handled, as (source, destination,
+        # sender MAC) -> None. See `_queue_packet_handler`.
+        self._la_batch: Dict[Tuple[bytes, bytes, bytes], None] = {}
+        # Queued packets which may still be handled at this wake-up. See
+        # `_handle_la_queue`.
+        self._la_budget = 0
+
+        self.metrics.counter("lrp_nfqueue_packets_total", "Packets received from the loop-avoidance nfqueue")
+        self.metrics.counter("lrp_nfqueue_duplicates_total", "Queued packets merged with a previous one of their batch")
+        self.metrics.counter("lrp_nfqueue_over_budget_total", "Queued packets dropped unhandled, over the budget of "
+                                                              "their wake-up")
+        self.metrics.histogram("lrp_kernel_commit_duration_seconds", "Time spent committing to the kernel",
+                               ("subsystem",))
+        self.metrics.histogram("lrp_timer_lag_seconds", "Delay between the expected and real timer activation")
+        self.metrics.gauge("lrp_kernel_pending_changes", "Kernel changes waiting to be applied",
+                           callback=lambda: self.kernel_programmer.pending)
+        self.metrics.gauge("lrp_socket_drops", "Datagrams dropped by a full socket receive buffer", ("socket",))
+        self.metrics.gauge("lrp_netlink_overruns", "Overflows of the rtnetlink notification sockets, followed by a "
+                                                   "full dump", callback=lambda: sum(interface.netlink_monitor.overruns
+                                                                                     for interface in self.interfaces))
+        self.metrics.histogram("lrp_socket_batch_size", "Datagrams read from a socket at each wake-up", ("socket",),
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+        # Actions triggered by signals. They are run from the event loop, not
+        # from the signal handler.
+        self._signal_actions = {signal.SIGUSR1: self.profiler.toggle,
+                                signal.SIGUSR2: self.dump_diagnostics}
+
+        # All the inputs of the event loop. See `register_io`.
+        self.selector = selectors.DefaultSelector()
 
-        # Initialize the routing table
+    def __enter__(self):
+        for interface in self.interfaces:
+            self._open_service_sockets(interface)
+
+        # Follow the changes of the kernel state, then initialize the routing
+        # table
+        for interface in self.interfaces:
+            self.register_io(interface.netlink_monitor, interface.netlink_monitor.handle_events)
+        self.kernel_programmer.__enter__()
+        if isinstance(self.kernel_programmer, KernelWorker):
+            self.register_io(self.kernel_programmer, self.kernel_programmer.handle_completions)
         self.routing_table.__enter__()
+        if self.state_path is not None:
+            restore_snapshot(self.state_path, self, lrp.conf['warm_restart']['max_age'])
+        # Remove what a previous instance left in the kernel, and is not part
+        # of the (restored) state
+        self.routing_table.prune_kernel_state()
 
         # Initialize netfilter queue for loop-avoidance mechanism
-        def queue_packet_handler(packet):
-            """Handle a non-routable packet and activate corresponding LRP mechanisms"""
-            payload = packet.get_payload()
-            destination = socket.inet_ntoa(payload[16:20])
-            if self.is_sink:
-                self.handle_unknown_host(destination)
-            else:
-                source = socket.inet_ntoa(payload[12:16])
-                sender = ":".join(["%02x" % b for b in packet.get_hw()[0:6]])
-                self.handle_non_routable_packet(
-                    source=Address(source), destination=Address(destination),
-                    sender=Address(self.routing_table.get_ip_from_mac(sender)))
-            packet.drop()
-
-        self.la_queue.bind(lrp.conf['netlink']['netfilter_queue_nb'], queue_packet_handler)
+        if self.la_workers is not None:
+            self.la_workers.__enter__()
+            self.register_io(self.la_workers, self._handle_la_workers)
+            for i, sentinel in enumerate(self.la_workers.sentinels):
+                self.register_io(sentinel, lambda i=i, sentinel=sentinel: self._handle_dead_la_worker(i, sentinel))
+        elif lrp.conf['receive_buffer_size'] is not None:
+            self.la_queue.bind(lrp.conf['netlink']['netfilter_queue_nb'], self._queue_packet_handler,
+                               sock_len=lrp.conf['receive_buffer_size'])
+        else:
+            self.la_queue.bind(lrp.conf['netlink']['netfilter_queue_nb'], self._queue_packet_handler)
+        if self.la_queue is not None:
+            self.register_io(self.la_queue.get_fd(), self._handle_la_queue)
+
+        if self.metrics_address is not None:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_address).__enter__()
+        if self.control_address is not None:
+            self.control_server = ControlServer(self.control_address).__enter__()
+
+        # Signals wake up the event loop through this socket pair
+        self._signal_socket, self._signal_wakeup_socket = socket.socketpair()
+        self._signal_socket.setblocking(False)
+        self._signal_wakeup_socket.setblocking(False)
+        signal.set_wakeup_fd(self._signal_wakeup_socket.fileno())
+        for signum in self._signal_actions.keys():
+            signal.signal(signum, lambda signum, frame: None)
+        self.register_io(self._signal_socket, self._handle_signals)
+
+        if self.record_path is not None:
+            self.recorder = Recorder(self.record_path, self).__enter__()
 
         # Initialize LRP itself
         return super().__enter__()
 
+    def _open_service_sockets(self, interface: LrpInterface):
+        interface.open_sockets()
+        for sock in interface.input_sockets:
+            self._setup_input_socket(sock)
+            self.register_io(sock, lambda sock=sock: self._drain_socket(interface, sock))
+
+    def _close_service_sockets(self, interface: LrpInterface):
+        if not interface.has_sockets:
+            return
+        for sock in interface.input_sockets:
+            self.unregister_io(sock)
+        interface.close_sockets()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and not issubclass(exc_type, KeyboardInterrupt):
+            self.logger.error("Crash: dump diagnostics")
+            self.dump_diagnostics()
+
         # Clean LRP itself
         super().__exit__(exc_type, exc_val, exc_tb)
 
-        # Clean the routing table
+        # Clean the routing table, or keep it for the next instance
+        if self.state_path is not None:
+            save_snapshot(self.state_path, self)
+            self.routing_table.keep_kernel_state = True
         self.routing_table.__exit__(exc_type, exc_val, exc_tb)
+        self.kernel_programmer.__exit__(exc_type, exc_val, exc_tb)
 
         # Close sockets
         self.logger.debug("Close service sockets")
-        self.output_multicast_socket.close()
-        self.input_multicast_socket.close()
-        self.unicast_socket.close()
+        for interface in self.interfaces:
+            self._close_service_sockets(interface)
+            interface.__exit__(exc_type, exc_val, exc_tb)
+        self.selector.close()
 
         # Close netfilter-queue
-        self.la_queue.unbind()
+        if self.la_workers is not None:
+            self.la_workers.__exit__(exc_type, exc_val, exc_tb)
+        else:
+            self.la_queue.unbind()
+
+        if self.metrics_server is not None:
+            self.metrics_server.__exit__(exc_type, exc_val, exc_tb)
+        if self.control_server is not None:
+            self.control_server.__exit__(exc_type, exc_val, exc_tb)
+
+        # Restore signal handling
+        for signum in self._signal_actions.keys():
+            signal.signal(signum, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        self._signal_socket.close()
+        self._signal_wakeup_socket.close()
+        self.profiler.stop()
+
+        if self.recorder is not None:
+            self.recorder.__exit__(exc_type, exc_val, exc_tb)
 
     @property
     def own_ip(self) -> Address:
-        if self._own_ip is None:
-            with pyroute2.IPRoute() as ip:
-                try:
-                    self._own_ip = Address(ip.get_addr(index=self.interface_idx)[0].get_attr('IFA_ADDRESS'))
-                except IndexError:
-                    raise Exception("%s: interface has no IP address" % self.interface)
-        return self._own_ip
+        return self.interfaces[0].address
+
+    def interface_of(self, neighbor: Address) -> LrpInterface:
+        """Return the interface a neighbor was last heard on, or else the one
+        where its layer 2 address is known. Default: the first interface."""
+        try:
+            return self._neighbor_interfaces[neighbor]
+        except KeyError:
+            pass
+        for interface in self.interfaces:
+            if interface.netlink_monitor.mac_of(neighbor) is not None:
+                return interface
+        return self.interfaces[0]
+
+    def _link_changed(self, interface: LrpInterface, link_up: bool):
+        """Stop emitting DIOs while all the interfaces are down, and announce
+        ourselves quickly when one comes back."""
+        others_up = any(other.netlink_monitor.link_up for other in self.interfaces if other is not interface)
+        if not link_up:
+            self.logger.warning("%s is down", interface.name)
+            if not others_up:
+                self.dio_trickle.stop()
+        else:
+            self.logger.warning("%s is up again", interface.name)
+            self.dio_trickle.reset()
+            if not self.is_sink and not others_up:
+                self.disconnected()
+
+    def _address_changed(self, interface: LrpInterface, address: Optional[Address]):
+        """Remember the new address of an interface. The sockets are rebound by
+        `_apply_address_changes`, once the ready inputs, which may include
+        these sockets, have been handled."""
+        self._address_changes[interface] = address
+
+    def _apply_address_changes(self):
+        """Rebind the service sockets on the new address of the interfaces, and
+        make the DODAG learn it, if it is the address of this node. Interfaces
+        without address are left without sockets."""
+        changes, self._address_changes = self._address_changes, {}
+        for interface, address in changes.items():
+            self._close_service_sockets(interface)
+            if address is None:
+                self.logger.warning("%s has no more IP address", interface.name)
+                if not any(other.has_sockets for other in self.interfaces):
+                    self.dio_trickle.stop()
+                continue
+            self.logger.warning("%s's address is now %s", interface.name, address)
+            self._open_service_sockets(interface)
+            if interface is self.interfaces[0]:
+                if self.is_sink:
+                    self.sink = address
+                else:
+                    for successor in self.routing_table.routes.get(DEFAULT_ROUTE, {}):
+                        self.send_msg(RREP(address, self.sink, 0), destination=successor)
+            # Restarted if it was stopped
+            self.dio_trickle.reset()
 
     @property
     def network_prefix(self) -> Subnet:
@@ -153,115 +427,373 @@ class LinuxLrpProcess(LrpProcess):
         prefix = Subnet(self.own_ip.as_bytes[0:2] + b"\x00\x00", prefix=16)
         return prefix
 
+    def register_io(self, fileobj, callback):
+        """Make the event loop call `callback` (without argument) each time
+        `fileobj` (a file object or descriptor) is readable. The callback should
+        consume what it can: it is called again at next iteration while data
+        remain."""
+        self.selector.register(fileobj, selectors.EVENT_READ, data=callback)
+
+    def unregister_io(self, fileobj):
+        """Stop watching `fileobj`. See `register_io`."""
+        self.selector.unregister(fileobj)
+
     def wait_event(self):
-        queue_fd = self.la_queue.get_fd()
+        timer_lag = self.metrics.histogram("lrp_timer_lag_seconds")
+        timer_deadline = None
         while True:
             # Handle timers
+            if timer_deadline is not None and time.monotonic() >= timer_deadline:
+                lag = time.monotonic() - timer_deadline
+                timer_lag.observe(lag)
+                if self.flight_recorder is not None:
+                    self.flight_recorder.record(EVENT_TIMER, value=int(lag * 1e6))
+                # Only when an event fires: the deadline may have been
+                # cancelled since
+                if self.recorder is not None and self.timer_due(self.scheduler.timefunc()):
+                    self.recorder.record_timer()
             next_time_event = self.scheduler.run(blocking=False)
-            # Handle socket input, but stop when next time event occurs
-            rr, _, _ = select.select([self.input_multicast_socket, self.unicast_socket, queue_fd],
-                                     [], [], next_time_event)
-            try:
-                # Handle packet from socket or queue
-                readable = rr[0]
-                if readable == queue_fd:
-                    self.la_queue.run(block=False)
+            timer_deadline = None if next_time_event is None else time.monotonic() + next_time_event
+            # Send the routes changed by the previous events
+            self.routing_table.flush()
+            if self.control_server is not None:
+                self._publish_control_state()
+            # Handle inputs, but stop when next time event occurs. If no input
+            # is ready, a timed event needs to be activated. Loop.
+            for key, _ in self.selector.select(next_time_event):
+                key.data()
+            if self._address_changes:
+                self._apply_address_changes()
+
+    def _handle_la_queue(self):
+        """Handle the packets waiting in the netfilter queue, up to
+        lrp.conf['netlink']['netfilter_queue_budget'] of them."""
+        self._la_budget = lrp.conf['netlink']['netfilter_queue_budget']
+        try:
+            process_pending = self.la_queue.process_pending
+        except AttributeError:
+            # netfilterqueue < 1.0 reads the whole queue: packets over the
+            # budget are dropped by _queue_packet_handler
+            self.la_queue.run(block=False)
+        else:
+            process_pending(self._la_budget)
+        self._flush_la_batch()
+
+    def _handle_la_workers(self):
+        """Handle the non-routable packets sent by the nfqueue workers, up to
+        about lrp.conf['netlink']['netfilter_queue_budget'] of them."""
+        events = self.la_workers.read_events(lrp.conf['netlink']['netfilter_queue_budget'])
+        for source, destination, sender_mac in events:
+            self._batch_non_routable(source, destination, sender_mac)
+        self._flush_la_batch()
+
+    def _handle_dead_la_worker(self, i: int, sentinel: int):
+        """Restart the nfqueue worker `i`, whose sentinel became readable.
+        Non-routable packets of its queue would not be handled anymore."""
+        self.unregister_io(sentinel)
+        sentinel = self.la_workers.respawn(i)
+        self.register_io(sentinel, lambda: self._handle_dead_la_worker(i, sentinel))
+
+    def _queue_packet_handler(self, packet):
+        """Drop a non-routable packet, and add it to the current batch."""
+        source, destination = _IPV4_ADDRESSES.unpack_from(packet.get_payload(), 12)
+        sender_mac = packet.get_hw()[0:6]
+        packet.drop()
+        if self._la_budget == 0:
+            self.metrics.counter("lrp_nfqueue_over_budget_total").inc()
+            return
+        self._la_budget -= 1
+        self._batch_non_routable(source, destination, sender_mac)
+
+    def _batch_non_routable(self, source: bytes, destination: bytes, sender_mac: bytes):
+        """Add a non-routable packet to the current batch, where duplicates are
+        merged."""
+        self.metrics.counter("lrp_nfqueue_packets_total").inc()
+        if self.is_sink:
+            # Only the destination matters
+            key = (b"", destination, b"")
+        else:
+            key = (source, destination, sender_mac)
+
+        if key in self._la_batch:
+            self.metrics.counter("lrp_nfqueue_duplicates_total").inc()
+        else:
+            self._la_batch[key] = None
+            if len(self._la_batch) >= lrp.conf['netlink']['netfilter_queue_batch']:
+                self._flush_la_batch()
+
+    def _flush_la_batch(self):
+        """Activate the LRP mechanisms corresponding to the batched non-routable
+        packets."""
+        batch, self._la_batch = self._la_batch, {}
+        for source, destination, sender_mac in batch:
+            if self.is_sink:
+                self.handle_unknown_host(Address(destination))
+            else:
+                sender = self.routing_table.get_ip_from_mac(sender_mac)
+                if sender is None:
+                    self.logger.warning("Unable to handle a non-routable packet: unknown sender %s",
+                                        ":".join("%02x" % b for b in sender_mac))
                 else:
-                    data, (sender, _) = readable.recvfrom(16)
-                    sender = Address(sender)
-                    if sender == self.own_ip:
-                        self.logger.debug("Skip a message from ourselves")  # Happen on broadcast messages
-                    else:
-                        msg = Message.parse(data)
-                        self.handle_msg(msg, sender, is_broadcast=(readable is self.input_multicast_socket))
-            except IndexError:
-                # No available readable socket. Select timed out. We have no new packet, but a timed event needs to
-                # be activated. Loop.
+                    self.handle_non_routable_packet(source=Address(source), destination=Address(destination),
+                                                    sender=sender)
+
+    def _publish_control_state(self):
+        """Give the changes of the state since the last call to the control
+        server, if any. Only the changed routes and neighbors are copied."""
+        changed_routes, changed_neighbors = self.routing_table.take_changes()
+        key = (self.own_metric, self.sink, self.is_sink)
+        if not changed_routes and not changed_neighbors and key == self._control_key:
+            return
+        self._control_key = key
+        node = {'address': str(self.own_ip), 'is_sink': self.is_sink, 'metric': self.own_metric,
+                'sink': str(self.sink), 'interfaces': [interface.name for interface in self.interfaces]}
+        routes = {}
+        for destination in changed_routes:
+            next_hops = self.routing_table.routes.get(destination)
+            routes[str(destination)] = None if next_hops is None else \
+                {str(next_hop): metric for next_hop, metric in next_hops.items()}
+        neighbors = {str(neighbor): self.interface_of(neighbor).name if neighbor in self.routing_table.neighbors
+                     else None for neighbor in changed_neighbors}
+        self.control_server.publish(node, routes, neighbors)
+
+    def _setup_input_socket(self, sock: socket.socket):
+        """Configure a service socket for `_drain_socket`."""
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        if lrp.conf['receive_buffer_size'] is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, lrp.conf['receive_buffer_size'])
+
+    def _drain_socket(self, interface: LrpInterface, sock: socket.socket):
+        """Handle the messages waiting on a service socket of an interface, up
+        to lrp.conf['receive_budget'] messages. Remaining ones will be handled
+        at the next wake-up, after the other ready sockets."""
+        is_broadcast = sock is interface.input_multicast_socket
+        socket_name = "%s:%s" % (interface.name, "multicast" if is_broadcast else "unicast")
+        nb_received = 0
+        while nb_received < lrp.conf['receive_budget']:
+            try:
+                data, ancillary_data, _, (sender, _) = sock.recvmsg(16, socket.CMSG_SPACE(4))
+            except BlockingIOError:
+                break
+            nb_received += 1
+            for level, cmsg_type, cmsg_data in ancillary_data:
+                if level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL:
+                    self.metrics.gauge("lrp_socket_drops").set(struct.unpack("=I", cmsg_data)[0], socket_name)
+
+            sender = Address(sender)
+            if any(sender == other.netlink_monitor.address for other in self.interfaces):
+                self.logger.debug("Skip a message from ourselves")  # Happen on broadcast messages
+            else:
+                self._neighbor_interfaces[sender] = interface
+                msg = Message.parse(data)
+                self.handle_msg(msg, sender, is_broadcast=is_broadcast)
+        self.metrics.histogram("lrp_socket_batch_size").observe(nb_received, socket_name)
+
+    def memory_structures(self):
+        structures = super().memory_structures()
+        structures.update(self.routing_table.kernel_routes.memory_structures())
+        for interface in self.interfaces:
+            structures.update(("%s:%s" % (interface.name, name), structure)
+                              for name, structure in interface.netlink_monitor.memory_structures().items())
+        structures['neighbor_interfaces'] = self._neighbor_interfaces
+        return structures
+
+    def dump_diagnostics(self):
+        """Dump the flight recorder and a memory report in files."""
+        if self.flight_recorder is not None:
+            self.flight_recorder.dump()
+        self.memory_report.dump(self.memory_structures())
+
+    def _handle_signals(self):
+        """Run the actions associated to the signals received since last call."""
+        try:
+            signums = self._signal_socket.recv(64)
+        except BlockingIOError:
+            return
+        for signum in signums:
+            try:
+                action = self._signal_actions[signum]
+            except KeyError:
+                # Other signals are handled by their own handlers
                 pass
+            else:
+                self.logger.info("Signal %s received", signal.Signals(signum).name)
+                action()
 
     def send_msg(self, msg: Message, destination: Address = None):
+        self.metrics.counter("lrp_messages_sent_total").inc(msg.message_type)
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(EVENT_MESSAGE_OUT, msg.message_type,
+                                        destination.as_bytes if destination is not None else b"\x00\x00\x00\x00")
         if destination is None:
             self.logger.info("Send %s (multicast)", msg)
-            self.output_multicast_socket.send(msg.dump())
+            data = msg.dump()
+            for interface in self.interfaces:
+                if interface.netlink_monitor.link_up and interface.has_sockets:
+                    interface.output_multicast_socket.send(data)
         else:
             self.logger.info("Send %s to %s", msg, destination)
-            self.unicast_socket.sendto(msg.dump(), (str(destination), lrp.conf['service_port']))
+            interface = self.interface_of(destination)
+            if not interface.has_sockets:
+                self.logger.warning("Unable to send %s to %s: %s has no IP address", msg, destination, interface.name)
+                return
+            interface.unicast_socket.sendto(msg.dump(), (str(destination), lrp.conf['service_port']))
 
 
 class NetlinkRoutingTable(RoutingTable):
     def __init__(self, lrp_process: LinuxLrpProcess):
-        super().__init__()
-        self.ipdb = IPDB()
+        super().__init__(flight_recorder=lrp_process.flight_recorder)
         self.lrp_process = lrp_process
+        lrp_process.interfaces[0].netlink_monitor.route_listeners.append(self._kernel_route_changed)
+        self.kernel_routes = ROUTE_BACKENDS[lrp.conf['netlink']['route_backend']](
+            lrp_process.interfaces[0].idx, self._account_kernel_call, lrp_process.kernel_programmer)
+        self.loop_avoidance = None
+        # Predecessors allowed by the loop-avoidance mechanism, with the layer
+        # 2 address they were allowed with, and those waiting for their layer 2
+        # address to be resolved
+        self._allowed_predecessors: Dict[Address, str] = {}
+        self._unresolved_predecessors: Set[Address] = set()
+        # Unresolved predecessors to be probed once the pending kernel changes,
+        # which may include their neighbor route, are applied. See `flush`.
+        self._pending_resolutions: Set[Address] = set()
+        # Destinations and neighbors changed since the last `take_changes`
+        self._changed_routes: Set[Subnet] = set()
+        self._changed_neighbors: Set[Address] = set()
+        for interface in lrp_process.interfaces:
+            interface.netlink_monitor.neighbour_listeners.append(self._neighbour_resolved)
 
     def __enter__(self):
+        self.kernel_routes.__enter__()
+
         # Initialize loop-avoidance mechanism
-        self._la_table = iptc.Table(iptc.Table.FILTER)
-        self._la_table.autocommit = False
-        self._la_chain = self._la_table.create_chain(lrp.conf['netlink']['iptables_chain_name'])
-
-        # Redirect forwarded traffic to our management table
-        self._la_redirect_rule = iptc.Rule()
-        self._la_redirect_rule.create_target(lrp.conf['netlink']['iptables_chain_name'])
-        iptc.Chain(self._la_table, "FORWARD").append_rule(self._la_redirect_rule)
-
-        # Redirect dropped packets to the nfqueue
-        self.logger.debug("Redirect non-routables towards netfilter-queue %d",
-                          lrp.conf['netlink']['netfilter_queue_nb'])
-        self._la_default_rule = iptc.Rule()
         if self.lrp_process.is_sink:
             # We are the sink: we expect to have a default route that does not
             # depend on the LRP network. Allow to use this route, except for
             # packets destined to the LRP network itself.
-            self._la_default_rule.dst = str(self.lrp_process.network_prefix)
-        self._la_default_rule.create_target("NFQUEUE")
-        self._la_default_rule.target.queue_num = str(lrp.conf['netlink']['netfilter_queue_nb'])
-        self._la_chain.append_rule(self._la_default_rule)
-
-        self._la_table.commit()
+            queued_destinations = self.lrp_process.network_prefix
+        else:
+            queued_destinations = None
+        self.loop_avoidance = LOOP_AVOIDANCE_BACKENDS[lrp.conf['netlink']['loop_avoidance_backend']](
+            self._account_kernel_call, queued_destinations, self.lrp_process.kernel_programmer,
+            [interface.idx for interface in self.lrp_process.interfaces]).__enter__()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        # Send the pending changes, in case the kernel state is kept. No more
+        # predecessor needs to be resolved.
+        self._pending_resolutions.clear()
+        self.flush()
+
         # Clean routing table: all routes inserted by the protocol LRP
-        for route in self.ipdb.routes:
-            if route['proto'] == lrp.conf['netlink']['proto_number']:
-                route.remove().commit()
-        self.ipdb.release()
-
-        self.logger.info("Cleaning iptables (loop avoidance mechanism)")
-        self._la_table.refresh()
-        iptc.Chain(self._la_table, "FORWARD").delete_rule(self._la_redirect_rule)
-        self._la_chain.flush()
-        self._la_table.delete_chain(self._la_chain)
-        self._la_table.commit()
+        self.kernel_routes.__exit__(exc_type, exc_val, exc_tb)
+
+        self.loop_avoidance.__exit__(exc_type, exc_val, exc_tb)
 
         # Clean internal structures
+        self._allowed_predecessors.clear()
+        self._unresolved_predecessors.clear()
+        self._pending_resolutions.clear()
+        self._changed_neighbors.update(self.neighbors)
+        self._changed_routes.update(self.routes)
         self.neighbors.clear()
         self.routes.clear()
+        self._subnet_routes.clear()
+
+    def take_changes(self) -> Tuple[Set[Subnet], Set[Address]]:
+        """Return the destinations whose routes changed, and the neighbors
+        which changed, since the last call."""
+        changes = self._changed_routes, self._changed_neighbors
+        self._changed_routes, self._changed_neighbors = set(), set()
+        return changes
+
+    def _account_kernel_call(self, name: str, start: float, subsystem: str = None):
+        """Account for the time spent in a kernel call started at `start`
+        (see time.perf_counter). Commits are also accounted in the metrics of
+        their subsystem."""
+        duration = time.perf_counter() - start
+        if subsystem is not None:
+            self.lrp_process.metrics.histogram("lrp_kernel_commit_duration_seconds").observe(duration, subsystem)
+        self.lrp_process.profiler.record(name, duration)
+
+    def _kernel_route_changed(self, destination, route):
+        self.kernel_routes.kernel_changed(destination, route)
+
+    @property
+    def keep_kernel_state(self) -> bool:
+        """If set, the routes and the loop-avoidance rules are left in the
+        kernel on exit, for a warm restart."""
+        return self.kernel_routes.keep_kernel_state
+
+    @keep_kernel_state.setter
+    def keep_kernel_state(self, keep: bool):
+        self.kernel_routes.keep_kernel_state = keep
+        self.loop_avoidance.keep_kernel_state = keep
+
+    def prune_kernel_state(self):
+        """Remove the routes and loop-avoidance entries left in the kernel by a
+        previous instance, which are not part of the current state."""
+        for destination, route in self.kernel_routes.routes().items():
+            if route.neighbor:
+                if destination.prefix != 32 or Address(destination) not in self.neighbors:
+                    self.logger.info("Prune stale rtnetlink neighbor route towards '%s'", destination)
+                    self.kernel_routes.remove_route(destination)
+            elif destination not in self.routes:
+                self.logger.info("Prune stale rtnetlink route towards '%s'", destination)
+                self.kernel_routes.remove_route(destination)
+            else:
+                for next_hop in route.gateways - self.routes[destination].keys():
+                    self.logger.info("Prune stale next hop '%s' towards '%s'", next_hop, destination)
+                    self.kernel_routes.del_nexthop(destination, next_hop)
+
+        # Kept routes were not announced to the loop-avoidance mechanism
+        destinations = {Subnet(neighbor) for neighbor in self.neighbors} | set(self.routes.keys())
+        for destination in destinations:
+            self._nl_allow_destination(destination)
+        self.loop_avoidance.prune(set(self._allowed_predecessors.values()), destinations)
+
+    def flush(self):
+        """Send the pending route and loop-avoidance changes to the kernel, then
+        resolve the predecessors waiting for it."""
+        self.kernel_routes.flush()
+        self.loop_avoidance.flush()
+        if self._pending_resolutions:
+            # The programmer applies changes in order: the probes are sent once
+            # the routes submitted before are in the kernel
+            predecessors, self._pending_resolutions = self._pending_resolutions, set()
+            self.kernel_routes.programmer.submit(lambda: None,
+                                                 callback=lambda _: self._resolve_predecessors(predecessors))
+
+    def _resolve_predecessors(self, predecessors: Set[Address]):
+        """Make the kernel resolve the layer 2 address of predecessors. See
+        `_neighbour_resolved`."""
+        for predecessor in predecessors:
+            if predecessor in self._unresolved_predecessors:
+                self.lrp_process.interface_of(predecessor).netlink_monitor.resolve(predecessor)
 
     def get_mac_from_ip(self, ip_address: Address):
         """Return the layer 2 address, given a layer 3 address. Return None if such
         address is unknown"""
-        table = self.ipdb.neighbours[self.lrp_process.interface_idx]
-        try:
-            return table[str(ip_address)]['lladdr'].upper()
-        except KeyError:
-            # Unknown IP address
-            return None
-
-    def get_ip_from_mac(self, mac_address) -> Optional[Address]:
-        """Return the layer 3 address, given a layer 2 address. Return None if such
-        layer 2 address is unknown"""
-        table = self.ipdb.neighbours[self.lrp_process.interface_idx].raw.items()
-        try:
-            return [ip for ip, data in table if data['lladdr'] == mac_address.lower()][0]
-        except IndexError:
-            # Unknown MAC address
+        mac_address = self.lrp_process.interface_of(ip_address).netlink_monitor.mac_of(ip_address)
+        if mac_address is None:
             return None
+        return ":".join("%02X" % b for b in mac_address)
+
+    def get_ip_from_mac(self, mac_address: Union[str, bytes]) -> Optional[Address]:
+        """Return the layer 3 address, given a layer 2 address (as a string, or
+        as 6 bytes). Return None if such layer 2 address is unknown"""
+        if isinstance(mac_address, str):
+            mac_address = bytes.fromhex(mac_address.replace(":", ""))
+        for interface in self.lrp_process.interfaces:
+            ip_address = interface.netlink_monitor.ip_of(mac_address)
+            if ip_address is not None:
+                return ip_address
+        return None
 
     def add_route(self, destination: Subnet, next_hop: Address, metric: int):
         inserted = super().add_route(destination, next_hop, metric)
 
         if inserted:
+            self._changed_routes.add(destination)
             self._rtnl_add_route(destination, next_hop, metric)
 
             if destination != DEFAULT_ROUTE:
@@ -271,6 +803,7 @@ class NetlinkRoutingTable(RoutingTable):
 
     def del_route(self, destination: Subnet, next_hop: Address):
         super().del_route(destination, next_hop)
+        self._changed_routes.add(destination)
 
         self._rtnl_del_route(destination, next_hop)
 
@@ -279,6 +812,8 @@ class NetlinkRoutingTable(RoutingTable):
 
     def filter_out_nexthops(self, destination: Subnet, max_metric: int = None) -> List[Tuple[Address, int]]:
         dropped_nhs = super().filter_out_nexthops(destination, max_metric)
+        if dropped_nhs:
+            self._changed_routes.add(destination)
 
         # Delete the dropped next hops from the netlink route
         for nh, _ in dropped_nhs:
@@ -290,194 +825,166 @@ class NetlinkRoutingTable(RoutingTable):
         return dropped_nhs
 
     def ensure_is_neighbor(self, neighbor: Address):
+        if neighbor not in self.neighbors:
+            self._changed_neighbors.add(neighbor)
         super().ensure_is_neighbor(neighbor)
 
         # Check netlink's state
-        try:
-            route = self.ipdb.routes[neighbor.as_subnet()]
-        except KeyError:
-            # Route does not exists. Will create it
-            pass
-        else:
+        route = self.kernel_routes.route(Subnet(neighbor))
+        if route is not None:
             # Route is found. Ensure it is a neighbor route
-            if route['scope'] == rt_scope['link']:
+            if route.neighbor:
                 # All is correct, nothing more to do
                 return
             else:
-                self.logger.info("Remove rtnetlink host route towards %r", str(neighbor))
-                route.remove().commit()
+                self.logger.info("Remove rtnetlink host route towards '%s'", neighbor)
+                self.kernel_routes.remove_route(Subnet(neighbor))
 
-        self.logger.info("Create rtnetlink route towards neighbor %r", str(neighbor))
-        self.ipdb.routes.add({
-            'dst': neighbor.as_subnet(),
-            'oif': self.lrp_process.interface_idx,
-            'scope': rt_scope['link'],
-            'proto': lrp.conf['netlink']['proto_number']}).commit()
+        self.logger.info("Create rtnetlink route towards neighbor '%s'", neighbor)
+        self.kernel_routes.add_neighbor_route(Subnet(neighbor), self.lrp_process.interface_of(neighbor).idx)
 
         self._nl_allow_destination(Subnet(neighbor))
 
     def no_more_neighbor(self, neighbor: Address):
+        self._changed_neighbors.add(neighbor)
         # Check netlink's state
-        try:
-            route = self.ipdb.routes[neighbor.as_subnet()]
-        except KeyError:
-            # No route towards this neighbor, ok.
-            pass
-        else:
-            # Ensure this is really a neighbor route, not a host route
-            if route['scope'] == rt_scope['link']:
-                # Drop this neighbor from others host routes
-                for destination in self.routes.keys():
-                    self.del_route(destination, neighbor)
-
-                self.logger.info("Remove rtnetlink neighbor route towards %r", str(neighbor))
-                route.remove().commit()
-
-                # Fallback to a host route towards it, if we have one
-                try:
-                    next_hops = self.routes[neighbor.as_subnet()]
-                except KeyError:
-                    # No such host route. Just disallow its traffic through us
-                    self._nl_disallow_destination(neighbor.as_subnet())
-                else:
-                    for nh, metric in next_hops.items():
-                        self.add_route(neighbor.as_subnet(), nh, metric)
+        route = self.kernel_routes.route(Subnet(neighbor))
+        # Ensure this is really a neighbor route, not a host route
+        if route is not None and route.neighbor:
+            # Drop this neighbor from others host routes
+            for destination in self.routes.keys():
+                self.del_route(destination, neighbor)
 
-    def _nl_allow_predecessor(self, predecessor: Address):
-        self._la_table.refresh()
-        predecessor_mac = self.get_mac_from_ip(predecessor)
-        # Look for the rule allowing the predecessor
-        for rule in self._la_chain.rules:
+            self.logger.info("Remove rtnetlink neighbor route towards '%s'", neighbor)
+            self.kernel_routes.remove_route(Subnet(neighbor))
+
+            # Fallback to a host route towards it, if we have one
             try:
-                if rule.matches[0].mac_source == predecessor_mac:
-                    # Found
-                    break
-            except IndexError:
-                # Not this rule
-                pass
+                next_hops = self.routes[neighbor.as_subnet()]
+            except KeyError:
+                # No such host route. Just disallow its traffic through us
+                self._nl_disallow_destination(Subnet(neighbor))
+            else:
+                for nh, metric in next_hops.items():
+                    self.add_route(neighbor.as_subnet(), nh, metric)
+
+    def _nl_allow_predecessor(self, predecessor: Address):
+        if predecessor in self._allowed_predecessors:
+            return
+        mac_address = self.get_mac_from_ip(predecessor)
+        if mac_address is None:
+            # Will be allowed once resolved. See `_neighbour_resolved`.
+            self.logger.info("Resolve predecessor %s before allowing its traffic", predecessor)
+            self._unresolved_predecessors.add(predecessor)
+            self._pending_resolutions.add(predecessor)
         else:
-            # Predecessor was not known. Add rule.
-            rule = iptc.Rule()
-            match = iptc.Match(rule, "mac")
-            match.mac_source = predecessor_mac
-            rule.add_match(match)
-            comment = iptc.Match(rule, "comment")
-            comment.comment = "allow from predecessor %s" % predecessor
-            rule.add_match(comment)
-            rule.target = iptc.Target(rule, "ACCEPT")
-            self._la_chain.insert_rule(rule)
-            self._la_table.commit()
-            self.logger.info("Traffic from %s is allowed", predecessor)
+            self._allowed_predecessors[predecessor] = mac_address
+            self.loop_avoidance.allow_predecessor(predecessor, mac_address)
 
     def _nl_disallow_predecessor(self, predecessor: Address):
-        self._la_table.refresh()
-        predecessor_mac = self.get_mac_from_ip(predecessor)
-        # Look for the rule allowing the predecessor
-        for rule in self._la_chain.rules:
-            try:
-                if rule.matches[0].mac_source == predecessor_mac:
-                    # Found. Delete this rule
-                    self._la_chain.delete_rule(rule)
-                    self._la_table.commit()
-                    self.logger.info("Traffic from %s is no more allowed", predecessor)
-            except IndexError:
-                # Not this rule
-                pass
+        self._unresolved_predecessors.discard(predecessor)
+        mac_address = self._allowed_predecessors.pop(predecessor, None)
+        if mac_address is not None:
+            self.loop_avoidance.disallow_predecessor(predecessor, mac_address)
+
+    def _neighbour_resolved(self, neighbor: Address, mac_address: bytes):
+        """Allow the traffic of a predecessor waiting for its layer 2 address, or
+        update it if the predecessor changed its layer 2 address."""
+        if neighbor in self._allowed_predecessors:
+            self._nl_disallow_predecessor(neighbor)
+        elif neighbor not in self._unresolved_predecessors:
+            return
+        self._unresolved_predecessors.discard(neighbor)
+        self._nl_allow_predecessor(neighbor)
 
     def _nl_allow_destination(self, destination: Subnet):
-        self._la_table.refresh()
-        if not any(Subnet(rule.dst) == destination for rule in self._la_chain.rules):
-            # Destination was not known. Add rule.
-            rule = iptc.Rule()
-            rule.dst = str(destination)
-            comment = iptc.Match(rule, "comment")
-            comment.comment = "allow towards destination %s" % destination
-            rule.add_match(comment)
-            rule.target = iptc.Target(rule, "ACCEPT")
-            self._la_chain.insert_rule(rule)
-            self._la_table.commit()
-            self.logger.info("Traffic towards %s is allowed", destination)
+        self.loop_avoidance.allow_destination(destination)
 
     def _nl_disallow_destination(self, destination: Subnet):
-        self._la_table.refresh()
-        try:
-            rule = [r for r in self._la_chain.rules if Subnet(r.dst) == destination][0]
-        except IndexError:
-            # Destination is not known by netfilter, ok.
-            pass
-        else:
-            self._la_chain.delete_rule(rule)
-            self._la_table.commit()
-            self.logger.info("Traffic towards %s is no more allowed", destination)
+        self.loop_avoidance.disallow_destination(destination)
 
     def _rtnl_add_route(self, destination, next_hop, metric):
         """Really add the described route in rtnetlink (without any test, except
         those related to rtnetlink itself)."""
-        try:
-            route = self.ipdb.routes[str(destination)]
-        except KeyError:
+        route = self.kernel_routes.route(destination)
+        if route is None:
             # Destination was unknown
-            self.logger.info("Update rtnetlink: new route towards %r through %r",
-                             str(destination), str(next_hop))
-            self.ipdb.routes.add({
-                'dst': str(destination),
-                'multipath': [{'gateway': str(next_hop)}],
-                'proto': lrp.conf['netlink']['proto_number']}).commit()
+            self.logger.info("Update rtnetlink: new route towards '%s' through '%s'",
+                             destination, next_hop)
+            self.kernel_routes.add_nexthop(destination, next_hop)
             self._nl_allow_destination(destination)
+        # Be sure this is not a neighbor route
+        elif route.neighbor:
+            self.logger.info("Refuse host route: would erase a neighbor route")
+        elif next_hop in route.gateways:
+            self.logger.info("rtnetlink already knows '%s' as next hop towards '%s'",
+                             next_hop, destination)
         else:
-            # Be sure this is not a neighbor route
-            if route['scope'] == rt_scope['link']:
-                self.logger.info("Refuse host route: would erase a neighbor route")
-            else:
-                already_known = (
-                    not route['multipath'] and route['gateway'] == str(next_hop) or
-                    route['multipath'] and any(p['gateway'] == str(next_hop)
-                                               for p in route['multipath']))
-                if already_known:
-                    self.logger.info("rtnetlink already knows %r as next hop towards %r",
-                                     str(next_hop), str(destination))
-                else:
-                    self.logger.info("Update rtnetlink: update route towards %r, also through %r",
-                                     str(destination), str(next_hop))
-                    route.add_nh({'gateway': str(next_hop)}).commit()
+            self.logger.info("Update rtnetlink: update route towards '%s', also through '%s'",
+                             destination, next_hop)
+            self.kernel_routes.add_nexthop(destination, next_hop)
 
     def _rtnl_del_route(self, destination, next_hop):
         """Really delete the described route in rtnetlink (without any test, except
         those related to rtnetlink itself)."""
-        try:
-            route = self.ipdb.routes[str(destination)]
-        except KeyError:
-            # No route at all, OK
-            pass
-        else:
-            # Be sure this is not a neighbor route
-            if route['scope'] != rt_scope['link']:
-                # Ensure this neighbor is a next hop for this destination
-                nexthop_exists = \
-                    not route['multipath'] and route['gateway'] == str(destination) or \
-                    route['multipath'] and any(nh['gateway'] == str(destination)
-                                               for nh in route['multipath'])
-                if nexthop_exists:
-                    self.logger.info("Removed netlink route towards %r through %r",
-                                     str(destination), str(next_hop))
-                    try:
-                        route.del_nh({'gateway': str(next_hop)}).commit()
-                    except KeyError:  # 'attempt to delete nexthop from non-multipath route': no more next hop
-                        route.remove().commit()
-                        self.logger.info("No more rtnetlink route towards %r",
-                                         str(destination))
-                        self._nl_disallow_destination(destination)
+        route = self.kernel_routes.route(destination)
+        # Be sure this is not a neighbor route, and this neighbor is a next
+        # hop for this destination
+        if route is not None and not route.neighbor and next_hop in route.gateways:
+            self.logger.info("Removed netlink route towards '%s' through '%s'",
+                             destination, next_hop)
+            if not self.kernel_routes.del_nexthop(destination, next_hop):
+                self.logger.info("No more rtnetlink route towards '%s'",
+                                 destination)
+                self._nl_disallow_destination(destination)
 
 
 @click.command()
-@click.option("--interface", default=None, metavar="<iface>",
-              help="The interface LRP should use. Default: auto-detect.")
+@click.option("--interface", "interfaces", multiple=True, metavar="<iface>",
+              help="An interface LRP should use. May be repeated: the address of the first one is the address of "
+                   "the node. Default: auto-detect.")
 @click.option("--metric", default=2 ** 16 - 1, metavar="<metric>",
               help="The initial metric of this node. Should be set for the sink. Default: infinite.")
 @click.option("--sink/--no-sink", default=False, help="Is this node a sink?", show_default=True)
-def daemon(interface=None, metric=2 ** 16 - 1, sink=False):
+@click.option("--metrics", default=None, metavar="<path|[host:]port>",
+              help="Serve metrics in the Prometheus text format on this Unix socket, or over HTTP on this "
+                   "TCP address (host defaults to %s). Default: disabled." % lrp.conf['metrics']['default_host'])
+@click.option("--metrics-public/--no-metrics-public", default=lrp.conf['metrics']['allow_public'], show_default=True,
+              help="Allow serving the metrics, which are not authenticated, on a non-loopback address.")
+@click.option("--rcvbuf", default=None, type=int, metavar="<bytes>",
+              help="Size of the receive buffers of the service sockets and of the netfilter queue. "
+                   "Default: system default.")
+@click.option("--record", default=None, metavar="<file>", type=click.Path(dir_okay=False, writable=True),
+              help="Record all inputs of the daemon in this file, for a later `replay`. Default: disabled.")
+@click.option("--tracemalloc/--no-tracemalloc", "trace_malloc", default=False, show_default=True,
+              help="Trace memory allocations, to be reported on SIGUSR2. Slows the daemon down.")
+@click.option("--route-backend", default=lrp.conf['netlink']['route_backend'], show_default=True,
+              type=click.Choice(sorted(ROUTE_BACKENDS.keys())),
+              help="How routes are programmed in the kernel.")
+@click.option("--loop-avoidance", default=lrp.conf['netlink']['loop_avoidance_backend'], show_default=True,
+              type=click.Choice(sorted(LOOP_AVOIDANCE_BACKENDS.keys())),
+              help="How the loop-avoidance rules are programmed in the kernel.")
+@click.option("--kernel-worker/--no-kernel-worker", default=lrp.conf['netlink']['kernel_worker']['enabled'],
+              show_default=True,
+              help="Apply route and filter changes from a dedicated thread (iproute, nexthop, ipset and "
+                   "nftables backends only; refused if neither backend uses it).")
+@click.option("--nfqueue-workers", default=lrp.conf['netlink']['nfqueue_workers']['count'], show_default=True,
+              type=click.IntRange(min=0), metavar="<count>",
+              help="Number of worker processes handling the non-routable packets, balanced among as many "
+                   "netfilter queues. 0 handles them in the daemon process.")
+@click.option("--state", default=None, metavar="<file>", type=click.Path(dir_okay=False, writable=True),
+              help="Save the state in this file on exit, and leave the routes in the kernel. Restore it on start, "
+                   "if recent enough. Default: disabled.")
+@click.option("--control", default=None, metavar="<path>",
+              help="Serve the routing table, neighbours, metric and sink on this Unix socket (see `query`). "
+                   "Default: disabled.")
+def daemon(interfaces=(), metric=2 ** 16 - 1, sink=False, metrics=None, metrics_public=False, rcvbuf=None,
+           record=None, trace_malloc=False, route_backend=lrp.conf['netlink']['route_backend'],
+           loop_avoidance=lrp.conf['netlink']['loop_avoidance_backend'],
+           kernel_worker=lrp.conf['netlink']['kernel_worker']['enabled'],
+           nfqueue_workers=lrp.conf['netlink']['nfqueue_workers']['count'], state=None, control=None):
     """Launch the LRP daemon."""
-    if interface is None:
+    if not interfaces:
         # Guess interface
         with pyroute2.IPRoute() as ipr:
             all_interfaces = ipr.get_links()
@@ -487,10 +994,32 @@ def daemon(interface=None, metric=2 ** 16 - 1, sink=False):
             raise Exception("Unable to auto-detect the interface to use. Please provide --interface argument.")
         elif len(all_interfaces) == 0:
             raise Exception("Unable to find a usable interface.")
-        interface = all_interfaces[0]
-        logging.getLogger("LRP").info("Use auto-detected interface %s", interface)
-
-    with LinuxLrpProcess(interface, metric=metric, is_sink=sink) as lrp_process:
+        interfaces = all_interfaces
+        logging.getLogger("LRP").info("Use auto-detected interface %s", interfaces[0])
+
+    if kernel_worker:
+        synchronous = [name for name, backend in ((route_backend, ROUTE_BACKENDS[route_backend]),
+                                                  (loop_avoidance, LOOP_AVOIDANCE_BACKENDS[loop_avoidance]))
+                       if not backend.uses_programmer]
+        if len(synchronous) == 2:
+            raise click.UsageError("--kernel-worker has no effect with the %s and %s backends"
+                                   % tuple(synchronous))
+        elif synchronous:
+            logging.getLogger("LRP").warning("The %s backend does not use the kernel worker: its changes are "
+                                             "applied by the daemon", synchronous[0])
+
+    if trace_malloc:
+        tracemalloc.start()
+    if rcvbuf is not None:
+        lrp.conf['receive_buffer_size'] = rcvbuf
+    lrp.conf['metrics']['allow_public'] = metrics_public
+    lrp.conf['netlink']['route_backend'] = route_backend
+    lrp.conf['netlink']['loop_avoidance_backend'] = loop_avoidance
+    lrp.conf['netlink']['kernel_worker']['enabled'] = kernel_worker
+    lrp.conf['netlink']['nfqueue_workers']['count'] = nfqueue_workers
+
+    with LinuxLrpProcess(list(interfaces), metrics_address=metrics, record_path=record, state_path=state,
+                         control_address=control, metric=metric, is_sink=sink) as lrp_process:
         lrp_process.wait_event()
 
 
@@ -0,0 +1,707 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import abc
+import errno
+import functools
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import iptc
+import pyroute2
+from pyroute2.ipset import IPSet
+from pyroute2.netlink.exceptions import NetlinkError
+
+import lrp
+from lrp.kernel_worker import SyncProgrammer
+from lrp.nfqueue_workers import queue_numbers
+from lrp.tools import Address, Subnet
+
+try:
+    import nftables
+except ImportError:
+    # Python bindings of libnftables, only needed by NftablesLoopAvoidance
+    nftables = None
+
+try:
+    import bcc
+except ImportError:
+    # BPF compiler collection, only needed by BpfLoopAvoidance
+    bcc = None
+
+
+class LoopAvoidance(metaclass=abc.ABCMeta):
+    """Kernel part of the loop-avoidance mechanism. Forwarded packets are
+    accepted if they come from an allowed predecessor, or if they go towards an
+    allowed destination. Others are sent to the netfilter queue(s) (see
+    `lrp.nfqueue_workers.queue_numbers`). Subclasses implement a given
+    netfilter backend.
+
+    Changes may be delayed until the next `flush`, which the event loop calls
+    before waiting for new events."""
+    logger = logging.getLogger("LoopAvoidance")
+    # Whether the changes are applied by the programmer, or at once
+    uses_programmer = False
+
+    def __init__(self, account_kernel_call: Callable[[str, float, str], None],
+                 queued_destinations: Optional[Subnet] = None, programmer: SyncProgrammer = None,
+                 interface_idxs: List[int] = ()):
+        """Constructor.
+
+        account_kernel_call: called as `(name, start, subsystem)` after each
+          kernel call. See `NetlinkRoutingTable._account_kernel_call`.
+        queued_destinations: if set, only the packets towards this prefix are
+          sent to the netfilter queue. Others are accepted.
+        programmer: applies the changes, if the backend supports it. Default:
+          a SyncProgrammer.
+        interface_idxs: the indexes of the interfaces LRP uses, if the backend
+          needs them."""
+        self._account_kernel_call = account_kernel_call
+        self.queued_destinations = queued_destinations
+        self.programmer = programmer if programmer is not None else SyncProgrammer()
+        self.interface_idxs = interface_idxs
+        # If set, rules are left in the kernel on exit, for a warm restart
+        self.keep_kernel_state = False
+
+    def __enter__(self):
+        return self
+
+    @abc.abstractmethod
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Remove all the kernel state of the mechanism, unless
+        `keep_kernel_state` is set."""
+
+    @abc.abstractmethod
+    def prune(self, predecessors: Set[str], destinations: Set[Subnet]):
+        """Remove the entries left by a previous instance: predecessors whose
+        layer 2 address is not in `predecessors`, and destinations not in
+        `destinations`."""
+
+    @abc.abstractmethod
+    def allow_predecessor(self, predecessor: Address, mac_address: str):
+        """Accept the traffic coming from `predecessor`, whose layer 2 address
+        is `mac_address`."""
+
+    @abc.abstractmethod
+    def disallow_predecessor(self, predecessor: Address, mac_address: str):
+        """Stop accepting the traffic coming from `predecessor`."""
+
+    @abc.abstractmethod
+    def allow_destination(self, destination: Subnet):
+        """Accept the traffic going towards `destination`."""
+
+    @abc.abstractmethod
+    def disallow_destination(self, destination: Subnet):
+        """Stop accepting the traffic going towards `destination`."""
+
+    def flush(self):
+        """Send the pending changes to the kernel."""
+        pass
+
+
+class IptablesLoopAvoidance(LoopAvoidance):
+    """Backend based on one iptables rule per allowed predecessor and per
+    allowed destination, in the chain lrp.conf['netlink']['iptables_chain_name'].
+    Each change rewrites the whole filter table."""
+
+    def __enter__(self):
+        chain_name = lrp.conf['netlink']['iptables_chain_name']
+        self._la_table = iptc.Table(iptc.Table.FILTER)
+        self._la_table.autocommit = False
+        self.reused_chain = self._la_table.is_chain(chain_name)
+        self._la_redirect_rule = self._la_default_rule = None
+        if self.reused_chain:
+            # Left by a previous instance: keep its rules until `prune`, and
+            # its redirection, if still there
+            self.logger.info("Reuse iptables chain %s", chain_name)
+            self._la_chain = iptc.Chain(self._la_table, chain_name)
+            self._la_redirect_rule = next((rule for rule in iptc.Chain(self._la_table, "FORWARD").rules
+                                           if rule.target.name == chain_name), None)
+            self._la_default_rule = next((rule for rule in self._la_chain.rules if rule.target.name == "NFQUEUE"),
+                                         None)
+            if self._la_redirect_rule is not None and self._la_default_rule is not None:
+                return self
+        else:
+            self._la_chain = self._la_table.create_chain(chain_name)
+
+        if self._la_redirect_rule is None:
+            # Redirect forwarded traffic to our management table
+            if self.reused_chain:
+                self.logger.warning("Restore the redirection towards iptables chain %s", chain_name)
+            self._la_redirect_rule = iptc.Rule()
+            self._la_redirect_rule.create_target(chain_name)
+            iptc.Chain(self._la_table, "FORWARD").append_rule(self._la_redirect_rule)
+
+        if self._la_default_rule is None:
+            # Redirect dropped packets to the nfqueue(s)
+            first_queue, last_queue = queue_numbers()
+            if self.reused_chain:
+                self.logger.warning("Restore the netfilter-queue rule of iptables chain %s", chain_name)
+            self.logger.debug("Redirect non-routables towards netfilter-queues %d to %d", first_queue, last_queue)
+            self._la_default_rule = iptc.Rule()
+            if self.queued_destinations is not None:
+                self._la_default_rule.dst = str(self.queued_destinations)
+            self._la_default_rule.create_target("NFQUEUE")
+            if first_queue == last_queue:
+                self._la_default_rule.target.queue_num = str(first_queue)
+            else:
+                self._la_default_rule.target.queue_balance = "%d:%d" % (first_queue, last_queue)
+            self._la_chain.append_rule(self._la_default_rule)
+
+        self._iptables_commit()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.keep_kernel_state:
+            return
+        self.logger.info("Cleaning iptables (loop avoidance mechanism)")
+        self._iptables_refresh()
+        iptc.Chain(self._la_table, "FORWARD").delete_rule(self._la_redirect_rule)
+        self._la_chain.flush()
+        self._la_table.delete_chain(self._la_chain)
+        self._iptables_commit()
+
+    def _iptables_commit(self):
+        """Commit the loop-avoidance table, accounting for its cost."""
+        start = time.perf_counter()
+        self._la_table.commit()
+        self._account_kernel_call("iptables.commit", start, "iptables")
+
+    def _iptables_refresh(self):
+        """Reload the loop-avoidance table from the kernel, accounting for its
+        cost."""
+        start = time.perf_counter()
+        self._la_table.refresh()
+        self._account_kernel_call("iptables.refresh", start, None)
+
+    def prune(self, predecessors, destinations):
+        if not self.reused_chain:
+            return
+        self._iptables_refresh()
+        predecessors = {mac_address.upper() for mac_address in predecessors}
+        stale_rules = []
+        for rule in self._la_chain.rules:
+            match_names = [match.name for match in rule.matches]
+            if match_names == ["mac", "comment"]:
+                if rule.matches[0].mac_source.upper() not in predecessors:
+                    stale_rules.append(rule)
+            elif match_names == ["comment"]:
+                if Subnet(rule.dst) not in destinations:
+                    stale_rules.append(rule)
+        for rule in stale_rules:
+            self._la_chain.delete_rule(rule)
+        if stale_rules:
+            self._iptables_commit()
+            self.logger.info("Pruned %d stale iptables rules", len(stale_rules))
+
+    def allow_predecessor(self, predecessor, mac_address):
+        self._iptables_refresh()
+        # Look for the rule allowing the predecessor
+        for rule in self._la_chain.rules:
+            try:
+                if rule.matches[0].mac_source == mac_address:
+                    # Found
+                    break
+            except IndexError:
+                # Not this rule
+                pass
+        else:
+            # Predecessor was not known. Add rule.
+            rule = iptc.Rule()
+            match = iptc.Match(rule, "mac")
+            match.mac_source = mac_address
+            rule.add_match(match)
+            comment = iptc.Match(rule, "comment")
+            comment.comment = "allow from predecessor %s" % predecessor
+            rule.add_match(comment)
+            rule.target = iptc.Target(rule, "ACCEPT")
+            self._la_chain.insert_rule(rule)
+            self._iptables_commit()
+            self.logger.info("Traffic from %s is allowed", predecessor)
+
+    def disallow_predecessor(self, predecessor, mac_address):
+        self._iptables_refresh()
+        # Look for the rule allowing the predecessor
+        for rule in self._la_chain.rules:
+            try:
+                if rule.matches[0].mac_source == mac_address:
+                    # Found. Delete this rule
+                    self._la_chain.delete_rule(rule)
+                    self._iptables_commit()
+                    self.logger.info("Traffic from %s is no more allowed", predecessor)
+            except IndexError:
+                # Not this rule
+                pass
+
+    def allow_destination(self, destination):
+        self._iptables_refresh()
+        if not any(Subnet(rule.dst) == destination for rule in self._la_chain.rules):
+            # Destination was not known. Add rule.
+            rule = iptc.Rule()
+            rule.dst = str(destination)
+            comment = iptc.Match(rule, "comment")
+            comment.comment = "allow towards destination %s" % destination
+            rule.add_match(comment)
+            rule.target = iptc.Target(rule, "ACCEPT")
+            self._la_chain.insert_rule(rule)
+            self._iptables_commit()
+            self.logger.info("Traffic towards %s is allowed", destination)
+
+    def disallow_destination(self, destination):
+        self._iptables_refresh()
+        try:
+            rule = [r for r in self._la_chain.rules if Subnet(r.dst) == destination][0]
+        except IndexError:
+            # Destination is not known by netfilter, ok.
+            pass
+        else:
+            self._la_chain.delete_rule(rule)
+            self._iptables_commit()
+            self.logger.info("Traffic towards %s is no more allowed", destination)
+
+
+class IpsetLoopAvoidance(IptablesLoopAvoidance):
+    """Backend based on two ipsets: a `hash:mac` of the allowed predecessors,
+    and a `hash:net` of the allowed destinations (see
+    lrp.conf['netlink']['ipset_names']). The iptables chain only holds a rule
+    matching each set, so changes are set operations, and packets are matched
+    by a hash lookup. Set operations are applied by the programmer."""
+    uses_programmer = True
+
+    def __init__(self, account_kernel_call, queued_destinations=None, programmer=None, interface_idxs=()):
+        super().__init__(account_kernel_call, queued_destinations, programmer, interface_idxs)
+        self.ipset = IPSet()
+        self._predecessors = lrp.conf['netlink']['ipset_names']['predecessors']
+        self._destinations = lrp.conf['netlink']['ipset_names']['destinations']
+
+    def __enter__(self):
+        for name, stype in self._set_types():
+            # Reuse the set left by a previous instance, if any. Its stale
+            # entries are removed by `prune`.
+            self._ipset_call("ipset.create", self.ipset.create, name, stype=stype, exclusive=False)
+
+        super().__enter__()
+        if self.reused_chain:
+            # The rules matching the sets are already there
+            return self
+        for name, direction in ((self._destinations, "dst"), (self._predecessors, "src")):
+            rule = iptc.Rule()
+            match = iptc.Match(rule, "set")
+            match.match_set = [name, direction]
+            rule.add_match(match)
+            rule.target = iptc.Target(rule, "ACCEPT")
+            self._la_chain.insert_rule(rule)
+        self._iptables_commit()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.programmer.wait()
+        super().__exit__(exc_type, exc_val, exc_tb)
+        if not self.keep_kernel_state:
+            for name in (self._predecessors, self._destinations):
+                self._ipset_call("ipset.destroy", self.ipset.destroy, name)
+        self.ipset.close()
+
+    def _set_types(self):
+        """Names and types of the sets."""
+        return (self._predecessors, "hash:mac"), (self._destinations, "hash:net")
+
+    def prune(self, predecessors, destinations):
+        # Build the wanted content in temporary sets, then swap them with the
+        # sets in use: the sets are replaced atomically
+        entries = {self._predecessors: [(mac_address, "mac") for mac_address in predecessors],
+                   self._destinations: [(self._net(destination), "net") for destination in destinations]}
+        for name, stype in self._set_types():
+            self.programmer.submit(self._rebuild_set, name, stype, entries[name])
+
+    def _rebuild_set(self, name: str, stype: str, entries):
+        """Replace the content of the set `name` by `entries`, a list of
+        (entry, etype)."""
+        temporary = name + "_NEW"
+        self._ipset_call("ipset.create", self.ipset.create, temporary, stype=stype, exclusive=False)
+        self._ipset_call("ipset.flush", self.ipset.flush, temporary)
+        for entry, etype in entries:
+            self._ipset_call("ipset.add", self.ipset.add, temporary, entry, etype=etype, exclusive=False)
+        self._ipset_call("ipset.swap", self.ipset.swap, name, temporary)
+        self._ipset_call("ipset.destroy", self.ipset.destroy, temporary)
+
+    def _ipset_call(self, name: str, method, *args, **kwargs) -> bool:
+        """Call an IPSet method, accounting for its cost. Return False if the
+        kernel refused it."""
+        start = time.perf_counter()
+        try:
+            method(*args, **kwargs)
+        except NetlinkError as e:
+            self.logger.debug("%s%r refused: %s", name, args, e)
+            return False
+        finally:
+            self._account_kernel_call(name, start, "ipset")
+        return True
+
+    def _submit_ipset_call(self, done_message: str, done_arg, name: str, method, *args, **kwargs):
+        """Make the programmer call an IPSet method. If the kernel accepts it,
+        log `done_message % done_arg`."""
+        def done(applied):
+            if applied:
+                self.logger.info(done_message, done_arg)
+
+        self.programmer.submit(functools.partial(self._ipset_call, name, method, *args, **kwargs), callback=done)
+
+    @staticmethod
+    def _net(destination: Subnet) -> str:
+        """Format a destination as an ipset entry."""
+        return "%s/%d" % (Address(destination), destination.prefix)
+
+    def allow_predecessor(self, predecessor, mac_address):
+        if mac_address is None:
+            self.logger.warning("Unable to allow traffic from %s: unknown MAC address", predecessor)
+        else:
+            self._submit_ipset_call("Traffic from %s is allowed", predecessor,
+                                    "ipset.add", self.ipset.add, self._predecessors, mac_address,
+                                    etype="mac", exclusive=False)
+
+    def disallow_predecessor(self, predecessor, mac_address):
+        if mac_address is not None:
+            self._submit_ipset_call("Traffic from %s is no more allowed", predecessor,
+                                    "ipset.delete", self.ipset.delete, self._predecessors, mac_address, etype="mac")
+
+    def allow_destination(self, destination):
+        self._submit_ipset_call("Traffic towards %s is allowed", destination,
+                                "ipset.add", self.ipset.add, self._destinations, self._net(destination),
+                                etype="net", exclusive=False)
+
+    def disallow_destination(self, destination):
+        # A missing destination is refused by the kernel: it is not known by
+        # netfilter, ok.
+        self._submit_ipset_call("Traffic towards %s is no more allowed", destination,
+                                "ipset.delete", self.ipset.delete, self._destinations, self._net(destination),
+                                etype="net")
+
+
+class NftablesLoopAvoidance(LoopAvoidance):
+    """Backend based on a dedicated nftables table (see
+    lrp.conf['netlink']['nftables_table']), with a named set of the allowed
+    predecessors and a named set of the allowed destinations.
+
+    Changes are only recorded until `flush`, which sends all of them as one
+    nftables transaction, applied by the programmer: they are applied
+    atomically, and an entry added then removed in the meantime is never
+    sent."""
+    uses_programmer = True
+
+    def __init__(self, account_kernel_call, queued_destinations=None, programmer=None, interface_idxs=()):
+        if nftables is None:
+            raise ImportError("The nftables loop-avoidance backend needs the libnftables python bindings")
+        super().__init__(account_kernel_call, queued_destinations, programmer, interface_idxs)
+        self.nft = nftables.Nftables()
+        self._table = "ip %s" % lrp.conf['netlink']['nftables_table']
+        # set name -> entries, as known by the kernel and as wanted
+        self._committed: Dict[str, Set[str]] = {'predecessors': set(), 'destinations': set()}
+        self._wanted: Dict[str, Set[str]] = {'predecessors': set(), 'destinations': set()}
+        # Set when the kernel state is not known: the whole table is replaced
+        # at next flush
+        self._resync = False
+        # Commands replacing the table, sent with the first flush, and again
+        # at each resync
+        self._table_commands = []
+
+    def __enter__(self):
+        first_queue, last_queue = queue_numbers()
+        queues = str(first_queue) if first_queue == last_queue else "%d-%d" % (first_queue, last_queue)
+        if self.queued_destinations is not None:
+            queue_rule = "ip daddr %s/%d queue num %s" % (
+                Address(self.queued_destinations), self.queued_destinations.prefix, queues)
+        else:
+            queue_rule = "queue num %s" % queues
+        # Replace the table left by a previous instance, if any. This is
+        # delayed until the first flush, in the same transaction as the
+        # initial content of the sets: on a warm restart, the previous table
+        # keeps filtering until then. If that transaction is refused, the
+        # table is created again by the next one.
+        self._table_commands = [
+            "add table %s" % self._table,
+            "delete table %s" % self._table,
+            "add table %s" % self._table,
+            "add set %s predecessors { type ether_addr; }" % self._table,
+            "add set %s destinations { type ipv4_addr; flags interval; }" % self._table,
+            "add chain %s forward { type filter hook forward priority 0; policy accept; }" % self._table,
+            "add rule %s forward ether saddr @predecessors accept" % self._table,
+            "add rule %s forward ip daddr @destinations accept" % self._table,
+            "add rule %s forward %s" % (self._table, queue_rule)]
+        self._resync = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.keep_kernel_state:
+            self.flush()
+            self.programmer.wait()
+            return
+        self.logger.info("Cleaning nftables (loop avoidance mechanism)")
+        self.programmer.wait()
+        self._nft_cmd("delete table %s" % self._table)
+
+    def _nft_cmd(self, *commands: str) -> bool:
+        """Run `commands` as one nftables transaction, accounting for its
+        cost. Return False if the transaction was refused."""
+        start = time.perf_counter()
+        rc, _, error = self.nft.cmd("\n".join(commands))
+        self._account_kernel_call("nftables.cmd", start, "nftables")
+        if rc != 0:
+            self.logger.error("nftables transaction refused: %s", error.strip())
+        return rc == 0
+
+    def prune(self, predecessors, destinations):
+        # Stale entries disappear with the table, replaced at first flush
+        pass
+
+    def allow_predecessor(self, predecessor, mac_address):
+        if mac_address is None:
+            self.logger.warning("Unable to allow traffic from %s: unknown MAC address", predecessor)
+        elif mac_address.lower() not in self._wanted['predecessors']:
+            self._wanted['predecessors'].add(mac_address.lower())
+            self.logger.info("Traffic from %s is allowed", predecessor)
+
+    def disallow_predecessor(self, predecessor, mac_address):
+        if mac_address is not None and mac_address.lower() in self._wanted['predecessors']:
+            self._wanted['predecessors'].remove(mac_address.lower())
+            self.logger.info("Traffic from %s is no more allowed", predecessor)
+
+    def allow_destination(self, destination):
+        entry = "%s/%d" % (Address(destination), destination.prefix)
+        if entry not in self._wanted['destinations']:
+            self._wanted['destinations'].add(entry)
+            self.logger.info("Traffic towards %s is allowed", destination)
+
+    def disallow_destination(self, destination):
+        entry = "%s/%d" % (Address(destination), destination.prefix)
+        if entry in self._wanted['destinations']:
+            self._wanted['destinations'].remove(entry)
+            self.logger.info("Traffic towards %s is no more allowed", destination)
+
+    def flush(self):
+        # On resync, the table is rewritten from scratch: it may not even
+        # exist, e.g. if the transaction creating it was refused
+        commands = list(self._table_commands) if self._resync else []
+        for name, wanted in self._wanted.items():
+            if self._resync:
+                added = wanted
+            else:
+                removed = self._committed[name] - wanted
+                added = wanted - self._committed[name]
+                if removed:
+                    commands.append("delete element %s %s { %s }" % (self._table, name, ", ".join(removed)))
+            if added:
+                commands.append("add element %s %s { %s }" % (self._table, name, ", ".join(added)))
+        if commands:
+            self._resync = False
+            self._committed = {name: set(wanted) for name, wanted in self._wanted.items()}
+            self.programmer.submit(self._nft_cmd, *commands, callback=self._transaction_done)
+
+    def _transaction_done(self, applied: bool):
+        if not applied:
+            # Nothing was applied, but later transactions may have been: the
+            # table is rewritten at next flush
+            self._resync = True
+
+
+# Classifier of BpfLoopAvoidance, compiled by bcc. MAC addresses are
+# stored in the low bytes of a u64, IPv4 addresses in network byte order.
+_BPF_CLASSIFIER = """
+#include <uapi/linux/bpf.h>
+#include <uapi/linux/if_ether.h>
+#include <uapi/linux/ip.h>
+#include <uapi/linux/pkt_cls.h>
+
+struct destination_key {
+    u32 prefixlen;
+    u32 address;
+};
+
+BPF_HASH(predecessors, u64, u8, MAX_PREDECESSORS);
+BPF_LPM_TRIE(destinations, struct destination_key, u8, MAX_DESTINATIONS);
+
+int lrp_ingress(struct __sk_buff *skb)
+{
+    void *data = (void *)(long)skb->data;
+    void *data_end = (void *)(long)skb->data_end;
+    struct ethhdr *eth = data;
+    struct iphdr *ip = data + sizeof(*eth);
+    struct destination_key destination = {32, 0};
+    u64 source = 0;
+
+    if ((void *)(ip + 1) > data_end || eth->h_proto != htons(ETH_P_IP))
+        return TC_ACT_OK;
+    __builtin_memcpy(&source, eth->h_source, ETH_ALEN);
+    destination.address = ip->daddr;
+    if (predecessors.lookup(&source) || destinations.lookup(&destination))
+        skb->mark |= ACCEPT_MARK;
+    return TC_ACT_OK;
+}
+"""
+
+
+class BpfLoopAvoidance(IptablesLoopAvoidance):
+    """Backend based on an eBPF classifier on the ingress of the LRP
+    interface, with a hash map of the allowed predecessors and a longest-prefix
+    match map of the allowed destinations. Accepted packets are marked with
+    lrp.conf['netlink']['bpf']['accept_mark']; the iptables chain accepts
+    marked packets, and sends the others to the netfilter queue. Each packet
+    costs two map lookups, whatever the number of entries. The classifier is
+    shared by all the LRP interfaces.
+
+    The classifier is attached on the first flush, with the initial content of
+    its maps: on a warm restart, the previous classifier keeps running until
+    then."""
+
+    def __init__(self, account_kernel_call, queued_destinations=None, programmer=None, interface_idxs=()):
+        if bcc is None:
+            raise ImportError("The bpf loop-avoidance backend needs the bcc python bindings")
+        super().__init__(account_kernel_call, queued_destinations, programmer, interface_idxs)
+        self.ipr = pyroute2.IPRoute()
+        self.bpf = None
+        self._classifier = None
+        self._attached = False
+
+    def __enter__(self):
+        conf = lrp.conf['netlink']['bpf']
+        start = time.perf_counter()
+        self.bpf = bcc.BPF(text=_BPF_CLASSIFIER, cflags=["-DACCEPT_MARK=%d" % conf['accept_mark'],
+                                                         "-DMAX_PREDECESSORS=%d" % conf['max_predecessors'],
+                                                         "-DMAX_DESTINATIONS=%d" % conf['max_destinations']])
+        self._classifier = self.bpf.load_func("lrp_ingress", bcc.BPF.SCHED_CLS)
+        self._account_kernel_call("bpf.load", start, None)
+        self._predecessors = self.bpf["predecessors"]
+        self._destinations = self.bpf["destinations"]
+
+        super().__enter__()
+        if self.reused_chain:
+            # The rule accepting marked packets is already there
+            return self
+        rule = iptc.Rule()
+        match = iptc.Match(rule, "mark")
+        match.mark = "0x%x/0x%x" % (conf['accept_mark'], conf['accept_mark'])
+        rule.add_match(match)
+        rule.target = iptc.Target(rule, "ACCEPT")
+        self._la_chain.insert_rule(rule)
+        self._iptables_commit()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.keep_kernel_state and self._attached:
+            self.logger.info("Detach the loop-avoidance classifier")
+            for interface_idx in self.interface_idxs:
+                self.ipr.tc("del-filter", "bpf", interface_idx, ":1", parent="ffff:",
+                            prio=lrp.conf['netlink']['bpf']['tc_priority'])
+        # The attached classifier, if kept, holds its maps
+        super().__exit__(exc_type, exc_val, exc_tb)
+        self.bpf.cleanup()
+        self.ipr.close()
+
+    def _attach(self):
+        """Attach the classifier on the ingress of the interfaces, replacing
+        the one of a previous instance, if any."""
+        start = time.perf_counter()
+        for interface_idx in self.interface_idxs:
+            try:
+                self.ipr.tc("add", "ingress", interface_idx, "ffff:")
+            except NetlinkError as e:
+                if e.code != errno.EEXIST:
+                    raise
+            self.ipr.tc("replace-filter", "bpf", interface_idx, ":1", fd=self._classifier.fd,
+                        name=self._classifier.name, parent="ffff:", classid=1, direct_action=True,
+                        prio=lrp.conf['netlink']['bpf']['tc_priority'])
+        self._account_kernel_call("bpf.attach", start, None)
+        self._attached = True
+        self.logger.info("Loop-avoidance classifier attached")
+
+    def _map_update(self, table, key):
+        """Add `key` to a map, accounting for its cost."""
+        start = time.perf_counter()
+        table[key] = table.Leaf(1)
+        self._account_kernel_call("bpf.update", start, "bpf")
+
+    def _map_delete(self, table, key):
+        """Remove `key` from a map, if it is there, accounting for its
+        cost."""
+        start = time.perf_counter()
+        try:
+            del table[key]
+        except KeyError:
+            # Not known by the classifier, ok
+            pass
+        self._account_kernel_call("bpf.delete", start, "bpf")
+
+    def _predecessor_key(self, mac_address: str):
+        return self._predecessors.Key(int.from_bytes(bytes.fromhex(mac_address.replace(":", "")), "little"))
+
+    def _destination_key(self, destination: Subnet):
+        return self._destinations.Key(destination.prefix, int.from_bytes(destination.as_bytes, "little"))
+
+    def prune(self, predecessors, destinations):
+        # The maps of the new classifier start empty, but a chain left by the
+        # iptables backend has per-entry rules, all stale
+        super().prune(set(), set())
+
+    def allow_predecessor(self, predecessor, mac_address):
+        if mac_address is None:
+            self.logger.warning("Unable to allow traffic from %s: unknown MAC address", predecessor)
+        else:
+            self._map_update(self._predecessors, self._predecessor_key(mac_address))
+            self.logger.info("Traffic from %s is allowed", predecessor)
+
+    def disallow_predecessor(self, predecessor, mac_address):
+        if mac_address is not None:
+            self._map_delete(self._predecessors, self._predecessor_key(mac_address))
+            self.logger.info("Traffic from %s is no more allowed", predecessor)
+
+    def allow_destination(self, destination):
+        self._map_update(self._destinations, self._destination_key(destination))
+        self.logger.info("Traffic towards %s is allowed", destination)
+
+    def disallow_destination(self, destination):
+        self._map_delete(self._destinations, self._destination_key(destination))
+        self.logger.info("Traffic towards %s is no more allowed", destination)
+
+    def flush(self):
+        if not self._attached:
+            self._attach()
+
+
+# Available backends, by name. See lrp.conf['netlink']['loop_avoidance_backend'].
+LOOP_AVOIDANCE_BACKENDS = {
+    "iptables": IptablesLoopAvoidance,
+    "ipset": IpsetLoopAvoidance,
+    "nftables": NftablesLoopAvoidance,
+    "bpf": BpfLoopAvoidance,
+}
@@ -0,0 +1,124 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import collections
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+import lrp
+
+_CONTAINERS = (dict, list, set, frozenset, tuple, collections.deque)
+
+
+def deep_sizeof(obj) -> int:
+    """Return the size of an object, including all objects it references.
+
+    Builtin containers are followed. Other objects are followed through their
+    attributes only if their class is defined by LRP: this way, objects of
+    third-party libraries are accounted for, but not the whole library state
+    they may reference."""
+    seen = set()
+    to_visit = [obj]
+    size = 0
+    while to_visit:
+        obj = to_visit.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            to_visit.extend(obj.keys())
+            to_visit.extend(obj.values())
+        elif isinstance(obj, _CONTAINERS):
+            to_visit.extend(obj)
+        if type(obj).__module__.startswith("lrp."):
+            if hasattr(obj, "__dict__"):
+                to_visit.append(obj.__dict__)
+            for attr_name in getattr(type(obj), "__slots__", ()):
+                try:
+                    to_visit.append(getattr(obj, attr_name))
+                except AttributeError:
+                    # Unset slot
+                    pass
+    return size
+
+
+class MemoryReport:
+    """Report the memory used by the main data structures of a LRP process.
+
+    If tracemalloc is tracing, each report also shows the allocation
+    differences since the previous one."""
+    logger = logging.getLogger("Memory")
+
+    def __init__(self):
+        self._previous_snapshot = None
+
+    def report(self, structures: Dict[str, object]) -> str:
+        """Build the report, for the structures given as a name -> object
+        dict."""
+        lines = ["%-40s %10s %14s" % ("structure", "entries", "size (bytes)")]
+        for name, structure in structures.items():
+            try:
+                entries = "%d" % len(structure)
+            except TypeError:
+                entries = "-"
+            lines.append("%-40s %10s %14d" % (name, entries, deep_sizeof(structure)))
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            lines.append("")
+            lines.append("tracemalloc: %d bytes traced, peak %d bytes" % (traced, peak))
+            if self._previous_snapshot is None:
+                lines.append("Top allocations:")
+                statistics = snapshot.statistics("lineno")
+            else:
+                lines.append("Top allocation differences since the previous report:")
+                statistics = snapshot.compare_to(self._previous_snapshot, "lineno")
+            lines.extend("  %s" % stat for stat in statistics[:lrp.conf['memory']['tracemalloc_top']])
+            self._previous_snapshot = snapshot
+        return "\n".join(lines) + "\n"
+
+    def dump(self, structures: Dict[str, object]) -> str:
+        """Write the report in a file. Return the path of this file."""
+        path = os.path.join(lrp.conf['diagnostics_directory'],
+                            "lrp-%d-%s.memory" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        with open(path, "w") as f:
+            f.write(self.report(structures))
+        self.logger.warning("Memory report written in %s", path)
+        return path
@@ -83,23 +83,27 @@ class Message(metaclass=abc.ABCMeta):
 
 @Message.record_message_type
 class DIO(Message):
-    __slots__ = ("metric_value", "sink")
+    __slots__ = ("metric_value", "sink", "sink_load")
     message_type = MessageType.DIO
 
     @classmethod
     def parse(cls, flow):
         metric_value = int.from_bytes(flow[1:3], lrp.conf['endianess'])
         sink = Address(flow[3:7])
-        return cls(metric_value, sink)
+        # sink_load is optional, for compatibility with older nodes
+        sink_load = int.from_bytes(flow[7:9], lrp.conf['endianess']) if len(flow) >= 9 else 0
+        return cls(metric_value, sink, sink_load)
 
-    def __init__(self, metric_value: int, sink: Address):
+    def __init__(self, metric_value: int, sink: Address, sink_load: int = 0):
         self.metric_value = metric_value
         self.sink = sink
+        self.sink_load = sink_load
 
     def dump(self):
         result = b""
         result += self.metric_value.to_bytes(2, lrp.conf['endianess'])
         result += self.sink.as_bytes
+        result += self.sink_load.to_bytes(2, lrp.conf['endianess'])
         return super(DIO, self).dump() + result
 
 
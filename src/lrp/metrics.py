@@ -0,0 +1,261 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import bisect
+import contextlib
+import http.server
+import ipaddress
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, Tuple, Callable
+
+import lrp
+
+# Default histogram buckets, in s: from 10µs to 10s
+DEFAULT_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 1e-1, 5e-1, 1, 5, 10)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: tuple, extra: str = "") -> str:
+    labels = ",".join('%s="%s"' % (name, value) for name, value in zip(label_names, label_values))
+    if extra:
+        labels = labels + "," + extra if labels else extra
+    return "{%s}" % labels if labels else ""
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def render(self):
+        yield "# HELP %s %s" % (self.name, self.documentation)
+        yield "# TYPE %s %s" % (self.name, self.metric_type)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def items(self):
+        """Return the (label values, value) pairs of this counter."""
+        return list(self._values.items())
+
+    def render(self):
+        yield from super().render()
+        for label_values, value in list(self._values.items()):
+            yield "%s%s %s" % (self.name, _format_labels(self.label_names, label_values), value)
+
+
+class Gauge(_Metric):
+    """A value which can go up and down. If `callback` is given, the value is
+    computed by calling it at export time."""
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, label_names=(), callback: Callable[[], float] = None):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def render(self):
+        yield from super().render()
+        if self.callback is not None:
+            yield "%s %s" % (self.name, self.callback())
+        for label_values, value in list(self._values.items()):
+            yield "%s%s %s" % (self.name, _format_labels(self.label_names, label_values), value)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # For each label values: [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value, *label_values):
+        try:
+            counts, total = self._values[label_values]
+        except KeyError:
+            counts, total = [0] * (len(self.buckets) + 1), 0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[label_values] = [counts, total + value]
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """Observe the wall-clock duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        yield from super().render()
+        for label_values, (counts, total) in list(self._values.items()):
+            cumulated = 0
+            for bound, count in zip(self.buckets + ("+Inf",), list(counts)):
+                cumulated += count
+                yield "%s_bucket%s %d" % (self.name,
+                                          _format_labels(self.label_names, label_values, 'le="%s"' % bound),
+                                          cumulated)
+            labels = _format_labels(self.label_names, label_values)
+            yield "%s_sum%s %s" % (self.name, labels, total)
+            yield "%s_count%s %d" % (self.name, labels, cumulated)
+
+
+class Registry:
+    """A set of metrics, exported in the Prometheus text format. As for
+    loggers, a metric is created on its first request, and the same instance
+    is returned on the following ones.
+
+    Metrics are updated from the protocol loop and read by the export server
+    from its own thread: updates are plain dict operations, never blocked by
+    the export."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get(self, metric_class, name, *args, **kwargs):
+        try:
+            return self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str = "", label_names=()) -> Counter:
+        return self._get(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str = "", label_names=(), callback=None) -> Gauge:
+        return self._get(Gauge, name, documentation, label_names, callback=callback)
+
+    def histogram(self, name: str, documentation: str = "", label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self) -> str:
+        """Export all metrics, in the Prometheus text format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serve a registry on a local socket, from a background thread.
+
+    address: a path, for a Unix socket (the metrics are written as soon as a
+      client connects), or a "[host:]port" string, for a TCP socket served
+      over HTTP (for Prometheus scrapers). The host defaults to
+      lrp.conf['metrics']['default_host']. Non-loopback hosts are refused,
+      unless lrp.conf['metrics']['allow_public'] is set."""
+    logger = logging.getLogger("Metrics")
+
+    def __init__(self, registry: Registry, address: str):
+        self.registry = registry
+        self.address = address
+        self._server = None
+        self._thread = None
+
+    @property
+    def is_unix(self) -> bool:
+        return "/" in self.address
+
+    def _tcp_address(self) -> Tuple[str, int]:
+        host, _, port = self.address.rpartition(":")
+        if host == "":
+            host = lrp.conf['metrics']['default_host']
+        resolved = {info[4][0] for info in socket.getaddrinfo(host, int(port), socket.AF_INET, socket.SOCK_STREAM)}
+        if not all(ipaddress.ip_address(address).is_loopback for address in resolved):
+            if not lrp.conf['metrics']['allow_public']:
+                raise Exception("Refuse to serve the metrics, which are not authenticated, on the non-loopback "
+                                "address %s. Allow it explicitly with --metrics-public." % host)
+            self.logger.warning("Metrics are served on the non-loopback address %s, without authentication", host)
+        return host, int(port)
+
+    def __enter__(self):
+        registry = self.registry
+        logger = self.logger
+
+        if self.is_unix:
+            class UnixHandler(socketserver.StreamRequestHandler):
+                def handle(self):
+                    self.wfile.write(registry.render().encode())
+
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = socketserver.UnixStreamServer(self.address, UnixHandler)
+        else:
+            class HttpHandler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = registry.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    logger.debug(format, *args)
+
+            self._server = http.server.HTTPServer(self._tcp_address(), HttpHandler)
+
+        self.logger.info("Serve metrics on %s", self.address)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        if self.is_unix:
+            os.unlink(self.address)
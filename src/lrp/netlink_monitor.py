@@ -0,0 +1,309 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import ctypes
+import errno
+import logging
+import socket
+import struct
+from typing import Callable, Dict, List, Optional
+
+import pyroute2
+from pyroute2.netlink import NLM_F_MULTI
+from pyroute2.netlink.rtnl import RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV4_ROUTE, RTMGRP_NEIGH, \
+    RTM_NEWROUTE, RTM_DELROUTE, ifinfmsg
+
+import lrp
+from lrp.kernel_routes import KernelRoute, parse_route
+from lrp.tools import Address, Subnet
+
+# Neighbour states without a usable layer 2 address. See `man rtnetlink.7`.
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+
+# Discard service (RFC 863): datagrams sent to it only trigger ARP resolution
+DISCARD_PORT = 9
+
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)
+
+
+def _route_filter(proto_number: int) -> bytes:
+    """Return a classic BPF socket filter dropping the route notifications of
+    other protocols than `proto_number`, so that they are not even read. Dump
+    replies (NLM_F_MULTI) are kept whole: they may hold many messages."""
+    def host_u16(value):
+        # Netlink headers are in host byte order, BPF loads are big-endian
+        return int.from_bytes(struct.pack("=H", value), "big")
+
+    program = [
+        (0x28, 0, 0, 6),  # ldh [6]: nlmsg_flags
+        (0x45, 5, 0, host_u16(NLM_F_MULTI)),  # jset NLM_F_MULTI -> accept
+        (0x28, 0, 0, 4),  # ldh [4]: nlmsg_type
+        (0x15, 1, 0, host_u16(RTM_NEWROUTE)),  # jeq -> check protocol
+        (0x15, 0, 2, host_u16(RTM_DELROUTE)),  # jeq -> check protocol, else accept
+        (0x30, 0, 0, 16 + 5),  # ldb [21]: rtm_protocol
+        (0x15, 0, 1, proto_number),  # jeq -> accept, else drop
+        (0x06, 0, 0, 0xffffffff),  # accept
+        (0x06, 0, 0, 0),  # drop
+    ]
+    return b"".join(struct.pack("=HBBI", *instruction) for instruction in program)
+
+
+class NetlinkMonitor:
+    """In-memory copy of the kernel state LRP depends on, kept up to date by
+    rtnetlink notifications, so that it can be read without any kernel call.
+
+    Its socket (see `fileno`) should be watched by the event loop, which should
+    call `handle_events` each time it is readable."""
+    logger = logging.getLogger("NetlinkMonitor")
+
+    def __init__(self, interface_idx: int, watch_routes: bool = True):
+        """Constructor.
+
+        interface_idx: the index of the interface LRP uses
+        watch_routes: whether the LRP routes are followed too. They do not
+          depend on the interface: with many interfaces, only one monitor
+          needs to."""
+        self.interface_idx = interface_idx
+        self.watch_routes = watch_routes
+        self.ipr = pyroute2.IPRoute()
+        self._resolution_socket = None
+        self._handlers = {'RTM_NEWLINK': self._handle_link,
+                          'RTM_DELLINK': self._handle_link,
+                          'RTM_NEWADDR': self._handle_address,
+                          'RTM_DELADDR': self._handle_address,
+                          'RTM_NEWROUTE': self._handle_route,
+                          'RTM_DELROUTE': self._handle_route,
+                          'RTM_NEWNEIGH': self._handle_neighbour,
+                          'RTM_DELNEIGH': self._handle_neighbour}
+
+        # State of the LRP interface. Listeners are called with the new state.
+        self.link_up = False
+        self._addresses: List[Address] = []
+        self.link_listeners: List[Callable[[bool], None]] = []
+        self.address_listeners: List[Callable[[Optional[Address]], None]] = []
+        # Routes owned by LRP. Listeners are called as `(destination, route)`,
+        # route being None when removed.
+        self.routes: Dict[Subnet, KernelRoute] = {}
+        self.route_listeners: List[Callable[[Subnet, Optional[KernelRoute]], None]] = []
+        # Neighbours of the LRP interface, in both directions. Layer 2
+        # addresses are kept as bytes.
+        self._mac_by_ip: Dict[Address, bytes] = {}
+        self._ip_by_mac: Dict[bytes, Address] = {}
+        # Called as `(ip_address, mac_address)` each time a neighbour gets a
+        # (new) layer 2 address
+        self.neighbour_listeners: List[Callable[[Address, bytes], None]] = []
+        # Number of times notifications were lost, as the socket overflowed
+        self.overruns = 0
+
+    def __enter__(self):
+        if self.watch_routes:
+            self._attach_route_filter()
+        # Subscribe before dumping, so that no change is missed
+        groups = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_NEIGH
+        if self.watch_routes:
+            groups |= RTMGRP_IPV4_ROUTE
+        self.ipr.bind(groups=groups)
+        self._dump()
+        self.logger.debug("Link %s, address %s, %d LRP routes and %d neighbours known",
+                          "up" if self.link_up else "down", self.address, len(self.routes), len(self._mac_by_ip))
+        self._resolution_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._resolution_socket.close()
+        self.ipr.close()
+
+    def fileno(self) -> int:
+        return self.ipr.fileno()
+
+    def _attach_route_filter(self):
+        """Make the kernel drop the notifications of the other routes. See
+        `_route_filter`."""
+        program = ctypes.create_string_buffer(_route_filter(lrp.conf['netlink']['proto_number']))
+        fprog = struct.pack("HP", len(program.raw) // 8, ctypes.addressof(program))
+        sock = socket.fromfd(self.ipr.fileno(), socket.AF_NETLINK, socket.SOCK_RAW)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        finally:
+            # Only closes the duplicated file descriptor
+            sock.close()
+
+    def _dump(self):
+        """Read the whole state from the kernel. Entries which are not there
+        anymore are removed, as if their removal had been notified."""
+        for msg in self.ipr.get_links(self.interface_idx):
+            self._handle_link(msg)
+
+        old_address = self.address
+        self._addresses = [Address(msg.get_attr('IFA_ADDRESS'))
+                           for msg in self.ipr.get_addr(family=socket.AF_INET, index=self.interface_idx)
+                           if msg['index'] == self.interface_idx]
+        self._address_maybe_changed(old_address)
+
+        if self.watch_routes:
+            stale_routes = set(self.routes)
+            for msg in self.ipr.get_routes(family=socket.AF_INET, proto=lrp.conf['netlink']['proto_number']):
+                self._handle_route(msg)
+                stale_routes.discard(parse_route(msg)[0])
+            for destination in stale_routes:
+                self._remove_route(destination)
+
+        stale_neighbours = set(self._mac_by_ip)
+        for msg in self.ipr.get_neighbours(family=socket.AF_INET, ifindex=self.interface_idx):
+            self._handle_neighbour(msg)
+            stale_neighbours.discard(Address(msg.get_attr('NDA_DST')))
+        for ip_address in stale_neighbours:
+            self._forget_neighbour(ip_address)
+
+    def handle_events(self):
+        """Update the copy with the notifications waiting in the socket. If some
+        were lost, as the socket overflowed, the whole state is read again."""
+        try:
+            messages = self.ipr.get()
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+            self.overruns += 1
+            self.logger.warning("Netlink notifications were lost: read the whole state again")
+            self._dump()
+            return
+        for msg in messages:
+            try:
+                handler = self._handlers[msg['event']]
+            except KeyError:
+                # Not an event we are interested in
+                pass
+            else:
+                handler(msg)
+
+    @property
+    def address(self) -> Optional[Address]:
+        """The (first) IPv4 address of the LRP interface, or None."""
+        return self._addresses[0] if self._addresses else None
+
+    def _handle_link(self, msg):
+        if msg['index'] != self.interface_idx:
+            return
+        link_up = msg['event'] == 'RTM_NEWLINK' and \
+            msg['flags'] & (ifinfmsg.IFF_UP | ifinfmsg.IFF_RUNNING) == ifinfmsg.IFF_UP | ifinfmsg.IFF_RUNNING
+        if link_up != self.link_up:
+            self.link_up = link_up
+            self.logger.debug("Link is %s", "up" if link_up else "down")
+            for listener in self.link_listeners:
+                listener(link_up)
+
+    def _handle_address(self, msg):
+        if msg['index'] != self.interface_idx or msg['family'] != socket.AF_INET:
+            return
+        old_address = self.address
+        address = Address(msg.get_attr('IFA_ADDRESS'))
+        if msg['event'] == 'RTM_NEWADDR':
+            if address not in self._addresses:
+                self._addresses.append(address)
+        elif address in self._addresses:
+            self._addresses.remove(address)
+        self._address_maybe_changed(old_address)
+
+    def _address_maybe_changed(self, old_address: Optional[Address]):
+        if self.address != old_address:
+            self.logger.debug("Interface address is now %s", self.address)
+            for listener in self.address_listeners:
+                listener(self.address)
+
+    def _handle_route(self, msg):
+        if msg['family'] != socket.AF_INET or msg['proto'] != lrp.conf['netlink']['proto_number']:
+            return
+        destination, route = parse_route(msg)
+        if msg['event'] == 'RTM_DELROUTE':
+            self._remove_route(destination)
+            return
+        self.routes[destination] = route
+        for listener in self.route_listeners:
+            listener(destination, route)
+
+    def _remove_route(self, destination: Subnet):
+        self.routes.pop(destination, None)
+        for listener in self.route_listeners:
+            listener(destination, None)
+
+    def _handle_neighbour(self, msg):
+        if msg['ifindex'] != self.interface_idx or msg['family'] != socket.AF_INET:
+            return
+        ip_address = Address(msg.get_attr('NDA_DST'))
+        lladdr = msg.get_attr('NDA_LLADDR')
+        old_mac = self._mac_by_ip.get(ip_address)
+        if msg['event'] == 'RTM_NEWNEIGH' and lladdr is not None and \
+                not msg['state'] & (NUD_INCOMPLETE | NUD_FAILED):
+            mac_address = bytes.fromhex(lladdr.replace(":", ""))
+            if mac_address == old_mac:
+                return
+            if old_mac is not None:
+                self._forget_mac(old_mac, ip_address)
+            self._mac_by_ip[ip_address] = mac_address
+            self._ip_by_mac[mac_address] = ip_address
+            self.logger.debug("Neighbour %s is at %s", ip_address, lladdr)
+            for listener in self.neighbour_listeners:
+                listener(ip_address, mac_address)
+        elif old_mac is not None:
+            self._forget_neighbour(ip_address)
+
+    def _forget_neighbour(self, ip_address: Address):
+        self._forget_mac(self._mac_by_ip.pop(ip_address), ip_address)
+        self.logger.debug("Neighbour %s is no more resolved", ip_address)
+
+    def _forget_mac(self, mac_address: bytes, ip_address: Address):
+        # The layer 2 address may already be used by another neighbour
+        if self._ip_by_mac.get(mac_address) == ip_address:
+            del self._ip_by_mac[mac_address]
+
+    def mac_of(self, ip_address: Address) -> Optional[bytes]:
+        """Return the layer 2 address of a neighbour, or None if unknown."""
+        return self._mac_by_ip.get(ip_address)
+
+    def ip_of(self, mac_address: bytes) -> Optional[Address]:
+        """Return the layer 3 address of a neighbour, or None if unknown."""
+        return self._ip_by_mac.get(mac_address)
+
+    def resolve(self, ip_address: Address):
+        """Make the kernel resolve the layer 2 address of a neighbour. The
+        neighbour listeners are called once it is known."""
+        try:
+            self._resolution_socket.sendto(b"", (str(ip_address), DISCARD_PORT))
+        except OSError as e:
+            self.logger.warning("Unable to resolve %s: %s", ip_address, e)
+
+    def memory_structures(self) -> Dict[str, object]:
+        """Return the structures to be included in memory reports."""
+        return {'netlink_monitor.routes': self.routes,
+                'netlink_monitor.neighbours': self._mac_by_ip}
@@ -0,0 +1,239 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import collections
+import logging
+import multiprocessing
+import select
+import signal
+import struct
+import sys
+import time
+from typing import List, Tuple
+
+import lrp
+
+# A non-routable packet, as sent by a worker to the protocol core: source and
+# destination addresses, MAC address of the sender
+_EVENT = struct.Struct("!4s4s6s")
+# Events sent at once by a worker. Writes to a pipe up to PIPE_BUF (4096)
+# bytes are atomic, so that the events of the workers are not interleaved.
+_EVENTS_PER_WRITE = 4000 // _EVENT.size
+
+# Counters of each worker, in the shared array
+_PACKETS, _DUPLICATES, _RATE_LIMITED = range(3)
+
+
+def queue_numbers() -> Tuple[int, int]:
+    """Return the first and the last netfilter queues non-routable packets are
+    sent to."""
+    first = lrp.conf['netlink']['netfilter_queue_nb']
+    return first, first + max(lrp.conf['netlink']['nfqueue_workers']['count'], 1) - 1
+
+
+class NfqueueWorkers:
+    """Handle the non-routable packets in worker processes, one per netfilter
+    queue. The kernel balances the packets among the queues.
+
+    Each worker gives the verdict, then drops the packets already seen during
+    the last `dedup_interval` seconds, and the packets exceeding `rate_limit`
+    per second. The others are sent to the protocol core as compact events,
+    through a pipe: the event loop should call `read_events` each time it is
+    readable (see `fileno`). The protocol state stays in the core process.
+
+    The event loop should also call `respawn` when a worker dies, that is when
+    its sentinel (see `sentinels`) is readable."""
+    logger = logging.getLogger("NfqueueWorkers")
+
+    def __init__(self, first_queue: int, count: int, dedup_interval: float, rate_limit: int,
+                 sock_len: int = None, respawn_limit: int = 0):
+        """Constructor.
+
+        first_queue: number of the netfilter queue of the first worker. Next
+          workers use the next queues.
+        count: number of workers
+        dedup_interval: a worker sends again the same event only after this
+          delay, in s
+        rate_limit: maximum number of events sent by a worker per second
+        sock_len: size of the receive buffer of the queues. None keeps the
+          default size.
+        respawn_limit: number of times dead workers are restarted"""
+        self.first_queue = first_queue
+        self.count = count
+        self.dedup_interval = dedup_interval
+        self.rate_limit = rate_limit
+        self.sock_len = sock_len
+        self.respawn_limit = respawn_limit
+        # Number of workers restarted so far
+        self.respawns = 0
+        # Workers are started from scratch, not forked from a process running
+        # threads
+        self._context = multiprocessing.get_context("spawn")
+        self._counters = self._context.RawArray("Q", 3 * count)
+        self._processes = []
+        self._reader = None
+        # Kept open, for the respawned workers: the pipe never reaches its end
+        self._writer = None
+
+    def __enter__(self):
+        self._reader, self._writer = self._context.Pipe(duplex=False)
+        for i in range(self.count):
+            self._processes.append(self._start_worker(i))
+        self.logger.info("Started %d workers, on netfilter queues %d to %d",
+                         self.count, self.first_queue, self.first_queue + self.count - 1)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes.clear()
+        self._writer.close()
+        self._reader.close()
+
+    def _start_worker(self, i: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=_run_worker, name="NfqueueWorker-%d" % i, daemon=True,
+            args=(self.first_queue + i, self._writer, self._counters, 3 * i, self.dedup_interval, self.rate_limit,
+                  self.sock_len))
+        process.start()
+        return process
+
+    def fileno(self) -> int:
+        return self._reader.fileno()
+
+    @property
+    def sentinels(self) -> List[int]:
+        """The sentinel of each worker: a descriptor which becomes readable
+        when the worker dies."""
+        return [process.sentinel for process in self._processes]
+
+    def respawn(self, i: int) -> int:
+        """Restart the worker `i`, which is dead. Return its new sentinel.
+        Raise an Exception if `respawn_limit` is reached: the netfilter queue
+        of the worker would not be read anymore."""
+        process = self._processes[i]
+        process.join()
+        if self.respawns >= self.respawn_limit:
+            raise Exception("nfqueue worker %d (queue %d) died with exit code %s, and %d workers were already "
+                            "restarted" % (i, self.first_queue + i, process.exitcode, self.respawns))
+        self.logger.error("Worker %d (queue %d) died with exit code %s, restart it",
+                          i, self.first_queue + i, process.exitcode)
+        self.respawns += 1
+        self._processes[i] = self._start_worker(i)
+        return self._processes[i].sentinel
+
+    def read_events(self, budget: int = None) -> List[Tuple[bytes, bytes, bytes]]:
+        """Return the events waiting in the pipe, as (source, destination,
+        sender MAC) tuples. If `budget` is set, stop reading once it is
+        reached: the pipe stays readable. A worker writes up to
+        `_EVENTS_PER_WRITE` events at once, so that up to `budget +
+        _EVENTS_PER_WRITE - 1` events are returned."""
+        events = []
+        while (budget is None or len(events) < budget) and self._reader.poll():
+            events.extend(_EVENT.iter_unpack(self._reader.recv_bytes()))
+        return events
+
+    def _total(self, counter: int) -> int:
+        return sum(self._counters[counter::3])
+
+    @property
+    def packets(self) -> int:
+        """Number of packets received by the workers."""
+        return self._total(_PACKETS)
+
+    @property
+    def duplicates(self) -> int:
+        """Number of packets dropped because their event was recently sent."""
+        return self._total(_DUPLICATES)
+
+    @property
+    def rate_limited(self) -> int:
+        """Number of packets dropped by the rate limit of the workers."""
+        return self._total(_RATE_LIMITED)
+
+
+def _run_worker(queue_nb, writer, counters, offset, dedup_interval, rate_limit, sock_len):
+    """Main function of a worker process."""
+    import netfilterqueue
+
+    # Ctrl-C is for the protocol core, which then terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Event -> time it was last sent, oldest first
+    recently_sent = collections.OrderedDict()
+    # Token bucket of the rate limit
+    tokens, last_refill = float(rate_limit), time.monotonic()
+    pending = []
+
+    def handle_packet(packet):
+        nonlocal tokens, last_refill
+        counters[offset + _PACKETS] += 1
+        payload = packet.get_payload()
+        event = payload[12:20] + packet.get_hw()[0:6]
+        packet.drop()
+
+        now = time.monotonic()
+        while recently_sent:
+            oldest, sent_at = next(iter(recently_sent.items()))
+            if now - sent_at < dedup_interval:
+                break
+            del recently_sent[oldest]
+        if event in recently_sent:
+            counters[offset + _DUPLICATES] += 1
+            return
+        tokens = min(float(rate_limit), tokens + (now - last_refill) * rate_limit)
+        last_refill = now
+        if tokens < 1:
+            counters[offset + _RATE_LIMITED] += 1
+            return
+        tokens -= 1
+        recently_sent[event] = now
+        pending.append(event)
+
+    queue = netfilterqueue.NetfilterQueue()
+    if sock_len is not None:
+        queue.bind(queue_nb, handle_packet, sock_len=sock_len)
+    else:
+        queue.bind(queue_nb, handle_packet)
+    try:
+        while True:
+            select.select([queue.get_fd()], [], [])
+            queue.run(block=False)
+            for i in range(0, len(pending), _EVENTS_PER_WRITE):
+                writer.send_bytes(b"".join(pending[i:i + _EVENTS_PER_WRITE]))
+            pending.clear()
+    finally:
+        queue.unbind()
@@ -0,0 +1,123 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import cProfile
+import logging
+import os
+import sched
+import time
+from typing import Dict, List
+
+import lrp
+
+
+class Profiler:
+    """On-demand profiling of the LRP process.
+
+    When started, the calling thread is profiled by cProfile, and the
+    durations reported through `record` are accumulated per name. When
+    stopped, both are written in `lrp.conf['diagnostics_directory']`: the
+    cProfile statistics in a `.pstats` file (see the `pstats` module), and the
+    accumulated durations in a `.timings` text file."""
+    logger = logging.getLogger("Profiler")
+
+    def __init__(self, scheduler: sched.scheduler):
+        self.scheduler = scheduler
+        self._profile = None
+        self._stop_event = None
+        # name -> [count, total duration, max duration]. None when inactive.
+        self._timings: Dict[str, List] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, duration: float = None):
+        """Start profiling for `duration` s (default:
+        lrp.conf['profiling']['duration']). Do nothing if already started."""
+        if self.is_active:
+            self.logger.warning("Profiling already started")
+            return
+        if duration is None:
+            duration = lrp.conf['profiling']['duration']
+        self.logger.warning("Start profiling for %gs", duration)
+        self._timings = {}
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._stop_event = self.scheduler.enter(duration, 0, action=self.stop)
+
+    def stop(self):
+        """Stop profiling, and write the results."""
+        if not self.is_active:
+            return
+        self._profile.disable()
+        if self._stop_event is not None:
+            try:
+                self.scheduler.cancel(self._stop_event)
+            except ValueError:
+                # We are called by this event
+                pass
+            self._stop_event = None
+
+        base_name = os.path.join(lrp.conf['diagnostics_directory'],
+                                 "lrp-%d-%s" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        self._profile.dump_stats(base_name + ".pstats")
+        with open(base_name + ".timings", "w") as timings_file:
+            timings_file.write("%-40s %10s %12s %12s %12s\n" % ("name", "count", "total (s)", "mean (s)", "max (s)"))
+            for name, (count, total, maximum) in sorted(self._timings.items(), key=lambda item: -item[1][1]):
+                timings_file.write("%-40s %10d %12.6f %12.6f %12.6f\n" % (name, count, total, total / count, maximum))
+        self.logger.warning("Profiling stopped, results written in %s.{pstats,timings}", base_name)
+
+        self._profile = None
+        self._timings = None
+
+    def toggle(self):
+        if self.is_active:
+            self.stop()
+        else:
+            self.start()
+
+    def record(self, name: str, duration: float):
+        """Account for `duration` s spent in `name`. Almost free when the
+        profiler is inactive."""
+        if self._timings is None:
+            return
+        try:
+            timing = self._timings[name]
+        except KeyError:
+            self._timings[name] = [1, duration, duration]
+        else:
+            timing[0] += 1
+            timing[1] += duration
+            if duration > timing[2]:
+                timing[2] = duration
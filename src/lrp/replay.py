@@ -0,0 +1,225 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+import random
+import sched
+import struct
+import time
+
+import click
+
+from lrp.daemon import LrpProcess
+from lrp.message import Message
+from lrp.tools import Address
+
+# File format: a header, then a sequence of records. All integers are
+# big-endian. Timestamps are in s, relative to the start of the recording.
+_MAGIC = b"LRPR"
+_VERSION = 1
+# magic, version, is_sink, own_ip, initial metric, random seed
+_HEADER = struct.Struct("!4sBB4sHQ")
+# timestamp, record kind
+_RECORD = struct.Struct("!dB")
+
+RECORD_MESSAGE = 0  # sender, is_broadcast, length, then the message itself
+RECORD_NON_ROUTABLE = 1  # source, destination, sender
+RECORD_UNKNOWN_HOST = 2  # destination
+RECORD_TIMER = 3  # nothing more
+
+_MESSAGE = struct.Struct("!4sBB")
+_NON_ROUTABLE = struct.Struct("!4s4s4s")
+_UNKNOWN_HOST = struct.Struct("!4s")
+
+
+class Recorder:
+    """Record all inputs of a LRP process in a compact binary file: received
+    messages, non-routable packets, unknown hosts, and timer activations.
+
+    The random generator is seeded at the start of the recording, and the
+    seed is saved: a replay of the file is deterministic (see `replay`)."""
+    logger = logging.getLogger("Recorder")
+
+    def __init__(self, path: str, lrp_process: LrpProcess):
+        self.path = path
+        self.lrp_process = lrp_process
+        self._file = None
+        self._start = None
+
+    def __enter__(self):
+        self.logger.info("Record inputs in %s", self.path)
+        seed = random.getrandbits(64)
+        random.seed(seed)
+        self._file = open(self.path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, self.lrp_process.is_sink,
+                                      self.lrp_process.own_ip.as_bytes, self.lrp_process.own_metric, seed))
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+
+    def _record(self, kind: int, payload: bytes = b""):
+        self._file.write(_RECORD.pack(time.monotonic() - self._start, kind) + payload)
+
+    def record_message(self, msg: Message, sender: Address, is_broadcast: bool):
+        data = msg.dump()
+        self._record(RECORD_MESSAGE, _MESSAGE.pack(sender.as_bytes, is_broadcast, len(data)) + data)
+
+    def record_non_routable(self, source: Address, destination: Address, sender: Address):
+        self._record(RECORD_NON_ROUTABLE, _NON_ROUTABLE.pack(source.as_bytes, destination.as_bytes, sender.as_bytes))
+
+    def record_unknown_host(self, destination: Address):
+        self._record(RECORD_UNKNOWN_HOST, _UNKNOWN_HOST.pack(destination.as_bytes))
+
+    def record_timer(self):
+        self._record(RECORD_TIMER)
+
+
+def read_records(path: str):
+    """Read a recording. Return its header, as a dict, and a generator of
+    (timestamp, kind, payload) tuples, where payload is a tuple whose content
+    depends on the kind."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, is_sink, own_ip, metric, seed = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception("%s: not a LRP recording (or unsupported version)" % path)
+    header = dict(is_sink=bool(is_sink), own_ip=Address(own_ip), metric=metric, seed=seed)
+
+    def records():
+        offset = _HEADER.size
+        while offset < len(data):
+            timestamp, kind = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if kind == RECORD_MESSAGE:
+                sender, is_broadcast, length = _MESSAGE.unpack_from(data, offset)
+                offset += _MESSAGE.size
+                payload = (Address(sender), bool(is_broadcast), data[offset:offset + length])
+                offset += length
+            elif kind == RECORD_NON_ROUTABLE:
+                payload = tuple(Address(a) for a in _NON_ROUTABLE.unpack_from(data, offset))
+                offset += _NON_ROUTABLE.size
+            elif kind == RECORD_UNKNOWN_HOST:
+                payload = (Address(_UNKNOWN_HOST.unpack_from(data, offset)[0]),)
+                offset += _UNKNOWN_HOST.size
+            elif kind == RECORD_TIMER:
+                payload = ()
+            else:
+                raise Exception("%s: unknown record kind %d at offset %d" % (path, kind, offset))
+            yield timestamp, kind, payload
+
+    return header, records()
+
+
+class ReplayLrpProcess(LrpProcess):
+    """A LRP process fed by a recording. Messages are serialized, but not sent,
+    and the routing table is only kept in memory. Time is virtual: timed
+    events are triggered according to the timestamps of the recording.
+
+    Timer records of the recording are checked against the scheduler: each
+    one with no timed event due is a divergence of the replay."""
+
+    def __init__(self, own_ip: Address, **remaining_kwargs):
+        self._own_ip = own_ip
+        self.clock = 0
+        self.divergences = 0
+        super().__init__(scheduler=sched.scheduler(timefunc=lambda: self.clock, delayfunc=lambda delay: None),
+                         **remaining_kwargs)
+
+    @property
+    def own_ip(self) -> Address:
+        return self._own_ip
+
+    def send_msg(self, msg: Message, destination: Address = None):
+        self.metrics.counter("lrp_messages_sent_total").inc(msg.message_type)
+        msg.dump()
+
+    def advance_clock(self, timestamp: float):
+        """Trigger all timed events up to `timestamp`, in order, then set the
+        clock to `timestamp`."""
+        while True:
+            delay = self.scheduler.run(blocking=False)
+            if delay is None or self.clock + delay > timestamp:
+                break
+            self.clock += delay
+        self.clock = max(self.clock, timestamp)
+
+
+def replay(path: str, realtime: bool = False) -> ReplayLrpProcess:
+    """Replay a recording on a ReplayLrpProcess, as fast as possible or in real
+    time. Return the process, once the replay is done."""
+    header, records = read_records(path)
+    random.seed(header['seed'])
+    lrp_process = ReplayLrpProcess(header['own_ip'], metric=header['metric'], is_sink=header['is_sink'])
+    start = time.monotonic()
+    with lrp_process:
+        for timestamp, kind, payload in records:
+            if realtime:
+                time.sleep(max(0, start + timestamp - time.monotonic()))
+            if kind == RECORD_TIMER and not lrp_process.timer_due(timestamp):
+                lrp_process.divergences += 1
+                lrp_process.logger.warning("Replay diverges at %.3fs: a timed event fired in the recording, none is "
+                                           "due in the replay", timestamp)
+            lrp_process.advance_clock(timestamp)
+            if kind == RECORD_MESSAGE:
+                sender, is_broadcast, data = payload
+                lrp_process.handle_msg(Message.parse(data), sender, is_broadcast)
+            elif kind == RECORD_NON_ROUTABLE:
+                source, destination, sender = payload
+                lrp_process.handle_non_routable_packet(source, destination, sender)
+            elif kind == RECORD_UNKNOWN_HOST:
+                lrp_process.handle_unknown_host(payload[0])
+    return lrp_process
+
+
+@click.command("replay")
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option("--realtime/--fast", default=False, show_default=True,
+              help="Replay in real time, or as fast as possible.")
+def replay_command(recording, realtime=False):
+    """Replay the inputs recorded by `daemon --record`."""
+    start = time.perf_counter()
+    lrp_process = replay(recording, realtime)
+    duration = time.perf_counter() - start
+
+    received = lrp_process.metrics.counter("lrp_messages_received_total")
+    sent = lrp_process.metrics.counter("lrp_messages_sent_total")
+    msg_types = sorted(set(labels[0] for labels, _ in received.items() + sent.items()))
+    print("Replayed %.3fs of recording in %.3fs" % (lrp_process.clock, duration))
+    for msg_type in msg_types:
+        print("  %-5s received: %6d  sent: %6d" % (msg_type, received.get(msg_type), sent.get(msg_type)))
+    print("Final routing table: %d destinations, %d neighbors" % (
+        len(lrp_process.routing_table.routes), len(lrp_process.routing_table.neighbors)))
+    if lrp_process.divergences > 0:
+        print("Diverged from the recording %d times" % lrp_process.divergences)
@@ -0,0 +1,281 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import collections
+import heapq
+import itertools
+import logging
+import math
+import random
+import sched
+import time
+from typing import Dict, Hashable, Optional
+
+import click
+import networkx
+
+import lrp
+from lrp.daemon import LrpProcess
+from lrp.message import Message
+from lrp.tools import Address, Subnet, NULL_ADDRESS, DEFAULT_ROUTE
+
+logger = logging.getLogger("Simulation")
+
+
+class SimulatedLrpProcess(LrpProcess):
+    """A LRP process attached to a `Simulation`. Messages are serialized, then
+    sent over the virtual links of the simulated topology, and time is the
+    simulated time."""
+
+    def __init__(self, simulation: "Simulation", name: Hashable, own_ip: Address, **remaining_kwargs):
+        """Constructor.
+
+        simulation: the simulation this node belongs to
+        name: the node of the topology this process runs on
+        own_ip: the address of the node"""
+        self.simulation = simulation
+        self.name = name
+        self._own_ip = own_ip
+        super().__init__(scheduler=sched.scheduler(timefunc=simulation.now, delayfunc=lambda delay: None),
+                         **remaining_kwargs)
+
+    @property
+    def own_ip(self) -> Address:
+        return self._own_ip
+
+    def send_msg(self, msg: Message, destination: Address = None):
+        self.metrics.counter("lrp_messages_sent_total").inc(msg.message_type)
+        self.simulation.transmit(self, msg.dump(), destination)
+
+
+class Simulation:
+    """Discrete-event simulation of a network of LRP nodes, in a single
+    process. Simulated time only advances from one event to the next: a
+    message delivery, or a timed event of a node.
+
+    The topology is a networkx graph: nodes are LRP nodes, edges are links.
+    Node attributes: `is_sink` (default: False), `metric` (default: 0 for sinks,
+    infinite otherwise) and `address` (default: 10.x.y.z, from the position of
+    the node). Edge attributes: `loss`, the probability a message is lost
+    (default: 0), and `latency`, in s (default:
+    lrp.conf['simulation']['latency']). An undirected graph has symmetric
+    links."""
+
+    def __init__(self, topology: networkx.Graph, seed: int = None):
+        """Constructor.
+
+        topology: the simulated network. See above.
+        seed: seed of the random losses. Default: random."""
+        self.topology = topology if topology.is_directed() else topology.to_directed()
+        self.clock = 0.
+        self.random = random.Random(seed)
+        # Heap of (time, sequence number, callback, args)
+        self._events = []
+        self._sequence = itertools.count()
+        # Next time the scheduler of each node should run, if any
+        self._wakeups: Dict[SimulatedLrpProcess, float] = {}
+        self.messages_sent = 0
+        self.messages_lost = 0
+        self.deliveries = 0
+
+        self.nodes: Dict[Hashable, SimulatedLrpProcess] = {}
+        self._nodes_by_address: Dict[Address, SimulatedLrpProcess] = {}
+        for i, (name, attrs) in enumerate(self.topology.nodes(data=True), start=1):
+            if 'address' in attrs:
+                address = Address(attrs['address'])
+            else:
+                address = Address(b"\x0a" + i.to_bytes(3, lrp.conf['endianess']))
+            is_sink = attrs.get('is_sink', False)
+            node = SimulatedLrpProcess(self, name, address, is_sink=is_sink,
+                                       metric=attrs.get('metric', 0 if is_sink else 2 ** 16 - 1))
+            self.nodes[name] = node
+            self._nodes_by_address[address] = node
+
+    def __enter__(self):
+        for node in self.nodes.values():
+            node.__enter__()
+            self._wake(node)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for node in self.nodes.values():
+            node.__exit__(exc_type, exc_val, exc_tb)
+
+    def now(self) -> float:
+        return self.clock
+
+    def _push(self, timestamp: float, callback, *args):
+        heapq.heappush(self._events, (timestamp, next(self._sequence), callback, args))
+
+    def _wake(self, node: SimulatedLrpProcess):
+        """Run the timed events of a node which are due, and make sure its
+        scheduler runs again at its next timed event."""
+        delay = node.scheduler.run(blocking=False)
+        if delay is None:
+            return
+        wakeup = self.clock + delay
+        if wakeup < self._wakeups.get(node, math.inf):
+            self._wakeups[node] = wakeup
+            self._push(wakeup, self._timer, node)
+
+    def _timer(self, node: SimulatedLrpProcess):
+        if self._wakeups.get(node) != self.clock:
+            # Superseded by an earlier wake-up
+            return
+        del self._wakeups[node]
+        self._wake(node)
+
+    def transmit(self, sender: SimulatedLrpProcess, data: bytes, destination: Address = None):
+        """Send a serialized message from a node to a neighbor, or to all its
+        neighbors if destination is None. The message is parsed once: handlers
+        do not modify received messages."""
+        self.messages_sent += 1
+        if destination is None:
+            receivers = [self.nodes[name] for name in self.topology.successors(sender.name)]
+        else:
+            receiver = self._nodes_by_address.get(destination)
+            if receiver is None or not self.topology.has_edge(sender.name, receiver.name):
+                # Not a neighbor: nobody receives the datagram
+                self.messages_lost += 1
+                return
+            receivers = [receiver]
+        msg = Message.parse(data)
+        for receiver in receivers:
+            link = self.topology.edges[sender.name, receiver.name]
+            if self.random.random() < link.get('loss', 0):
+                self.messages_lost += 1
+                continue
+            self._push(self.clock + link.get('latency', lrp.conf['simulation']['latency']), self._deliver,
+                       receiver, msg, sender.own_ip, destination is None)
+
+    def _deliver(self, node: SimulatedLrpProcess, msg: Message, sender: Address, is_broadcast: bool):
+        self.deliveries += 1
+        node.handle_msg(msg, sender, is_broadcast)
+        self._wake(node)
+
+    def run(self, until: float):
+        """Handle all the events up to simulated time `until`, in order, then
+        set the clock to `until`."""
+        while self._events and self._events[0][0] <= until:
+            timestamp, _, callback, args = heapq.heappop(self._events)
+            self.clock = timestamp
+            callback(*args)
+        self.clock = max(self.clock, until)
+
+    def converged(self) -> bool:
+        """Check whether all the nodes are attached to a sink, through a
+        successor, and whether their sink has a route towards them."""
+        for node in self.nodes.values():
+            if node.is_sink:
+                continue
+            if node.sink == NULL_ADDRESS or not node.routing_table.is_successor(
+                    node.routing_table.get_a_nexthop(DEFAULT_ROUTE)):
+                return False
+            sink = self._nodes_by_address.get(node.sink)
+            if sink is None or Subnet(node.own_ip) not in sink.routing_table.routes:
+                return False
+        return True
+
+    def run_until_converged(self, timeout: float, check_interval: float = 1) -> Optional[float]:
+        """Run the simulation until it has converged (see `converged`), checking
+        every `check_interval` simulated seconds. Return the simulated time of
+        convergence, or None if it has not converged after `timeout` s."""
+        while self.clock < timeout:
+            self.run(min(self.clock + check_interval, timeout))
+            if self.converged():
+                return self.clock
+        return None
+
+
+def random_topology(nb_nodes: int, degree: float, nb_sinks: int = 1, loss: float = 0, seed: int = None) \
+        -> networkx.Graph:
+    """Return a random geometric graph, as a wireless network would be: nodes
+    are spread in a unit square, and linked to those close enough to have
+    `degree` neighbors in average. Only its largest connected component is
+    kept. Its first nodes are the sinks."""
+    radius = math.sqrt(degree / (math.pi * nb_nodes))
+    topology = networkx.random_geometric_graph(nb_nodes, radius, seed=seed)
+    topology = topology.subgraph(max(networkx.connected_components(topology), key=len)).copy()
+    for name in sorted(topology.nodes())[:nb_sinks]:
+        topology.nodes[name]['is_sink'] = True
+    networkx.set_edge_attributes(topology, loss, 'loss')
+    return topology
+
+
+@click.command("simulate")
+@click.option("--topology", "topology_path", default=None, type=click.Path(exists=True, dir_okay=False),
+              metavar="<file>",
+              help="GraphML file of the topology (see `Simulation` for the attributes). Default: a random "
+                   "geometric graph.")
+@click.option("--nodes", "nb_nodes", default=1000, show_default=True, metavar="<count>",
+              help="Number of nodes of the random topology.")
+@click.option("--degree", default=8., show_default=True, metavar="<count>",
+              help="Average number of neighbors in the random topology.")
+@click.option("--sinks", "nb_sinks", default=1, show_default=True, metavar="<count>",
+              help="Number of sinks in the random topology.")
+@click.option("--loss", default=0., show_default=True, metavar="<probability>",
+              help="Loss probability of the links of the random topology.")
+@click.option("--timeout", default=600., show_default=True, metavar="<seconds>",
+              help="Maximum simulated time.")
+@click.option("--seed", default=None, type=int, metavar="<seed>",
+              help="Seed of the random generators. Default: random.")
+def simulate(topology_path=None, nb_nodes=1000, degree=8., nb_sinks=1, loss=0., timeout=600., seed=None):
+    """Simulate a network of LRP nodes, until it converges."""
+    random.seed(seed)
+    # Thousands of flight recorders would not fit in memory
+    lrp.conf['flight_recorder']['size'] = 0
+    if topology_path is not None:
+        topology = networkx.read_graphml(topology_path)
+    else:
+        topology = random_topology(nb_nodes, degree, nb_sinks, loss, seed)
+
+    start = time.perf_counter()
+    simulation = Simulation(topology, seed)
+    with simulation:
+        converged_at = simulation.run_until_converged(timeout)
+    duration = time.perf_counter() - start
+
+    print("Simulated %d nodes, %d links, for %.1fs in %.3fs" % (
+        len(simulation.nodes), simulation.topology.number_of_edges() // 2, simulation.clock, duration))
+    if converged_at is None:
+        print("Not converged after %.1fs" % timeout)
+    else:
+        print("Converged after %.1fs" % converged_at)
+    print("Messages: %d sent, %d delivered, %d lost" % (
+        simulation.messages_sent, simulation.deliveries, simulation.messages_lost))
+    sent = collections.Counter()
+    for node in simulation.nodes.values():
+        for labels, value in node.metrics.counter("lrp_messages_sent_total").items():
+            sent[labels[0]] += value
+    for msg_type, count in sorted(sent.items()):
+        print("  %-5s sent: %8d" % (msg_type, count))
@@ -0,0 +1,140 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+import os
+import struct
+import time
+
+from lrp.daemon import LrpProcess
+from lrp.tools import Address, Subnet, DEFAULT_ROUTE, NULL_ADDRESS
+
+# File format: a header, then the neighbors, the routes and the tracked RREQ
+# seqnos. All integers are big-endian.
+_MAGIC = b"LRPS"
+_VERSION = 1
+# magic, version, saving time, own_ip, is_sink, metric, sink, own RREQ seqno,
+# number of neighbors, of routes, of tracked RREQ sources
+_HEADER = struct.Struct("!4sBd4sBH4sHIII")
+_NEIGHBOR = struct.Struct("!4s")
+# destination, prefix, next hop, metric
+_ROUTE = struct.Struct("!4sB4sH")
+# source, seqno
+_RREQ = struct.Struct("!4sH")
+
+logger = logging.getLogger("Snapshot")
+
+
+def save_snapshot(path: str, lrp_process: LrpProcess):
+    """Write the state of a LRP process in a compact binary file: its routing
+    table, metric, sink, and RREQ seqnos. The file is replaced atomically."""
+    routes = [(destination, next_hop, metric)
+              for destination, next_hops in lrp_process.routing_table.routes.items()
+              for next_hop, metric in next_hops.items()]
+    chunks = [_HEADER.pack(_MAGIC, _VERSION, time.time(), lrp_process.own_ip.as_bytes, lrp_process.is_sink,
+                           lrp_process.own_metric, lrp_process.sink.as_bytes, lrp_process._own_current_seqno,
+                           len(lrp_process.routing_table.neighbors), len(routes), len(lrp_process._tracked_rreq))]
+    chunks.extend(_NEIGHBOR.pack(neighbor.as_bytes) for neighbor in lrp_process.routing_table.neighbors)
+    chunks.extend(_ROUTE.pack(destination.as_bytes, destination.prefix, next_hop.as_bytes, metric)
+                  for destination, next_hop, metric in routes)
+    chunks.extend(_RREQ.pack(source.as_bytes, seqno) for source, seqno in lrp_process._tracked_rreq.items())
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(temporary_path, path)
+    logger.info("State saved in %s: %d neighbors, %d routes", path,
+                len(lrp_process.routing_table.neighbors), len(routes))
+
+
+def load_snapshot(path: str) -> dict:
+    """Read a file written by `save_snapshot`. Return its content as a dict."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, saved_at, own_ip, is_sink, metric, sink, own_seqno, nb_neighbors, nb_routes, nb_rreq = \
+        _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception("%s: not a LRP snapshot (or unsupported version)" % path)
+    offset = _HEADER.size
+    neighbors = []
+    for _ in range(nb_neighbors):
+        neighbors.append(Address(_NEIGHBOR.unpack_from(data, offset)[0]))
+        offset += _NEIGHBOR.size
+    routes = []
+    for _ in range(nb_routes):
+        destination, prefix, next_hop, route_metric = _ROUTE.unpack_from(data, offset)
+        destination = DEFAULT_ROUTE if prefix == 0 else Subnet(destination, prefix=prefix)
+        routes.append((destination, Address(next_hop), route_metric))
+        offset += _ROUTE.size
+    tracked_rreq = {}
+    for _ in range(nb_rreq):
+        source, seqno = _RREQ.unpack_from(data, offset)
+        tracked_rreq[Address(source)] = seqno
+        offset += _RREQ.size
+    return dict(saved_at=saved_at, own_ip=Address(own_ip), is_sink=bool(is_sink), metric=metric,
+                sink=Address(sink), own_seqno=own_seqno, neighbors=neighbors, routes=routes,
+                tracked_rreq=tracked_rreq)
+
+
+def restore_snapshot(path: str, lrp_process: LrpProcess, max_age: float) -> bool:
+    """Restore the state saved in `path` in a LRP process, before it is
+    started. Routes are added through its routing table. The snapshot is
+    ignored if it is older than `max_age` s, or if it belongs to another node.
+    Return True if the state was restored."""
+    try:
+        snapshot = load_snapshot(path)
+    except FileNotFoundError:
+        logger.info("No state to restore from %s", path)
+        return False
+    age = time.time() - snapshot['saved_at']
+    if age > max_age:
+        logger.warning("Ignore %s: state is too old (%ds)", path, age)
+        return False
+    if snapshot['own_ip'] != lrp_process.own_ip or snapshot['is_sink'] != lrp_process.is_sink:
+        logger.warning("Ignore %s: state of another node (%s)", path, snapshot['own_ip'])
+        return False
+
+    lrp_process.own_metric = snapshot['metric']
+    if not lrp_process.is_sink:
+        lrp_process.sink = snapshot['sink']
+    if lrp_process.sink != NULL_ADDRESS:
+        lrp_process._sink_metrics[lrp_process.sink] = lrp_process.own_metric
+    lrp_process._own_current_seqno = snapshot['own_seqno']
+    lrp_process._tracked_rreq.update(snapshot['tracked_rreq'])
+    for neighbor in snapshot['neighbors']:
+        lrp_process.routing_table.ensure_is_neighbor(neighbor)
+    for destination, next_hop, metric in snapshot['routes']:
+        lrp_process.routing_table.add_route(destination, next_hop, metric)
+    logger.info("State restored from %s (%ds old): %d neighbors, %d routes", path, age,
+                len(snapshot['neighbors']), len(snapshot['routes']))
+    return True
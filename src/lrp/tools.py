@@ -35,6 +35,7 @@ import socket
 from typing import Dict, Tuple, List, Optional, Set
 
 import lrp
+from lrp.flight_recorder import FlightRecorder, EVENT_ROUTE_ADD, EVENT_ROUTE_DEL
 
 
 class Address:
@@ -84,7 +85,7 @@ class Subnet(Address):
                 mask = parts[1].split(".")
                 if len(mask) == 1:
                     # Parse .../32 format
-                    self.prefix = int(mask[0])
+                    prefix = int(mask[0])
                 else:
                     # Parse .../255.255.255.255 format
                     prefix = format(int.from_bytes(bytes(int(a) for a in mask), 'big'), 'b').find("0")
@@ -130,9 +131,12 @@ DEFAULT_ROUTE = Subnet(b"\x00\x00\x00\x00", prefix=0)
 class RoutingTable:
     logger = logging.getLogger("RoutingTable")
 
-    def __init__(self):
+    def __init__(self, flight_recorder: FlightRecorder = None):
         self.routes: Dict[Subnet, Dict[Address, int]] = {}
+        # Destinations of self.routes which are not host routes
+        self._subnet_routes: Set[Subnet] = set()
         self.neighbors: Set[Address] = set()
+        self.flight_recorder = flight_recorder
 
     def add_route(self, destination: Subnet, next_hop: Address, metric: int):
         """Add a route to `destination`, through `next_hop`, with cost `metric`. If a
@@ -147,23 +151,28 @@ class RoutingTable:
         except KeyError:
             # Destination was unknown
             next_hops = self.routes[destination] = {next_hop: metric}
-            self.logger.info("Update routing table: new route towards %r through %r[%d]",
-                             str(destination), str(next_hop), metric)
+            if isinstance(destination, Subnet) and destination.prefix < 32:
+                self._subnet_routes.add(destination)
+            self.logger.info("Update routing table: new route towards '%s' through '%s'[%d]",
+                             destination, next_hop, metric)
         else:
             try:
                 known_metric = next_hops[next_hop]
             except KeyError:
-                self.logger.info("Update routing table: update route towards %r, also through %r[%d]",
-                                 str(destination), str(next_hop), metric)
+                self.logger.info("Update routing table: update route towards '%s', also through '%s'[%d]",
+                                 destination, next_hop, metric)
                 next_hops[next_hop] = metric
             else:
                 if known_metric <= metric:
                     self.logger.info("Refusing new route: bad metric")
                     return False
                 else:
-                    self.logger.info("Update routing table: refresh route towards %r through %r[%d]",
-                                     str(destination), str(next_hop), metric)
+                    self.logger.info("Update routing table: refresh route towards '%s' through '%s'[%d]",
+                                     destination, next_hop, metric)
                     next_hops[next_hop] = metric
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(EVENT_ROUTE_ADD, destination.prefix, destination.as_bytes, next_hop.as_bytes,
+                                        metric)
         return True
 
     def del_route(self, destination: Subnet, next_hop: Address):
@@ -182,9 +191,13 @@ class RoutingTable:
                 # Was not a next hop, ok.
                 pass
             else:
+                if self.flight_recorder is not None:
+                    self.flight_recorder.record(EVENT_ROUTE_DEL, destination.prefix, destination.as_bytes,
+                                                next_hop.as_bytes)
                 if len(next_hops) == 0:
                     # No more next hops for this route
                     del self.routes[destination]
+                    self._subnet_routes.discard(destination)
 
     def filter_out_nexthops(self, destination: Subnet, max_metric: int = None) -> List[Tuple[Address, int]]:
         """Filter out some next hops, according to some constraints. Returns the list
@@ -203,9 +216,13 @@ class RoutingTable:
                                       nh, destination, max_metric)
                     dropped.append((nh, metric))
                     del next_hops[nh]
+                    if self.flight_recorder is not None:
+                        self.flight_recorder.record(EVENT_ROUTE_DEL, destination.prefix, destination.as_bytes,
+                                                    nh.as_bytes)
             if len(next_hops) == 0:
                 # No more next hops for this route
                 del self.routes[destination]
+                self._subnet_routes.discard(destination)
             return dropped
 
     def is_successor(self, neighbor: Address) -> bool:
@@ -225,13 +242,20 @@ class RoutingTable:
     def get_a_nexthop(self, destination: Address) -> Optional[Address]:
         """Return the best next hop for this destination, according to the metric. If
         many are equal, return any of them."""
-        for route_dest, next_hops in sorted(self.routes.items(), key=lambda tple: tple[0].prefix, reverse=True):
-            if destination in route_dest:
-                best_nh, metric = max(next_hops.items(), key=lambda tple: tple[1])
-                return best_nh
-        else:
-            # No route matches this destination
-            return None
+        try:
+            # An exact match is the longest one
+            next_hops = self.routes[destination]
+        except KeyError:
+            # Other host routes cannot match
+            for route_dest in sorted(self._subnet_routes, key=lambda subnet: subnet.prefix, reverse=True):
+                if destination in route_dest:
+                    next_hops = self.routes[route_dest]
+                    break
+            else:
+                # No route matches this destination
+                return None
+        best_nh, metric = max(next_hops.items(), key=lambda tple: tple[1])
+        return best_nh
 
     def ensure_is_neighbor(self, neighbor: Address):
         """Check if neighbor is declared. If it is not, add it as neighbor."""
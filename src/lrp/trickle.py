@@ -0,0 +1,144 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import logging
+import random
+import sched
+
+
+class TrickleTimer:
+    """Trickle algorithm, as described in RFC 6206.
+
+    The timer calls `action` at most once per interval. The interval grows
+    from `imin` to `imin * 2 ** imax_doublings` while the network is
+    consistent, and the transmission is suppressed if at least `k`
+    consistent transmissions have been heard during the interval. Any
+    inconsistency resets the interval to `imin`.
+
+    The timer is driven by a `sched.scheduler`, the same the LRP process uses
+    for its other timed events."""
+    logger = logging.getLogger("Trickle")
+
+    def __init__(self, scheduler: sched.scheduler, action, imin: float, imax_doublings: int, k: int):
+        """Constructor.
+
+        scheduler: the scheduler on which timed events are registered
+        action: called (without argument) when the timer fires and the
+          transmission is not suppressed
+        imin: the minimum interval size, in s
+        imax_doublings: the number of times imin can be doubled
+        k: the redundancy constant. 0 means no suppression at all."""
+        self.scheduler = scheduler
+        self.action = action
+        self.imin = imin
+        self.imax_doublings = imax_doublings
+        self.imax = imin * 2 ** imax_doublings
+        self.k = k
+
+        self.interval = None
+        self.counter = 0
+        self._fire_event = None
+        self._end_event = None
+
+        # Statistics about this timer
+        self.counters = {'transmitted': 0, 'suppressed': 0, 'resets': 0, 'consistent': 0}
+
+    @property
+    def is_running(self) -> bool:
+        return self.interval is not None
+
+    def start(self):
+        """Start the timer with the minimum interval. Do nothing if the timer is
+        already running."""
+        if not self.is_running:
+            self.interval = self.imin
+            self._begin_interval()
+
+    def stop(self):
+        """Stop the timer. Scheduled events are cancelled."""
+        self._cancel_events()
+        self.interval = None
+
+    def reset(self):
+        """Signal an inconsistency: restart with the minimum interval. As stated in
+        the RFC, nothing is done if the interval is already the minimum one."""
+        if self.interval == self.imin:
+            return
+        self.counters['resets'] += 1
+        self.logger.debug("Reset trickle timer")
+        self._cancel_events()
+        self.interval = self.imin
+        self._begin_interval()
+
+    def limit(self, imax_doublings: int = None):
+        """Lower the maximum interval to `imin * 2 ** imax_doublings`, or restore
+        the one given to the constructor if None. It applies from the end of
+        the current interval."""
+        if imax_doublings is None:
+            imax_doublings = self.imax_doublings
+        self.imax = self.imin * 2 ** imax_doublings
+
+    def hear_consistent(self):
+        """Signal a consistent transmission from a neighbor."""
+        self.counter += 1
+        self.counters['consistent'] += 1
+
+    def _begin_interval(self):
+        self.counter = 0
+        fire_delay = random.uniform(self.interval / 2, self.interval)
+        self._fire_event = self.scheduler.enter(fire_delay, 0, action=self._fire)
+        self._end_event = self.scheduler.enter(self.interval, 0, action=self._end_interval)
+
+    def _fire(self):
+        self._fire_event = None
+        if self.k == 0 or self.counter < self.k:
+            self.counters['transmitted'] += 1
+            self.action()
+        else:
+            self.logger.debug("Suppress transmission: %d consistent ones heard", self.counter)
+            self.counters['suppressed'] += 1
+
+    def _end_interval(self):
+        self._end_event = None
+        self.interval = min(2 * self.interval, self.imax)
+        self._begin_interval()
+
+    def _cancel_events(self):
+        for event in (self._fire_event, self._end_event):
+            if event is not None:
+                try:
+                    self.scheduler.cancel(event)
+                except ValueError:
+                    # Event already consumed
+                    pass
+        self._fire_event = self._end_event = None
@@ -0,0 +1,99 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import json
+import socket
+
+from lrp.control import ControlState, ControlServer, send_message, recv_message
+
+
+def test_apply_routes():
+    state = ControlState()
+    changes = state.apply({}, {"10.1.0.0/16": {"10.0.0.2": 3, "10.0.0.3": 4}}, {})
+    assert sorted(changes, key=lambda change: change['next_hop']) == [
+        {'type': "route-add", 'destination': "10.1.0.0/16", 'next_hop': "10.0.0.2", 'metric': 3},
+        {'type': "route-add", 'destination': "10.1.0.0/16", 'next_hop': "10.0.0.3", 'metric': 4}]
+    assert state.version == 1
+    # A new metric, a removed next hop
+    changes = state.apply({}, {"10.1.0.0/16": {"10.0.0.2": 2}}, {})
+    assert sorted(changes, key=lambda change: change['type']) == [
+        {'type': "route-add", 'destination': "10.1.0.0/16", 'next_hop': "10.0.0.2", 'metric': 2},
+        {'type': "route-del", 'destination': "10.1.0.0/16", 'next_hop': "10.0.0.3"}]
+    # No more route
+    changes = state.apply({}, {"10.1.0.0/16": None}, {})
+    assert changes == [{'type': "route-del", 'destination': "10.1.0.0/16", 'next_hop': "10.0.0.2"}]
+    assert state.routes == {}
+    assert state.version == 3
+
+
+def test_apply_node_and_neighbors():
+    state = ControlState()
+    changes = state.apply({'metric': 1}, {}, {"10.0.0.2": "eth0", "10.0.0.3": None})
+    assert changes == [{'type': "node", 'node': {'metric': 1}},
+                       {'type': "neighbor-add", 'address': "10.0.0.2", 'interface': "eth0"}]
+    changes = state.apply({'metric': 1}, {}, {"10.0.0.2": None})
+    assert changes == [{'type': "neighbor-del", 'address': "10.0.0.2"}]
+    assert state.neighbors == {}
+
+
+def test_apply_without_change():
+    state = ControlState()
+    state.apply({'metric': 1}, {"10.1.0.0/16": {"10.0.0.2": 3}}, {"10.0.0.2": "eth0"})
+    answer = state.answer("all")
+    assert state.apply({'metric': 1}, {"10.1.0.0/16": {"10.0.0.2": 3}}, {"10.0.0.2": "eth0"}) == []
+    assert state.version == 1
+    assert state.answer("all") is answer
+
+
+def test_answer():
+    state = ControlState()
+    state.apply({'metric': 1}, {"10.1.0.0/16": {"10.0.0.2": 3}}, {"10.0.0.2": "eth0"})
+    answer = json.loads(state.answer("routes")[4:].decode())
+    assert answer == {'version': 1, 'routes': {"10.1.0.0/16": {"10.0.0.2": 3}}}
+    state.apply({'metric': 2}, {}, {})
+    answer = json.loads(state.answer("all")[4:].decode())
+    assert answer == {'version': 2, 'node': {'metric': 2}, 'routes': {"10.1.0.0/16": {"10.0.0.2": 3}},
+                      'neighbors': {"10.0.0.2": "eth0"}}
+
+
+def test_subscribe(tmp_path):
+    address = str(tmp_path / "control")
+    with ControlServer(address) as control_server:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(address)
+            send_message(sock, {'query': "subscribe"})
+            assert recv_message(sock) == {'version': 0, 'node': {}, 'routes': {}, 'neighbors': {}}
+            control_server.publish({'metric': 1}, {}, {"10.0.0.2": "eth0"})
+            assert recv_message(sock) == {'version': 1, 'changes': [
+                {'type': "node", 'node': {'metric': 1}},
+                {'type': "neighbor-add", 'address': "10.0.0.2", 'interface': "eth0"}]}
@@ -0,0 +1,52 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import lrp
+from lrp.message import Message, DIO, MessageType
+from lrp.tools import Address
+
+
+def test_dio_sink_load_round_trip():
+    data = DIO(12, Address("10.0.0.1"), sink_load=300).dump()
+    assert len(data) == 9
+    msg = Message.parse(data)
+    assert isinstance(msg, DIO)
+    assert msg.message_type == MessageType.DIO
+    assert (msg.metric_value, msg.sink, msg.sink_load) == (12, Address("10.0.0.1"), 300)
+
+
+def test_dio_without_sink_load():
+    # As sent by older nodes
+    data = bytes([MessageType.DIO]) + (12).to_bytes(2, lrp.conf['endianess']) + Address("10.0.0.1").as_bytes
+    msg = Message.parse(data)
+    assert (msg.metric_value, msg.sink, msg.sink_load) == (12, Address("10.0.0.1"), 0)
@@ -0,0 +1,70 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+from lrp.metrics import Registry
+
+
+def test_same_instance():
+    registry = Registry()
+    assert registry.counter("lrp_test_total") is registry.counter("lrp_test_total")
+
+
+def test_render_counter():
+    registry = Registry()
+    counter = registry.counter("lrp_messages_total", "Messages", label_names=("type",))
+    counter.inc("DIO")
+    counter.inc("DIO", amount=2)
+    counter.inc("RREQ")
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP lrp_messages_total Messages", "# TYPE lrp_messages_total counter"]
+    assert set(lines[2:]) == {'lrp_messages_total{type="DIO"} 3', 'lrp_messages_total{type="RREQ"} 1'}
+
+
+def test_render_gauge():
+    registry = Registry()
+    registry.gauge("lrp_routes", "Routes", callback=lambda: 42)
+    assert registry.render() == "# HELP lrp_routes Routes\n# TYPE lrp_routes gauge\nlrp_routes 42\n"
+
+
+def test_render_histogram():
+    registry = Registry()
+    histogram = registry.histogram("lrp_duration_seconds", "Duration", label_names=("kind",), buckets=(1, 0.1))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "a")
+    lines = registry.render().splitlines()
+    assert lines[2:] == ['lrp_duration_seconds_bucket{kind="a",le="0.1"} 1',
+                         'lrp_duration_seconds_bucket{kind="a",le="1"} 2',
+                         'lrp_duration_seconds_bucket{kind="a",le="+Inf"} 3',
+                         'lrp_duration_seconds_sum{kind="a"} 5.55',
+                         'lrp_duration_seconds_count{kind="a"} 3']
@@ -0,0 +1,89 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import pytest
+
+from lrp.message import DIO
+from lrp.replay import Recorder, ReplayLrpProcess, read_records, replay, \
+    RECORD_MESSAGE, RECORD_NON_ROUTABLE, RECORD_UNKNOWN_HOST, RECORD_TIMER
+from lrp.tools import Address, DEFAULT_ROUTE
+
+SINK = Address("10.0.0.100")
+NEIGHBOR = Address("10.0.0.2")
+
+
+def _record(path: str):
+    lrp_process = ReplayLrpProcess(Address("10.0.0.1"))
+    with Recorder(path, lrp_process) as recorder:
+        recorder.record_message(DIO(1, SINK, sink_load=4), NEIGHBOR, True)
+        recorder.record_non_routable(Address("10.0.0.3"), Address("10.0.0.4"), NEIGHBOR)
+        recorder.record_unknown_host(Address("10.0.0.5"))
+        recorder.record_timer()
+
+
+def test_read_records(tmp_path):
+    path = str(tmp_path / "recording")
+    _record(path)
+    header, records = read_records(path)
+    assert header['own_ip'] == Address("10.0.0.1")
+    assert not header['is_sink']
+    assert header['metric'] == 2 ** 16 - 1
+    records = list(records)
+    assert [kind for _, kind, _ in records] == [RECORD_MESSAGE, RECORD_NON_ROUTABLE, RECORD_UNKNOWN_HOST,
+                                                 RECORD_TIMER]
+    timestamps = [timestamp for timestamp, _, _ in records]
+    assert timestamps == sorted(timestamps)
+    sender, is_broadcast, data = records[0][2]
+    assert (sender, is_broadcast) == (NEIGHBOR, True)
+    msg = DIO.parse(data)
+    assert (msg.metric_value, msg.sink, msg.sink_load) == (1, SINK, 4)
+    assert records[1][2] == (Address("10.0.0.3"), Address("10.0.0.4"), NEIGHBOR)
+    assert records[2][2] == (Address("10.0.0.5"),)
+    assert records[3][2] == ()
+
+
+def test_read_records_bad_file(tmp_path):
+    path = tmp_path / "recording"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(Exception):
+        read_records(str(path))
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / "recording")
+    with Recorder(path, ReplayLrpProcess(Address("10.0.0.1"))) as recorder:
+        recorder.record_message(DIO(1, SINK), NEIGHBOR, True)
+    lrp_process = replay(path)
+    # Attached to the sink announced by the recorded DIO
+    assert lrp_process.sink == SINK
+    assert lrp_process.routing_table.get_a_nexthop(DEFAULT_ROUTE) == NEIGHBOR
@@ -0,0 +1,83 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import networkx
+
+from lrp.simulation import Simulation, random_topology
+from lrp.tools import Address, Subnet, DEFAULT_ROUTE
+
+
+def test_line_converges():
+    # 1 (sink) - 2 - 3 - 4
+    topology = networkx.path_graph([1, 2, 3, 4])
+    topology.nodes[1]['is_sink'] = True
+    with Simulation(topology, seed=1) as simulation:
+        assert simulation.run_until_converged(timeout=60) is not None
+        addresses = {name: node.own_ip for name, node in simulation.nodes.items()}
+        sink = simulation.nodes[1]
+        for name in (2, 3, 4):
+            node = simulation.nodes[name]
+            assert node.sink == addresses[1]
+            assert node.routing_table.get_a_nexthop(DEFAULT_ROUTE) == addresses[name - 1]
+            assert Subnet(addresses[name]) in sink.routing_table.routes
+        assert simulation.nodes[4].own_metric > simulation.nodes[2].own_metric
+        assert simulation.messages_sent > 0
+
+
+def test_addresses():
+    topology = networkx.Graph()
+    topology.add_node("a", is_sink=True, address="10.9.0.1")
+    topology.add_node("b")
+    topology.add_edge("a", "b")
+    simulation = Simulation(topology)
+    assert simulation.nodes["a"].own_ip == Address("10.9.0.1")
+    assert simulation.nodes["a"].is_sink
+    assert simulation.nodes["b"].own_ip == Address("10.0.0.2")
+    assert not simulation.nodes["b"].is_sink
+
+
+def test_lossy_links_lose_messages():
+    topology = networkx.path_graph([1, 2])
+    topology.nodes[1]['is_sink'] = True
+    networkx.set_edge_attributes(topology, 1., 'loss')
+    with Simulation(topology, seed=1) as simulation:
+        simulation.run(10)
+        assert simulation.deliveries == 0
+        assert simulation.messages_lost > 0
+        assert not simulation.converged()
+
+
+def test_random_topology():
+    topology = random_topology(50, degree=6, nb_sinks=2, seed=1)
+    assert networkx.is_connected(topology)
+    assert sum(1 for _, is_sink in topology.nodes(data='is_sink') if is_sink) == 2
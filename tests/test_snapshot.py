@@ -0,0 +1,92 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import time
+
+from lrp.replay import ReplayLrpProcess
+from lrp.snapshot import save_snapshot, load_snapshot, restore_snapshot
+from lrp.tools import Address, Subnet, DEFAULT_ROUTE
+
+
+def _lrp_process() -> ReplayLrpProcess:
+    lrp_process = ReplayLrpProcess(Address("10.0.0.1"), metric=3)
+    lrp_process.sink = Address("10.0.0.100")
+    lrp_process._own_current_seqno = 7
+    lrp_process._tracked_rreq[Address("10.0.0.5")] = 2
+    lrp_process.routing_table.ensure_is_neighbor(Address("10.0.0.2"))
+    lrp_process.routing_table.add_route(DEFAULT_ROUTE, Address("10.0.0.2"), 2)
+    lrp_process.routing_table.add_route(Subnet("10.1.0.0/16"), Address("10.0.0.2"), 4)
+    lrp_process.routing_table.add_route(Subnet("10.0.0.9"), Address("10.0.0.3"), 1)
+    return lrp_process
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / "state")
+    save_snapshot(path, _lrp_process())
+    assert not os.path.exists(path + ".tmp")
+    snapshot = load_snapshot(path)
+    assert snapshot['own_ip'] == Address("10.0.0.1")
+    assert not snapshot['is_sink']
+    assert snapshot['metric'] == 3
+    assert snapshot['sink'] == Address("10.0.0.100")
+    assert snapshot['own_seqno'] == 7
+    assert snapshot['neighbors'] == [Address("10.0.0.2")]
+    assert len(snapshot['routes']) == 3
+    assert set(snapshot['routes']) == {(DEFAULT_ROUTE, Address("10.0.0.2"), 2),
+                                       (Subnet("10.1.0.0/16"), Address("10.0.0.2"), 4),
+                                       (Subnet("10.0.0.9"), Address("10.0.0.3"), 1)}
+    assert snapshot['tracked_rreq'] == {Address("10.0.0.5"): 2}
+    assert time.time() - snapshot['saved_at'] < 60
+
+
+def test_restore(tmp_path):
+    path = str(tmp_path / "state")
+    saved = _lrp_process()
+    save_snapshot(path, saved)
+    restored = ReplayLrpProcess(Address("10.0.0.1"))
+    assert restore_snapshot(path, restored, max_age=60)
+    assert restored.routing_table.routes == saved.routing_table.routes
+    assert restored.routing_table.neighbors == saved.routing_table.neighbors
+    assert (restored.own_metric, restored.sink) == (3, Address("10.0.0.100"))
+    assert restored.routing_table.get_a_nexthop(Address("10.1.2.3")) == Address("10.0.0.2")
+
+
+def test_restore_ignored(tmp_path):
+    path = str(tmp_path / "state")
+    assert not restore_snapshot(path, ReplayLrpProcess(Address("10.0.0.1")), max_age=60)
+    save_snapshot(path, _lrp_process())
+    # State of another node
+    assert not restore_snapshot(path, ReplayLrpProcess(Address("10.0.0.2")), max_age=60)
+    # Too old
+    assert not restore_snapshot(path, ReplayLrpProcess(Address("10.0.0.1")), max_age=-1)
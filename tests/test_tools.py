@@ -0,0 +1,86 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+from lrp.tools import Address, Subnet, RoutingTable, DEFAULT_ROUTE
+
+
+def test_subnet_prefix_length():
+    subnet = Subnet("10.1.0.0/16")
+    assert subnet.prefix == 16
+    assert Address("10.1.2.3") in subnet
+    assert Address("10.2.0.1") not in subnet
+
+
+def test_subnet_dotted_mask():
+    assert Subnet("10.1.0.0/255.255.0.0") == Subnet("10.1.0.0/16")
+    assert Subnet("10.1.0.0/255.255.255.255").prefix == 32
+
+
+def test_subnet_default_prefix():
+    assert Subnet("10.1.2.3").prefix == 32
+    assert Subnet("10.1.2.3") == Address("10.1.2.3")
+
+
+def _routing_table() -> RoutingTable:
+    routing_table = RoutingTable()
+    routing_table.add_route(DEFAULT_ROUTE, Address("10.0.0.1"), 3)
+    routing_table.add_route(Subnet("10.1.0.0/16"), Address("10.0.0.2"), 2)
+    routing_table.add_route(Subnet("10.1.2.0/24"), Address("10.0.0.3"), 2)
+    routing_table.add_route(Subnet("10.1.2.3"), Address("10.0.0.4"), 1)
+    return routing_table
+
+
+def test_get_a_nexthop_exact():
+    assert _routing_table().get_a_nexthop(Address("10.1.2.3")) == Address("10.0.0.4")
+
+
+def test_get_a_nexthop_longest_subnet():
+    routing_table = _routing_table()
+    assert routing_table.get_a_nexthop(Address("10.1.2.4")) == Address("10.0.0.3")
+    assert routing_table.get_a_nexthop(Address("10.1.3.1")) == Address("10.0.0.2")
+
+
+def test_get_a_nexthop_default_route():
+    routing_table = _routing_table()
+    assert routing_table.get_a_nexthop(Address("192.168.0.1")) == Address("10.0.0.1")
+    assert routing_table.get_a_nexthop(DEFAULT_ROUTE) == Address("10.0.0.1")
+
+
+def test_get_a_nexthop_deleted_routes():
+    routing_table = _routing_table()
+    routing_table.del_route(Subnet("10.1.2.0/24"), Address("10.0.0.3"))
+    assert routing_table.get_a_nexthop(Address("10.1.2.4")) == Address("10.0.0.2")
+    routing_table.del_route(Subnet("10.1.2.3"), Address("10.0.0.4"))
+    assert routing_table.get_a_nexthop(Address("10.1.2.3")) == Address("10.0.0.2")
+    routing_table.del_route(DEFAULT_ROUTE, Address("10.0.0.1"))
+    assert routing_table.get_a_nexthop(Address("192.168.0.1")) is None
@@ -0,0 +1,124 @@
+# Copyright Laboratoire d'Informatique de Grenoble (2017)
+#
+# This file is part of pylrp.
+#
+# Pylrp is a Python/Linux implementation of the LRP routing protocol.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import sched
+
+from lrp.trickle import TrickleTimer
+
+
+class _Clock:
+    """Virtual time of a scheduler: events are run without waiting."""
+
+    def __init__(self):
+        self.now = 0.
+        self.scheduler = sched.scheduler(timefunc=lambda: self.now, delayfunc=lambda delay: None)
+
+    def run(self, until: float):
+        while True:
+            delay = self.scheduler.run(blocking=False)
+            if delay is None or self.now + delay > until:
+                break
+            self.now += delay
+        self.now = until
+
+
+def _timer(clock: _Clock, k: int = 0):
+    fired = []
+    timer = TrickleTimer(clock.scheduler, action=lambda: fired.append(clock.now), imin=1, imax_doublings=3, k=k)
+    return timer, fired
+
+
+def test_interval_doubles_up_to_imax():
+    clock = _Clock()
+    timer, fired = _timer(clock)
+    timer.start()
+    # Intervals of 1, 2, 4, 8, then 8 s
+    clock.run(1 + 2 + 4 + 8 + 8)
+    assert timer.interval == 8
+    assert len(fired) == 5
+    assert 0.5 <= fired[0] <= 1
+    assert 15 + 4 <= fired[4] <= 15 + 8
+
+
+def test_consistent_transmissions_suppress():
+    clock = _Clock()
+    timer, fired = _timer(clock, k=1)
+    timer.start()
+    timer.hear_consistent()
+    clock.run(1)
+    assert fired == []
+    assert timer.counters['suppressed'] == 1
+    # The counter is reset with each interval
+    clock.run(3)
+    assert len(fired) == 1
+
+
+def test_reset_restarts_with_imin():
+    clock = _Clock()
+    timer, fired = _timer(clock)
+    timer.start()
+    timer.reset()
+    # Already the minimum interval
+    assert timer.counters['resets'] == 0
+    clock.run(7)
+    assert timer.interval == 8
+    timer.reset()
+    assert timer.interval == 1
+    assert timer.counters['resets'] == 1
+    clock.run(8)
+    assert len(fired) == 4
+
+
+def test_limit_applies_from_next_interval():
+    clock = _Clock()
+    timer, fired = _timer(clock)
+    timer.start()
+    clock.run(7)
+    assert timer.interval == 8
+    timer.limit(1)
+    clock.run(15)
+    assert timer.interval == 2
+    timer.limit()
+    clock.run(17)
+    assert timer.interval == 4
+
+
+def test_stop_cancels_events():
+    clock = _Clock()
+    timer, fired = _timer(clock)
+    timer.start()
+    timer.stop()
+    assert not timer.is_running
+    assert clock.scheduler.empty()
+    clock.run(10)
+    assert fired == []